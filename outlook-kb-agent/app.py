@@ -1,30 +1,56 @@
 # app.py — UI web local pentru kb_mail.py (FastAPI)
 # Rulare din app: uvicorn app:app --port 8000
 # URL: http://127.0.0.1:8000/
+# Echipă / server: UI_SERVER_MODE=1 UI_STORE_PATH=.ui_store.sqlite3 uvicorn app:app --host 0.0.0.0 --workers 4
+#
+# .env (opțional):
+#   DEFAULT_LOGIN=ana@firma.ro    # precompletat în formulare (altfel ultimul login folosit în browser)
+#   UI_SERVER_MODE=0              # 1 => fără Stop server, login device code, fiecare sesiune își dovedește contul
 
 from fastapi import FastAPI, Form, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from typing import Optional
-import html, os, signal, threading, time
+import asyncio, hashlib, html, json, logging, os, re, signal, threading, time, uuid
 
 from kb_mail import (
+    BACKGROUND,
+    BASE_DIR,
+    SEARCH_MODES,
     acquire_token_public,
-    fetch_last_messages,
-    search_messages,
+    file_lock,
+    get_auth,
+    graph_priority,
     extract_participants,
-    generate_summary_and_reply,
-    generate_search_summary_and_reply,
-    create_reply_draft,
-    graph_get,
     TZ_NAME,
 )
+from kb_async import (
+    afetch_last_messages,
+    asearch_messages,
+    astream_summary_and_reply,
+    astream_search_summary_and_reply,
+    acreate_reply_drafts,
+    aacquire_token,
+    get_allm,
+    agraph_me,
+    close_async_transport,
+)
+from conversations import group_by_conversation
+from ui_store import get_ui_store
+import metrics
 
 APP_TITLE = "Outlook KB — UI local"
-DEFAULT_LOGIN = "laurentiu@omnia.capital"
+DEFAULT_LOGIN = os.getenv("DEFAULT_LOGIN", "")
 DEFAULT_LAST = 5
 DEFAULT_TONE = "brief-firm"
 
+MAIL_SYNC_INTERVAL = int(os.getenv("MAIL_SYNC_INTERVAL", "0"))  # secunde; 0 => fără sync în background
+UI_SERVER_MODE = os.getenv("UI_SERVER_MODE", "0").lower() not in ("0", "false", "no", "")
+SESSION_COOKIE, LOGIN_COOKIE = "kb_session", "kb_login"
+COOKIE_MAX_AGE = 30 * 86400
+RE_SESSION = re.compile(r"[0-9a-f]{32}")
+
 app = FastAPI(title=APP_TITLE)
+log = logging.getLogger("uvicorn.error")
 
 BASE_CSS = """
 <style>
@@ -54,16 +80,20 @@ BASE_CSS = """
 </style>
 """
 
-HOME_HTML = f"""
+STOP_FORM = "" if UI_SERVER_MODE else """
+    <form class="inline-form" method="post" action="/shutdown" onsubmit="return confirm('Închizi UI-ul?');">
+      <button class="danger" type="submit">Stop server</button>
+    </form>"""
+
+def home_html(login: str = "") -> str:
+    return f"""
 <!doctype html><meta charset="utf-8"><title>{APP_TITLE}</title>
 {BASE_CSS}
 <header>
   <h1>{APP_TITLE}</h1>
   <div class="right">
-    <span class="muted">local-only • token cache în .token_cache.json</span>
-    <form class="inline-form" method="post" action="/shutdown" onsubmit="return confirm('Închizi UI-ul?');">
-      <button class="danger" type="submit">Stop server</button>
-    </form>
+    <a class="muted" href="/correspondents">Corespondenți</a>
+    <span class="muted">{"server" if UI_SERVER_MODE else "local-only"} • un token cache per cont</span>{STOP_FORM}
   </div>
 </header>
 
@@ -71,7 +101,7 @@ HOME_HTML = f"""
   <form method="post" action="/run">
     <h3>Summarize & Draft (by Sender/Domain)</h3>
     <fieldset>
-      <div class="row"><label>Login (MSA)</label><input type="text" name="login" value="{html.escape(DEFAULT_LOGIN)}" required></div>
+      <div class="row"><label>Login (MSA)</label><input type="text" name="login" value="{html.escape(login)}" required></div>
       <div class="row">
         <label>Mod</label>
         <div style="display:flex; gap:16px; align-items:center;">
@@ -79,7 +109,7 @@ HOME_HTML = f"""
           <label><input type="radio" name="mode" value="sender"> Sender</label>
         </div>
       </div>
-      <div class="row"><label>Valoare</label><input type="text" name="value" placeholder="firma.com sau ana@firma.com" required></div>
+      <div class="row"><label>Valoare</label><input type="text" name="value" placeholder="firma.com sau ana@firma.com" list="correspondents" autocomplete="off" required></div>
       <div class="row"><label>Ultimele</label><input type="number" name="last" value="{DEFAULT_LAST}" min="1" max="50"></div>
       <div class="row"><label>Ultimele N zile</label><input type="number" name="days" placeholder="ex: 30 (opțional)" min="1"></div>
       <div class="row"><label>Tone</label>
@@ -92,6 +122,8 @@ HOME_HTML = f"""
       </div>
       <div class="row"><label>Propune slot (opțional)</label><input type="text" name="slot" placeholder="Thu 14:00-15:00 Europe/Bucharest"></div>
       <div class="row"><label>Creează draft reply</label><label><input type="checkbox" name="create_draft" checked> da</label></div>
+      <div class="row"><label>Ignoră cache LLM</label><label><input type="checkbox" name="no_cache"> regenerează</label></div>
+      <div class="row"><label>Doar noutăți</label><label><input type="checkbox" name="since_last"> de la ultimul summary</label></div>
     </fieldset>
     <div class="actions"><button class="primary" type="submit">Run</button></div>
   </form>
@@ -99,8 +131,16 @@ HOME_HTML = f"""
   <form method="post" action="/search">
     <h3>Search (by keyword/phrase)</h3>
     <fieldset>
-      <div class="row"><label>Login (MSA)</label><input type="text" name="login" value="{html.escape(DEFAULT_LOGIN)}" required></div>
+      <div class="row"><label>Login (MSA)</label><input type="text" name="login" value="{html.escape(login)}" required></div>
       <div class="row"><label>Fraza/Cuvinte</label><input type="text" name="q" placeholder="ex: contract cadru, oferta 12.3k, deadline vineri" required></div>
+      <div class="row"><span></span><span class="muted">Cu store local: "frază exactă", from:firma.com, subject:oferta, after:2024-01-31, before:2024-03-01</span></div>
+      <div class="row"><label>Mod</label>
+        <select name="mode">
+          <option value="keyword" selected>keyword (Graph $search / FTS)</option>
+          <option value="semantic">semantic (index local)</option>
+          <option value="hybrid">hybrid (semantic + keyword)</option>
+        </select>
+      </div>
       <div class="row"><label>Max rezultate</label><input type="number" name="last" value="20" min="1" max="100"></div>
       <div class="row"><label>Ultimele N zile</label><input type="number" name="days" placeholder="ex: 60 (opțional)" min="1"></div>
       <div class="row"><label>Tone</label>
@@ -112,10 +152,39 @@ HOME_HTML = f"""
         </select>
       </div>
       <div class="row"><label>Creează draft reply</label><label><input type="checkbox" name="create_draft" checked> da</label></div>
+      <div class="row"><label>Ignoră cache LLM</label><label><input type="checkbox" name="no_cache"> regenerează</label></div>
     </fieldset>
     <div class="actions"><button class="primary" type="submit">Search</button></div>
   </form>
 </div>
+<datalist id="correspondents"></datalist>
+{SUGGEST_JS}
+"""
+
+# autocomplete pentru "Valoare": adresele/domeniile din indexul de corespondenți, cele mai active primele
+SUGGEST_JS = """
+<script>
+(() => {
+  const form = document.querySelector("form[action='/run']"), input = form.elements.namedItem("value");
+  const list = document.getElementById("correspondents");
+  let timer, last = "";
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    timer = setTimeout(async () => {
+      const kind = form.elements.mode.value === "sender" ? "address" : "domain";
+      const q = new URLSearchParams({login: form.elements.login.value, kind, prefix: input.value.trim()});
+      if (!input.value.trim() || q.toString() === last) return;
+      last = q.toString();
+      const r = await fetch("/correspondents/suggest?" + q);
+      if (!r.ok) return;
+      list.replaceChildren(...(await r.json()).map(c => {
+        const o = document.createElement("option");
+        o.value = c.value; o.label = `${c.name ? c.name + " • " : ""}${c.messages} mesaje`; return o;
+      }));
+    }, 150);
+  });
+})();
+</script>
 """
 
 RESULT_TPL = """
@@ -124,10 +193,7 @@ RESULT_TPL = """
 <header>
   <h1>{title}</h1>
   <div class="right">
-    <a class="muted" href="/">← Înapoi</a>
-    <form class="inline-form" method="post" action="/shutdown" onsubmit="return confirm('Închizi UI-ul?');">
-      <button class="danger" type="submit">Stop server</button>
-    </form>
+    <a class="muted" href="/">← Înapoi</a>{stop}
   </div>
 </header>
 <div class="card mono">{me_line}</div>
@@ -135,15 +201,252 @@ RESULT_TPL = """
 """
 
 def render_page(body_html: str, me_line: str = "", title: str = APP_TITLE) -> HTMLResponse:
-    return HTMLResponse(RESULT_TPL.format(title=html.escape(title), css=BASE_CSS, me_line=me_line, body=body_html))
+    return HTMLResponse(RESULT_TPL.format(title=html.escape(title), css=BASE_CSS, stop=STOP_FORM, me_line=me_line, body=body_html))
+
+def form_login(request: Request) -> str:
+    return request.cookies.get(LOGIN_COOKIE) or DEFAULT_LOGIN
+
+@app.middleware("http")
+async def session_cookie(request: Request, call_next):
+    """Fiecare browser are o sesiune (cookie kb_session): joburile ei și, în UI_SERVER_MODE, conturile dovedite."""
+    sid = request.cookies.get(SESSION_COOKIE)
+    fresh = not (sid and RE_SESSION.fullmatch(sid))
+    request.state.session = uuid.uuid4().hex if fresh else sid
+    response = await call_next(request)
+    if fresh:
+        response.set_cookie(SESSION_COOKIE, request.state.session, max_age=COOKIE_MAX_AGE, httponly=True, samesite="lax")
+    return response
 
 @app.get("/", response_class=HTMLResponse)
-def home():
-    return HTMLResponse(HOME_HTML)
+def home(request: Request):
+    return HTMLResponse(home_html(form_login(request)))
+
+async def me_line_for(token: str, login: str) -> str:
+    try:
+        me = await agraph_me(token, login)
+        return f"[ME] {html.escape(me.get('userPrincipalName',''))} • {html.escape(me.get('mail','') or '')} • id={html.escape(me.get('id',''))}"
+    except Exception as e:
+        return f'<span class="warn">[WARN] /me failed: {html.escape(str(e))}</span>'
+
+async def draft_link_html(token: str, message_id: str, draft_html: str) -> str:
+    # createReply cu body inclus întoarce direct webLink: un singur round-trip
+    try:
+        d = (await acreate_reply_drafts(token, [(message_id, draft_html)]))[0]
+    except Exception as e:
+        return f'<p class="err">Eroare la creare draft: {html.escape(str(e))}</p>'
+    if d["error"]:
+        return f'<p class="err">Eroare la creare draft: {html.escape(d["error"])}</p>'
+    link = d["webLink"]
+    return f'<p class="ok">Draft creat: <a href="{html.escape(link)}">{html.escape(link)}</a></p>' if link else '<p class="warn">Draft creat, dar fără webLink.</p>'
+
+# ------- Jobs: fetch → curățare → summary → draft în background, progres prin SSE -------
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))   # job-uri care rulează simultan; restul așteaptă la coadă
+JOB_TTL = int(os.getenv("JOB_TTL", "900"))         # secunde cât un job terminat rămâne disponibil (refresh, alt tab)
+
+class Job:
+    """
+    Un /run sau /search în execuție. Evenimentele (fragmente HTML pentru "me" sau "body") se păstrează toate,
+    astfel încât orice client SSE — inclusiv după refresh — primește de la început tot ce s-a produs.
+    Cu UI_STORE_PATH se scriu și în ui_store, pentru SSE-ul servit de alt worker (ui_store.JobView).
+    """
+    def __init__(self, key, title, session=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.key, self.title, self.session = key, title, session
+        self.events = []
+        self.done_at = None
+        self.trace = None   # metrics.Trace cu METRICS_TRACE=1
+        self.changed = asyncio.Event()
+
+    def _push(self, ev):
+        self.events.append(ev)
+        if _ui_store.shared: _ui_store.append(self.id, ev)
+        self.changed.set(); self.changed = asyncio.Event()
+
+    def emit(self, target, html_part, event="part"):
+        self._push({"event": event, "target": target, "html": html_part})
+
+    def emit_text(self, el_id, text):
+        """Text adăugat la elementul el_id (summary-ul streamuit de LLM)."""
+        self._push({"event": "part", "target": "text", "id": el_id, "text": text})
+
+    def finish(self, html_part=""):
+        self.done_at = time.time()
+        self.emit("body", html_part, event="done")
+        if _ui_store.shared: _ui_store.finish(self.id, self.trace_data())
+
+    def events_from(self, i) -> list:
+        return self.events[i:]
+
+    async def wait(self, i, timeout) -> bool:
+        """Așteaptă evenimente după indexul i; False la timeout."""
+        if len(self.events) > i: return True
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout); return True
+        except asyncio.TimeoutError:
+            return False
+
+    def trace_data(self):
+        return self.trace.to_dict() if self.trace else None
+
+_jobs = {}       # id -> Job
+_inflight = {}   # cheie cerere -> Job încă în lucru (dedupe)
+_job_slots = asyncio.Semaphore(JOB_WORKERS)
+_ui_store = get_ui_store()
+
+def submit_job(key, title, pipeline, params, session=None):
+    """
+    Job nou pentru (cheie, parametri), sau jobul identic deja în lucru — două cereri la fel împart o execuție,
+    și între workeri (UI_STORE_PATH): atunci se întoarce un JobView al jobului din celălalt worker.
+    """
+    now = time.time()
+    for jid in [j for j, job in _jobs.items() if job.done_at and now - job.done_at > JOB_TTL]:
+        del _jobs[jid]
+    if (job := _inflight.get(key)) is not None:
+        return job
+    job = Job(key, title, session)
+    if _ui_store.shared:
+        _ui_store.purge(JOB_TTL)
+        if (other := _ui_store.claim(job.id, key, title, session)) != job.id:
+            return _ui_store.view(other)
+    _jobs[job.id] = _inflight[key] = job
+    asyncio.get_running_loop().create_task(_run_job(job, pipeline, params))
+    return job
+
+async def _run_job(job, pipeline, params):
+    if metrics.METRICS_TRACE:
+        job.trace, _ = metrics.start_trace(job.title, job_id=job.id)   # task propriu => contextul nu iese din job
+    if _job_slots.locked():
+        job.emit("body", "<p class='muted' data-transient>În coadă…</p>")
+    try:
+        async with _job_slots:
+            with metrics.span("job", kind=pipeline.__name__.removesuffix("_pipeline")):
+                await pipeline(job, **params)
+        job.finish(trace_link(job))
+    except Exception as e:
+        log.exception("[job %s] eșuat", job.id)
+        job.finish(f'<p class="err">Eroare: {html.escape(str(e))}</p>' + trace_link(job))
+    finally:
+        _inflight.pop(job.key, None)
+
+def trace_link(job) -> str:
+    if job.trace is None: return ""
+    return f"<p class='muted'><a href='/jobs/{job.id}/trace'>trace</a> · {job.trace.to_dict()['elapsed_ms']:.0f} ms</p>"
+
+STREAM_FLUSH = 0.1   # secunde: fragmentele de summary se trimit grupat, nu token cu token
+
+async def stream_summary(job, title, events):
+    """
+    Cardul Summary apare imediat, iar textul lui crește pe măsură ce modelul îl generează.
+    Întoarce {summary, draft_html} după ultimul fragment.
+    """
+    el_id = f"summary-{job.id}"
+    job.emit("body", f"<div class='card'><h3>{title}</h3><pre id='{el_id}'></pre></div>")
+    buf, last = [], time.monotonic()
+    async for k, v in events:
+        if k is None: data = v; break
+        if k != "summary": continue
+        buf.append(v)
+        if time.monotonic() - last >= STREAM_FLUSH:
+            job.emit_text(el_id, "".join(buf)); buf, last = [], time.monotonic()
+    if buf: job.emit_text(el_id, "".join(buf))
+    return data
+
+def job_key(kind, params, session=None) -> str:
+    """Cheia de dedupe; în UI_SERVER_MODE și per sesiune (alt utilizator nu primește rezultatul altcuiva)."""
+    scope = [kind, params, session] if UI_SERVER_MODE else [kind, params]
+    return hashlib.sha256(json.dumps(scope, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def job_response(request: Request, job, login=""):
+    """Clienții API primesc {job_id}; formularul HTML e redirecționat la pagina jobului (refresh-safe)."""
+    if "application/json" in request.headers.get("accept", ""):
+        response = JSONResponse({"job_id": job.id, "events": f"/jobs/{job.id}/events"}, status_code=202)
+    else:
+        response = RedirectResponse(f"/jobs/{job.id}", status_code=303)
+    if login.strip():   # precompletat data viitoare în formulare
+        response.set_cookie(LOGIN_COOKIE, login.strip(), max_age=COOKIE_MAX_AGE, samesite="lax")
+    return response
+
+def _find_job(job_id, request: Request):
+    """Jobul din acest worker sau, cu UI_STORE_PATH, din altul; în UI_SERVER_MODE doar al sesiunii care l-a pornit."""
+    job = _jobs.get(job_id) or (_ui_store.view(job_id) if _ui_store.shared else None)
+    if job is not None and UI_SERVER_MODE and job.session != request.state.session: return None
+    return job
+
+async def job_token(job, login) -> str:
+    """
+    Token-ul contului pentru job. Cu AUTH_FLOW=device_code, URL-ul și codul de login apar în pagina jobului.
+    În UI_SERVER_MODE o sesiune folosește un cont doar după ce s-a autentificat o dată cu el în UI
+    (login forțat, chiar dacă alt coleg a lăsat deja token-ul contului în cache).
+    """
+    if UI_SERVER_MODE and not login.strip():
+        raise ValueError("Login-ul e obligatoriu în UI_SERVER_MODE")
+    loop = asyncio.get_running_loop()
+    def on_device_code(message):   # din thread-ul MSAL
+        loop.call_soon_threadsafe(job.emit, "body", f"<div class='card'><h3>Login necesar</h3><p>{html.escape(message)}</p></div>")
+    force = UI_SERVER_MODE and not _ui_store.allowed(job.session, login)
+    token = await aacquire_token(login, on_device_code=on_device_code, force=force)
+    if force: _ui_store.allow(job.session, login)
+    return token
+
+JOB_JS = """
+<script>
+const box = document.getElementById("job-body"), me = document.getElementById("job-me");
+const src = new EventSource("/jobs/%s/events");
+function part(ev) {
+  const d = JSON.parse(ev.data);
+  box.querySelectorAll("[data-transient]").forEach(n => n.remove());
+  if (d.target === "text") document.getElementById(d.id).append(d.text);
+  else if (d.target === "me") me.innerHTML = d.html; else box.insertAdjacentHTML("beforeend", d.html);
+}
+src.addEventListener("part", part);
+src.addEventListener("done", ev => { part(ev); src.close(); });
+</script>
+"""
 
 # ------- Summarize & Draft (by sender/domain) -------
-@app.post("/run", response_class=HTMLResponse)
-def run(
+async def run_pipeline(job, login, mode, value, last_int, days_int, tone, slot, create_draft, use_cache, since_last=False):
+    token = await job_token(job, login)
+
+    val = value.strip()
+    if not val:
+        job.emit("me", await me_line_for(token, login))
+        job.emit("body", '<p class="err">Valoarea e goală.</p>'); return
+
+    who = {"sender": val} if mode == "sender" else {"domain": val}
+    label = f"{'Sender' if mode == 'sender' else 'Domain'}: {html.escape(val)}"; hint = val
+    # /me și căutarea mesajelor sunt independente => în paralel
+    if since_last:
+        from watermarks import afresh_since_last, astream_since_last, capped
+        me_line, (wm_key, wm, msgs) = await asyncio.gather(me_line_for(token, login), afresh_since_last(token, top=last_int, days=days_int, **who))
+    else:
+        me_line, msgs = await asyncio.gather(me_line_for(token, login), afetch_last_messages(token, top=last_int, days=days_int, **who))
+    job.emit("me", me_line)
+
+    if not msgs and since_last and wm:
+        job.emit("body", f"<p class='muted'>Nimic nou de la ultimul summary ({html.escape(wm['last_received'])}).</p>"
+                         f"<div class='card'><h3>Summary</h3><pre>{html.escape(wm['summary'])}</pre></div>"); return
+    if not msgs:
+        job.emit("body", f'<p class="warn">Nu am găsit mesaje pentru <b>{label}</b>.</p>'); return
+    if since_last and capped(wm, msgs):
+        job.emit("body", f"<p class='warn'>Doar cele mai noi {len(msgs)} mesaje (SINCE_LAST_MAX): cele mai vechi de la ultimul summary nu intră în actualizare.</p>")
+    job.emit("body", f"<p class='muted' data-transient>{len(msgs)} mesaje {'noi' if since_last else 'găsite'}, se generează summary…</p>")
+
+    try:
+        if since_last:
+            events = astream_since_last(wm_key, wm, msgs, hint=hint, tone=tone, slot=slot or None, use_cache=use_cache)
+        else:
+            events = astream_summary_and_reply(msgs, sender_hint=hint, tone=tone, propose_slot=slot or None, timezone_name=TZ_NAME, use_cache=use_cache)
+        data = await stream_summary(job, "Summary (actualizat)" if since_last and wm else "Summary", events)
+    except Exception as e:
+        job.emit("body", f'<p class="err">LLM a eșuat: {html.escape(str(e))}</p>'); return
+
+    draft_html = data["draft_html"]
+    job.emit("body", f"<div class='card'><h3>Draft</h3>{draft_html}</div>")
+    if create_draft:
+        job.emit("body", f"<div class='card'>{await draft_link_html(token, msgs[0]['id'], draft_html)}</div>")
+
+@app.post("/run")
+async def run(
     request: Request,
     login: str = Form(...),
     mode: str = Form(...),
@@ -153,6 +456,8 @@ def run(
     tone: str = Form(DEFAULT_TONE),
     slot: str = Form(""),
     create_draft: Optional[str] = Form(None),
+    no_cache: Optional[str] = Form(None),
+    since_last: Optional[str] = Form(None),
 ):
     # coercie
     try: last_int = int(last)
@@ -162,51 +467,65 @@ def run(
         try: days_int = int(days)
         except Exception: days_int = None
 
-    token = acquire_token_public(login_hint=login)
-    try:
-        me = graph_get("/me", headers={"Authorization": f"Bearer {token}"}, params={"$select":"userPrincipalName,mail,id,displayName"})
-        me_line = f"[ME] {html.escape(me.get('userPrincipalName',''))} • {html.escape(me.get('mail','') or '')} • id={html.escape(me.get('id',''))}"
-    except Exception as e:
-        me_line = f'<span class="warn">[WARN] /me failed: {html.escape(str(e))}</span>'
+    params = dict(login=login, mode=mode, value=value, last_int=last_int, days_int=days_int, tone=tone, slot=slot,
+                  create_draft=create_draft is not None, use_cache=no_cache is None, since_last=since_last is not None)
+    session = request.state.session
+    job = submit_job(job_key("run", params, session), f"{APP_TITLE} — {value.strip()}", run_pipeline, params, session)
+    return job_response(request, job, login)
 
-    val = value.strip()
-    if not val:
-        return render_page('<p class="err">Valoarea e goală.</p>' + HOME_HTML, me_line)
+# ------- NEW: Search (by keyword/phrase) -------
+async def search_pipeline(job, login, phrase, last_int, days_int, tone, create_draft, use_cache, mode="keyword"):
+    token = await job_token(job, login)
 
-    if mode == "sender":
-        msgs = fetch_last_messages(token, sender=val, top=last_int, days=days_int)
-        hint = val; label = f"Sender: {html.escape(val)}"
-    else:
-        msgs = fetch_last_messages(token, domain=val, top=last_int, days=days_int)
-        hint = val; label = f"Domain: {html.escape(val)}"
+    if not phrase:
+        job.emit("me", await me_line_for(token, login))
+        job.emit("body", '<p class="err">Fraza de căutare e goală.</p>'); return
+    job.emit("body", f"<div class='card'><h3>Search query <span class='muted'>({html.escape(mode)})</span></h3><div class='mono'>{html.escape(phrase)}</div></div>")
+
+    # 1) /me + căutare mesaje, în paralel
+    me_line, (msgs, err) = await asyncio.gather(me_line_for(token, login), _settle(asearch_messages(token, phrase=phrase, top=last_int, days=days_int, mode=mode)))
+    job.emit("me", me_line)
+    if err is not None:
+        job.emit("body", f'<p class="err">Eroare la căutare: {html.escape(str(err))}</p>'); return
 
     if not msgs:
-        return render_page(f'<p class="warn">Nu am găsit mesaje pentru <b>{label}</b>.</p>' + HOME_HTML, me_line)
+        job.emit("body", f'<p class="warn">Nu am găsit mesaje pentru <b>{html.escape(phrase)}</b>.</p>'); return
+
+    # 2) participanți unici + 3) timeline pe fire: gata înaintea LLM-ului, se trimit imediat
+    participants = extract_participants(msgs)
+    participants_html = "<ul>" + "".join(f"<li>{html.escape(a)}</li>" for a in participants) + "</ul>"
+    timeline_html = "".join(
+        f"<details open><summary><b>{html.escape(t['subject'] or '(fără subiect)')}</b> "
+        f"<span class='muted'>— {len(t['messages'])} mesaje, ultimul {html.escape(t['latest'])}</span></summary><ol>"
+        + "".join(
+            f"<li>{html.escape(m.get('receivedDateTime',''))} — <span class='mono'>{html.escape((m.get('from') or {}).get('emailAddress',{}).get('address','') or '')}</span> — {html.escape(m.get('subject','') or '')}</li>"
+            for m in t["messages"]
+        ) + "</ol></details>"
+        for t in group_by_conversation(msgs)
+    )
+    job.emit("body", f"<div class='card'><h3>Participanți</h3>{participants_html}</div>")
+    job.emit("body", f"<div class='card'><h3>Timeline</h3>{timeline_html}</div>")
+    job.emit("body", "<p class='muted' data-transient>Se generează summary…</p>")
 
+    # 4) summary focalizat pe căutare + draft
     try:
-        summary_md, draft_html = generate_summary_and_reply(msgs, sender_hint=hint, tone=tone, propose_slot=slot or None, timezone_name=TZ_NAME)
+        data = await stream_summary(job, "Summary (focus pe căutare)", astream_search_summary_and_reply(msgs, query=phrase, tone=tone, timezone_name=TZ_NAME, use_cache=use_cache))
     except Exception as e:
-        return render_page(f'<p class="err">LLM a eșuat: {html.escape(str(e))}</p>' + HOME_HTML, me_line)
+        job.emit("body", f'<p class="err">LLM a eșuat: {html.escape(str(e))}</p>'); return
+    draft_html = data["draft_html"]
+    job.emit("body", f"<div class='card'><h3>Draft</h3>{draft_html}</div>")
 
-    web_link_html = ""
-    if create_draft is not None:
-        try:
-            newest_id = msgs[0]["id"]
-            draft_id = create_reply_draft(token, newest_id, draft_html)
-            link = graph_get(f"/me/messages/{draft_id}", headers={"Authorization": f"Bearer {token}"}, params={"$select":"webLink"}).get("webLink")
-            web_link_html = f'<p class="ok">Draft creat: <a href="{html.escape(link or "")}">{html.escape(link or "")}</a></p>' if link else '<p class="warn">Draft creat, dar fără webLink.</p>'
-        except Exception as e:
-            web_link_html = f'<p class="err">Eroare la creare draft: {html.escape(str(e))}</p>'
-
-    # afișare
-    summary_block = f"<div class='card'><h3>Summary</h3><pre>{html.escape(summary_md)}</pre></div>"
-    draft_block = f"<div class='card'><h3>Draft</h3>{draft_html}</div>"
-    body = summary_block + draft_block + (f"<div class='card'>{web_link_html}</div>" if web_link_html else "")
-    return render_page(body, me_line)
+    # 5) creare draft (opțional) — reply la cel mai nou mesaj găsit
+    if create_draft:
+        job.emit("body", f"<div class='card'>{await draft_link_html(token, msgs[0]['id'], draft_html)}</div>")
 
-# ------- NEW: Search (by keyword/phrase) -------
-@app.post("/search", response_class=HTMLResponse)
-def search(
+async def _settle(coro):
+    """(rezultat, None) sau (None, excepție) — ca un gather să nu piardă /me când căutarea eșuează."""
+    try: return await coro, None
+    except Exception as e: return None, e
+
+@app.post("/search")
+async def search(
     request: Request,
     login: str = Form(...),
     q: str = Form(...),
@@ -214,78 +533,198 @@ def search(
     days: str = Form(""),
     tone: str = Form(DEFAULT_TONE),
     create_draft: Optional[str] = Form(None),
+    no_cache: Optional[str] = Form(None),
+    mode: str = Form("keyword"),
 ):
     # coercie
     try: last_int = int(last)
     except Exception: last_int = 20
+    if mode not in SEARCH_MODES: mode = "keyword"
     days_int = None
     if days.strip():
         try: days_int = int(days)
         except Exception: days_int = None
 
-    token = acquire_token_public(login_hint=login)
-    try:
-        me = graph_get("/me", headers={"Authorization": f"Bearer {token}"}, params={"$select":"userPrincipalName,mail,id,displayName"})
-        me_line = f"[ME] {html.escape(me.get('userPrincipalName',''))} • {html.escape(me.get('mail','') or '')} • id={html.escape(me.get('id',''))}"
-    except Exception as e:
-        me_line = f'<span class="warn">[WARN] /me failed: {html.escape(str(e))}</span>'
+    params = dict(login=login, phrase=q.strip(), last_int=last_int, days_int=days_int, tone=tone,
+                  create_draft=create_draft is not None, use_cache=no_cache is None, mode=mode)
+    session = request.state.session
+    job = submit_job(job_key("search", params, session), f"{APP_TITLE} — Search", search_pipeline, params, session)
+    return job_response(request, job, login)
 
-    phrase = q.strip()
-    if not phrase:
-        return render_page('<p class="err">Fraza de căutare e goală.</p>' + HOME_HTML, me_line)
+# ------- Job page + SSE -------
+@app.get("/jobs/{job_id}", response_class=HTMLResponse)
+def job_page(job_id: str, request: Request):
+    job = _find_job(job_id, request)
+    if job is None:
+        return render_page('<p class="warn">Jobul nu mai există (expirat sau server repornit).</p>' + home_html(form_login(request)))
+    body = f"<div id='job-body'><p class='muted' data-transient>Se lucrează…</p></div>" + JOB_JS % job.id
+    return render_page(body, "<span id='job-me'></span>", title=job.title)
 
-    # 1) căutare mesaje
-    try:
-        msgs = search_messages(token, phrase=phrase, top=last_int, days=days_int)
-    except Exception as e:
-        return render_page(f'<p class="err">Eroare la căutare: {html.escape(str(e))}</p>' + HOME_HTML, me_line)
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    SSE: toate evenimentele jobului de la început (sau de după Last-Event-ID la reconectarea automată),
+    apoi cele noi pe măsură ce apar; fluxul se închide după evenimentul "done".
+    """
+    job = _find_job(job_id, request)
+    if job is None:
+        return JSONResponse({"error": "job inexistent"}, status_code=404)
+    try: start = int(request.headers.get("last-event-id", "-1")) + 1
+    except ValueError: start = 0
 
-    if not msgs:
-        return render_page(f'<p class="warn">Nu am găsit mesaje pentru <b>{html.escape(phrase)}</b>.</p>' + HOME_HTML, me_line)
+    async def stream():
+        i = start
+        while True:
+            for ev in job.events_from(i):
+                yield f"id: {i}\nevent: {ev['event']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+                if ev["event"] == "done": return
+                i += 1
+            if not await job.wait(i, 15):
+                yield ": keep-alive\n\n"
 
-    # 2) participanți unici
-    participants = extract_participants(msgs)
-    participants_html = "<ul>" + "".join(f"<li>{html.escape(a)}</li>" for a in participants) + "</ul>"
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    # 3) timeline (cele mai noi primele)
-    timeline_html = "<ol>" + "".join(
-        f"<li>{html.escape(m.get('receivedDateTime',''))} — <span class='mono'>{html.escape((m.get('from') or {}).get('emailAddress',{}).get('address','') or '')}</span> — {html.escape(m.get('subject','') or '')}</li>"
-        for m in msgs
-    ) + "</ol>"
+# ------- Corespondenți (correspondents.py) -------
+def _correspondents_for(request: Request, login: str):
+    """(index, eroare HTML, status): în UI_SERVER_MODE doar conturile dovedite de sesiune."""
+    from correspondents import get_correspondents
+    if UI_SERVER_MODE and not _ui_store.allowed(request.state.session, login):
+        return None, '<p class="warn">Autentifică-te o dată cu acest cont (Run/Search) ca să-i vezi corespondenții.</p>', 403
+    index = get_correspondents(login.strip() or None)
+    if index is None: return None, '<p class="muted">Indexul de corespondenți e dezactivat (CORRESPONDENTS_PATH gol).</p>', 200
+    return index, "", 200
 
-    # 4) summary focalizat pe căutare + draft
-    try:
-        summary_md, draft_html = generate_search_summary_and_reply(msgs, query=phrase, tone=tone, timezone_name=TZ_NAME)
-    except Exception as e:
-        return render_page(f'<p class="err">LLM a eșuat: {html.escape(str(e))}</p>' + HOME_HTML, me_line)
+def _ago(seconds) -> str:
+    if seconds is None: return "—"
+    if seconds < 3600: return f"{seconds / 60:.0f} min"
+    if seconds < 2 * 86400: return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} zile"
 
-    # 5) creare draft (opțional) — reply la cel mai nou mesaj găsit
-    web_link_html = ""
-    if create_draft is not None:
-        try:
-            newest_id = msgs[0]["id"]
-            draft_id = create_reply_draft(token, newest_id, draft_html)
-            link = graph_get(f"/me/messages/{draft_id}", headers={"Authorization": f"Bearer {token}"}, params={"$select":"webLink"}).get("webLink")
-            web_link_html = f'<p class="ok">Draft creat: <a href="{html.escape(link or "")}">{html.escape(link or "")}</a></p>' if link else '<p class="warn">Draft creat, dar fără webLink.</p>'
-        except Exception as e:
-            web_link_html = f'<p class="err">Eroare la creare draft: {html.escape(str(e))}</p>'
-
-    # out
-    blocks = []
-    blocks.append(f"<div class='card'><h3>Search query</h3><div class='mono'>{html.escape(phrase)}</div></div>")
-    blocks.append(f"<div class='card'><h3>Summary (focus pe căutare)</h3><pre>{html.escape(summary_md)}</pre></div>")
-    blocks.append(f"<div class='card'><h3>Participanți</h3>{participants_html}</div>")
-    blocks.append(f"<div class='card'><h3>Timeline</h3>{timeline_html}</div>")
-    blocks.append(f"<div class='card'><h3>Draft</h3>{draft_html}</div>")
-    if web_link_html:
-        blocks.append(f"<div class='card'>{web_link_html}</div>")
-
-    return render_page("".join(blocks), me_line, title=f"{APP_TITLE} — Search")
+def _day(iso) -> str:
+    return html.escape((iso or "—")[:10])
+
+def _correspondents_table(rows, login, domains=False) -> str:
+    if not rows: return '<p class="muted">Nimic în index încă (Run/Search sau sync-ul store-ului îl populează).</p>'
+    head = ("<tr><th align='left'>" + ("Domeniu" if domains else "Adresă") + "</th><th>Mesaje</th><th>De la ei</th><th>De la noi</th>"
+            "<th>Fire</th><th>Prima</th><th>Ultima</th><th>Răspundem în</th><th>Ne răspund în</th></tr>")
+    body = "".join(
+        f"<tr><td><a href='/correspondents?login={html.escape(login)}&q={html.escape(r['key'])}'>{html.escape(r['key'])}</a>"
+        + (f" <span class='muted'>{html.escape(r['name'])}</span>" if r["name"] else "")
+        + f"</td><td align='right'>{r['messages']}</td><td align='right'>{r['received']}</td><td align='right'>{r['sent']}</td>"
+        f"<td align='right'>{r['threads']}</td><td>{_day(r['first_seen'])}</td><td>{_day(r['last_seen'])}</td>"
+        f"<td align='right'>{_ago(r['our_reply_avg_s'])}</td><td align='right'>{_ago(r['their_reply_avg_s'])}</td></tr>"
+        for r in rows)
+    return f"<table class='mono' style='width:100%; border-collapse:collapse'>{head}{body}</table>"
+
+@app.get("/correspondents", response_class=HTMLResponse)
+def correspondents_page(request: Request, login: str = "", q: str = ""):
+    """Panoul de corespondenți: statisticile unei adrese/unui domeniu, altfel cei mai activi corespondenți."""
+    login, q = (login or form_login(request)).strip(), q.strip()
+    form = (f"<form method='get' action='/correspondents'><fieldset>"
+            f"<div class='row'><label>Login (MSA)</label><input type='text' name='login' value='{html.escape(login)}'></div>"
+            f"<div class='row'><label>Adresă sau domeniu</label><input type='text' name='q' value='{html.escape(q)}' "
+            f"placeholder='ana@firma.com sau firma.com (gol = top)'></div></fieldset>"
+            f"<div class='actions'><button class='primary' type='submit'>Caută</button></div></form>")
+    index, err, status = _correspondents_for(request, login)
+    if index is None:
+        page = render_page(form + err, title="Corespondenți"); page.status_code = status; return page
+    if not q:
+        st = index.stats()
+        body = (f"<div class='card'><h3>Cei mai activi corespondenți</h3>{_correspondents_table(index.top(), login)}</div>"
+                f"<div class='card'><h3>Domenii</h3>{_correspondents_table(index.top_domains(), login, domains=True)}</div>")
+        return render_page(form + body, f"{st['messages']} mesaje indexate • {st['addresses']} adrese • {st['domains']} domenii", title="Corespondenți")
+    r = index.lookup(q)
+    if r is None:
+        return render_page(form + f'<p class="warn">Nu am date despre <b>{html.escape(q)}</b>.</p>', title="Corespondenți")
+    domain = r["kind"] == "domain"
+    last_in = f"<p class='muted'>Ultimul mesaj de la ei: {_day(r['last_received'])}</p>" if r["last_received"] else ""
+    body = f"<div class='card'><h3>{html.escape(r['key'])}</h3>{_correspondents_table([r], login, domains=domain)}{last_in}</div>"
+    if domain:
+        body += f"<div class='card'><h3>Adrese la {html.escape(r['key'])}</h3>{_correspondents_table(index.top(domain=r['key']), login)}</div>"
+    return render_page(form + body, title=f"Corespondenți — {r['key']}")
+
+@app.get("/correspondents/suggest")
+def correspondents_suggest(request: Request, login: str = "", prefix: str = "", kind: str = "address", limit: int = 10):
+    """Autocomplete pentru câmpurile sender/domeniu: [{value, name, messages}]."""
+    if kind not in ("address", "domain"): kind = "address"
+    index, _, status = _correspondents_for(request, login)
+    if index is None: return JSONResponse([], status_code=status)
+    return JSONResponse([{"value": r["key"], "name": r["name"], "messages": r["messages"]}
+                         for r in index.suggest(prefix, kind, max(1, min(limit, 50)))])
+
+# ------- Job trace + metrics -------
+@app.get("/jobs/{job_id}/trace")
+def job_trace(job_id: str, request: Request):
+    job = _find_job(job_id, request)
+    trace = job.trace_data() if job is not None else None
+    if trace is None:
+        return JSONResponse({"error": "trace inexistent (METRICS_TRACE=1 pentru joburile noi)"}, status_code=404)
+    return JSONResponse(trace)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Metricile workerului care răspunde (registry in-process): cu --workers N, fiecare worker are seriile lui."""
+    metrics.gauge("kb_jobs_inflight", len(_inflight))
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ------- LLM cache stats -------
+@app.get("/cache/stats")
+def cache_stats():
+    from llm_cache import get_llm_cache
+    cache = get_llm_cache()
+    return JSONResponse(cache.stats() if cache else {"disabled": True})
+
+# ------- Background sync (store local) -------
+_sync_stop = threading.Event()
+
+def _sync_account(login):
+    from mail_store import get_store
+    # doar token silent: în background nu pornim niciun login
+    token = acquire_token_public(login_hint=login, interactive=False)
+    store = get_store(login)
+    changed = store.sync(token)
+    if changed: log.info("[sync] %s: %s modificări în store-ul local", login or "default", changed)
+    if changed and os.path.exists(store.path + ".vectors"):
+        from semantic import refresh_existing
+        log.info("[sync] %s: %s mesaje vectorizate", login or "default", refresh_existing(store))
+
+def _sync_loop():
+    with graph_priority(BACKGROUND):   # sincronizarea cedează cutia poștală joburilor din UI
+        while not _sync_stop.wait(MAIL_SYNC_INTERVAL):
+            # toate conturile cu token în TOKEN_CACHE_DIR; cu mai mulți workeri, tura o face unul singur
+            with file_lock(str(BASE_DIR / ".sync.lock"), blocking=False) as leader:
+                if not leader: continue
+                for login in get_auth().logins():
+                    try: _sync_account(login)
+                    except Exception as e: log.warning("[sync] %s eșuat: %s", login or "default", e)
+
+@app.on_event("startup")
+def server_mode_auth():
+    if UI_SERVER_MODE and get_auth().flow == "interactive":   # browserul s-ar deschide pe server, nu la utilizator
+        log.warning("[auth] UI_SERVER_MODE: AUTH_FLOW=interactive devine device_code")
+        get_auth().flow = "device_code"
+
+@app.on_event("startup")
+async def warm_llm_client():
+    # SDK-ul OpenAI se încarcă după pornire, într-un thread: nici reloader-ul, nici primul job nu-l așteaptă
+    asyncio.get_running_loop().run_in_executor(None, get_allm)
+
+@app.on_event("startup")
+def start_background_sync():
+    if MAIL_SYNC_INTERVAL > 0:
+        threading.Thread(target=_sync_loop, name="mail-sync", daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_background_sync():
+    _sync_stop.set()
+    await close_async_transport()
 
 # ------- Stop server -------
 @app.post("/shutdown", response_class=HTMLResponse)
-def shutdown():
+def shutdown(request: Request):
+    if UI_SERVER_MODE:
+        return HTMLResponse("<p class='err'>Serverul partajat nu se oprește din UI.</p>", status_code=403)
     def _kill():
         time.sleep(0.2); os.kill(os.getpid(), signal.SIGINT)
     threading.Thread(target=_kill, daemon=True).start()
-    return HTMLResponse("<p class='ok'>Serverul se oprește… Poți închide această fereastră.</p>" + HOME_HTML)
+    return HTMLResponse("<p class='ok'>Serverul se oprește… Poți închide această fereastră.</p>" + home_html(form_login(request)))
@@ -0,0 +1,201 @@
+# bench.py — benchmark offline pentru fluxurile CLI și UI, pe mock_graph + mock_llm (fără rețea externă)
+# Pentru fiecare mărime de cutie poștală măsoară throughput, latența p50/p95 și memoria:
+#   import: pornirea la rece — interpretor nou per iterație: import kb_mail / kb_async / app, kb_mail.py --help,
+#           plus kb_mail cu msal/requests/openai încărcate (costul de dinainte de importurile leneșe)
+#   micro:  trim_email_body, extract_participants (independente de mărimea cutiei)
+#   cli:    fetch_last_messages (expeditor, domeniu + zile), search_messages, summary complet (fetch + LLM)
+#   ui:     POST /run și POST /search + fluxul SSE /jobs/{id}/events până la "done", cu N joburi simultane
+# Memoria = vârful tracemalloc al unei rulări (încălzirea, măsurată separat de timpi) + max RSS al procesului.
+#
+#   python bench/bench.py --sizes 1000,100000,1000000 --iterations 20 --concurrency 8 --json bench.json
+#
+# .env de lângă kb_mail.py se încarcă în continuare; Graph, clientul LLM, token-ul și cache-ul LLM
+# sunt însă redirecționate explicit spre mock-uri după import.
+
+import argparse, asyncio, json, os, resource, subprocess, sys, time, tracemalloc
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path[:0] = [str(HERE.parent), str(HERE)]
+os.environ.setdefault("CLIENT_ID", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import kb_mail, kb_async, llm_cache
+from mock_graph import SENDERS, DOMAINS, Mailbox, start_graph
+from mock_llm import start_llm
+
+LOGIN = "bench@example.com"
+PHRASES = ["contract cadru", "factura", "termen plata", "server migrare", "buget aprobare"]
+
+def configure(graph_base, llm_base, graph_rps=0.0, graph_concurrency=0):
+    """
+    Totul spre mock-uri: Graph, OpenAI sync + async, token în memorie, fără cache LLM. Scheduler-ul Graph
+    (MailboxGate) primește plafonul mock-ului; fără plafon (0) nu limitează nimic.
+    """
+    from openai import AsyncOpenAI, OpenAI
+    kb_mail.GRAPH = graph_base
+    kb_mail.GRAPH_MAILBOX_RPS, kb_mail.GRAPH_MAILBOX_CONCURRENCY = graph_rps, graph_concurrency
+    kb_mail.llm = OpenAI(api_key="bench", base_url=llm_base)
+    kb_async.allm = AsyncOpenAI(api_key="bench", base_url=llm_base)
+    llm_cache.LLM_CACHE_TTL = 0
+    auth = kb_mail.get_auth()
+    for login in (None, LOGIN):
+        auth.tokens[auth._key(login)] = ("bench-token", time.time() + 7 * 86400)
+
+def _pct(values, p):
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))] if s else 0.0
+
+def _rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _row(scenario, size, lat, wall, errors, mem_peak):
+    return {"scenario": scenario, "size": size, "n": len(lat), "errors": errors,
+            "throughput_per_s": round(len(lat) / wall, 2) if wall else 0.0,
+            "p50_ms": round(_pct(lat, 50) * 1000, 2), "p95_ms": round(_pct(lat, 95) * 1000, 2),
+            "mem_peak_kb": round(mem_peak / 1024, 1), "max_rss_mb": _rss_mb()}
+
+def measure(scenario, size, fn, iterations, cold=False):
+    """fn(k) sincron, rulat de `iterations` ori secvențial, după o încălzire sub tracemalloc."""
+    tracemalloc.start()
+    fn(0)
+    mem_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    lat, errors, t0 = [], 0, time.perf_counter()
+    for k in range(iterations):
+        if cold: kb_mail._body_memo.clear()
+        t = time.perf_counter()
+        try: fn(k)
+        except Exception: errors += 1
+        lat.append(time.perf_counter() - t)
+    return _row(scenario, size, lat, time.perf_counter() - t0, errors, mem_peak)
+
+async def ameasure(scenario, size, fn, iterations, concurrency):
+    """fn(k) async, `iterations` apeluri cu cel mult `concurrency` simultane; throughput = apeluri / timp total."""
+    tracemalloc.start()
+    await fn(0)
+    mem_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    slots, lat, errors = asyncio.Semaphore(concurrency), [], [0]
+    async def one(k):
+        async with slots:
+            t = time.perf_counter()
+            try: await fn(k)
+            except Exception: errors[0] += 1
+            lat.append(time.perf_counter() - t)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(k) for k in range(1, iterations + 1)))
+    return _row(scenario, size, lat, time.perf_counter() - t0, errors[0], mem_peak)
+
+# ---------- scenarii ----------
+IMPORT_CASES = [
+    ("import kb_mail", ["-c", "import kb_mail"]),
+    ("import kb_mail+msal+requests+openai", ["-c", "import kb_mail, msal, requests, openai"]),
+    ("import kb_async", ["-c", "import kb_async"]),
+    ("import app", ["-c", "import app"]),
+    ("kb_mail.py --help", ["kb_mail.py", "--help"]),
+]
+
+def import_suite(args):
+    """Fiecare iterație e un proces nou, fără CLIENT_ID/OPENAI_API_KEY (cum pornesc scripturile batch și reloader-ul)."""
+    env = {k: v for k, v in os.environ.items() if k not in ("CLIENT_ID", "OPENAI_API_KEY")}
+    def spawn(argv):
+        return lambda k: subprocess.run([sys.executable, *argv], cwd=HERE.parent, env=env, check=True, capture_output=True)
+    return [measure(name, "-", spawn(argv), args.iterations) for name, argv in IMPORT_CASES]
+
+def micro_suite(args):
+    mb = Mailbox(10000)
+    bodies = [mb.body_html(i) for i in range(200)]
+    msgs = [mb.message(i, kb_mail.LIST_SELECT.split(",")) for i in range(1000)]
+    full = [mb.message(i) for i in range(50)]
+    return [measure("trim_email_body", "-", lambda k: kb_mail.trim_email_body(bodies[k % len(bodies)]), args.iterations * 10),
+            measure("extract_participants[1000]", "-", lambda k: kb_mail.extract_participants(msgs), args.iterations),
+            measure("prompt_build[50]", "-", lambda k: kb_mail.emails_payload(kb_mail.search_base(PHRASES[k % len(PHRASES)]), full), args.iterations)]
+
+def cli_suite(args, size):
+    tok, it, cold = "bench-token", args.iterations, args.cold
+    sender = lambda k: SENDERS[k % len(SENDERS)]
+
+    def summary(k):
+        msgs = kb_mail.fetch_last_messages(tok, sender=sender(k), top=10, max_age=None)
+        kb_mail.generate_summary_and_reply(msgs, sender_hint=sender(k), use_cache=False)
+
+    return [measure("cli fetch sender top10", size, lambda k: kb_mail.fetch_last_messages(tok, sender=sender(k), top=10, max_age=None), it, cold),
+            measure("cli fetch domain top25 30d", size, lambda k: kb_mail.fetch_last_messages(
+                tok, domain=DOMAINS[k % len(DOMAINS)], top=25, days=30, max_age=None), it, cold),
+            measure("cli search top20", size, lambda k: kb_mail.search_messages(tok, PHRASES[k % len(PHRASES)], top=20, max_age=None), it, cold),
+            measure("cli summary sender top10", size, summary, it, cold)]
+
+async def ui_suite(args, graph, sizes):
+    import httpx
+    import app
+    rows = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://bench", timeout=600) as c:
+        async def job(path, form):
+            r = await c.post(path, data=form, headers={"accept": "application/json"})
+            r.raise_for_status()
+            ev = await c.get(r.json()["events"])
+            if "event: done" not in ev.text or 'class="err"' in ev.text:
+                raise RuntimeError(f"job {path} incomplet")
+
+        # parametri diferiți per job: cererile identice simultane ar fi deduplicate într-un singur job
+        run = lambda k: job("/run", {"login": LOGIN, "mode": "sender", "value": SENDERS[k % len(SENDERS)], "last": "10"})
+        search = lambda k: job("/search", {"login": LOGIN, "q": PHRASES[k % len(PHRASES)], "last": str(20 + k)})
+        for size in sizes:
+            graph.mailbox = Mailbox(size)
+            rows.append(await ameasure(f"ui /run x{args.concurrency}", size, run, args.iterations, args.concurrency))
+            rows.append(await ameasure(f"ui /search x{args.concurrency}", size, search, args.iterations, args.concurrency))
+    await kb_async.close_async_transport()
+    return rows
+
+def print_table(rows):
+    cols = ["scenario", "size", "n", "errors", "throughput_per_s", "p50_ms", "p95_ms", "mem_peak_kb", "max_rss_mb"]
+    width = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in cols}
+    print("  ".join(c.ljust(width[c]) for c in cols))
+    for r in rows:
+        print("  ".join(str(r[c]).ljust(width[c]) for c in cols))
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark offline (mock Graph + mock LLM)")
+    p.add_argument("--sizes", default="1000,10000,100000", help="marimile cutiei postale, separate prin virgula (ex: 1000,1000000)")
+    p.add_argument("--scenarios", default="import,micro,cli,ui", help="subset din import,micro,cli,ui")
+    p.add_argument("--iterations", type=int, default=20)
+    p.add_argument("--concurrency", type=int, default=8, help="joburi UI simultane")
+    p.add_argument("--cold", action="store_true", help="goleste memo-ul de body-uri inainte de fiecare iteratie CLI")
+    p.add_argument("--graph-latency", type=float, default=0.0, help="secunde adaugate fiecarei cereri Graph")
+    p.add_argument("--throttle-every", type=int, default=0, help="mock Graph raspunde 429 la fiecare a N-a cerere")
+    p.add_argument("--retry-after", type=int, default=0, help="Retry-After (secunde) pentru 429-urile simulate")
+    p.add_argument("--graph-rps", type=float, default=0.0, help="plafonul mock Graph de cereri/s (0 = fara)")
+    p.add_argument("--graph-concurrency", type=int, default=0, help="plafonul mock Graph de cereri simultane (0 = fara)")
+    p.add_argument("--llm-latency", type=float, default=0.3, help="secunde pana la primul token")
+    p.add_argument("--llm-tps", type=float, default=0.0, help="tokeni/s generati de mock LLM (0 = instantaneu)")
+    p.add_argument("--json", default=None, help="scrie rezultatele si configuratia in acest fisier")
+    args = p.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    scenarios = {s.strip() for s in args.scenarios.split(",")}
+
+    _, graph, graph_base = start_graph(sizes[0], args.graph_latency, args.throttle_every, args.retry_after,
+                                       rps=args.graph_rps, concurrency=args.graph_concurrency)
+    _, llm, llm_base = start_llm(args.llm_latency, args.llm_tps)
+    configure(graph_base, llm_base, args.graph_rps, args.graph_concurrency)
+    print(f"[bench] graph={graph_base} llm={llm_base} sizes={sizes} scenarios={sorted(scenarios)}", file=sys.stderr)
+
+    rows = []
+    if "import" in scenarios: rows += import_suite(args)
+    if "micro" in scenarios: rows += micro_suite(args)
+    if "cli" in scenarios:
+        for size in sizes:
+            graph.mailbox = Mailbox(size)
+            rows += cli_suite(args, size)
+    if "ui" in scenarios: rows += asyncio.run(ui_suite(args, graph, sizes))
+    print_table(rows)
+    if llm.stats["calls"]:
+        print(f"[bench] llm: {llm.stats['calls']} apeluri, {llm.stats['prompt_chars'] // llm.stats['calls']} caractere prompt/apel", file=sys.stderr)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "graph": graph.stats, "llm": llm.stats, "results": rows}, f, indent=2)
+    return 1 if any(r["errors"] for r in rows) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
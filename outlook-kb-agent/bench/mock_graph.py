@@ -0,0 +1,274 @@
+# mock_graph.py — server Graph local pentru benchmark-uri offline (fără Microsoft, fără token real)
+# Emulează exact ce folosește codul: /me, listări /messages (+ /mailFolders/{id}/messages) cu
+# $search/$filter/$orderby/$top/$select și nextLink, /messages/delta, GET /messages/{id},
+# createReply, PATCH, /$batch (cu dependsOn => 424) și 429 + Retry-After: la fiecare N cereri și/sau
+# peste un plafon ca al Outlook (rps * 10 cereri într-o fereastră glisantă de 10s, cereri HTTP simultane).
+#
+# Cutia poștală e virtuală: mesajul i (0 = cel mai nou) e generat determinist din i la cerere,
+# deci 1M mesaje nu ocupă memorie; body-urile sunt HTML Outlook realist (stiluri, citare, semnătură,
+# disclaimer, pixel de tracking). Pornire separată: python bench/mock_graph.py --size 100000 --port 8900
+
+import argparse, collections, json, re, threading, time, urllib.parse
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("contract cadru oferta factura livrare termen plata avans comanda proiect buget aprobare revizie "
+         "specificatii anexa semnatura intalnire raport status risc blocaj test lansare server migrare cost "
+         "discount volum trimestru audit conformitate licenta suport incident escaladare prioritate client "
+         "furnizor echipa planificare estimare sprint release hotfix backup securitate acces cont").split()
+DOMAINS = [f"firma{k}.ro" for k in range(30)] + [f"company{k}.com" for k in range(10)]
+SENDERS = [f"user{k}@{DOMAINS[k % len(DOMAINS)]}" for k in range(200)]
+ME = {"id": "bench-user", "userPrincipalName": "bench@example.com", "mail": "bench@example.com", "displayName": "Bench User"}
+PAGE_MAX = 1000
+DELTA_PAGE = 200
+
+def _rng(seed):
+    """Generator determinist de numere (LCG) — mult mai ieftin decât random.Random(seed) per mesaj."""
+    x = (seed * 2654435761 + 0x9E3779B9) & 0xFFFFFFFF
+    while True:
+        x = (x * 1103515245 + 12345) & 0x7FFFFFFF
+        yield x
+
+def _words(seed, n):
+    r = _rng(seed)   # bitii mici ai unui LCG au perioade scurte => textul s-ar repeta în bucle; folosim bitii mari
+    return " ".join(WORDS[(next(r) >> 12) % len(WORDS)] for _ in range(n))
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class Mailbox:
+    """Cutia virtuală: `size` mesaje pe ultimele `span_days` zile, cel mai nou la indexul 0."""
+    def __init__(self, size=10000, span_days=365, now=None):
+        self.size = size
+        self.now = now or datetime.now(timezone.utc).replace(microsecond=0)
+        self.step = span_days * 86400 / max(1, size)
+
+    def received(self, i):
+        return self.now - timedelta(seconds=i * self.step)
+
+    def index_before(self, cutoff):
+        """Primul index cu receivedDateTime < cutoff (mesajele sunt ordonate descrescător)."""
+        return max(0, min(self.size, int((self.now - cutoff).total_seconds() // self.step) + 1))
+
+    def sender(self, i):
+        return SENDERS[(i * 7919 + (i // 3)) % len(SENDERS)]
+
+    def subject(self, i):
+        t = i // 3   # fire de câte 3 mesaje consecutive
+        return ("RE: " if i % 3 else "") + _words(t, 3 + t % 4).capitalize() + f" #{t}"
+
+    def preview(self, i):
+        return _words(i * 31 + 7, 24)
+
+    def body_html(self, i):
+        r = _rng(i)
+        paras = "".join(f"<p class=MsoNormal style='margin:0cm;font-size:11pt'>{_words(i * 97 + k, 30 + next(r) % 60)}.</p>"
+                        for k in range(2 + next(r) % 5))
+        table = ""
+        if i % 4 == 0:
+            rows = "".join(f"<tr><td>{_words(i + k, 2)}</td><td>{next(r) % 10000}.{next(r) % 100:02d} RON</td></tr>" for k in range(5 + next(r) % 15))
+            table = f"<table border=1 cellpadding=4 style='border-collapse:collapse'>{rows}</table>"
+        quoted = "".join(f"<p>{_words(i * 13 + k, 40)}</p>" for k in range(1 + i % 3))
+        prev = self.sender(i + 1)
+        return ("<html><head><meta http-equiv='Content-Type' content='text/html; charset=utf-8'>"
+                "<style>p.MsoNormal{margin:0cm;font-size:11.0pt;font-family:Calibri,sans-serif}"
+                " .x_sig{color:#888} table td{padding:4px}</style></head><body lang=RO>"
+                f"<div class=WordSection1><p>Buna ziua,</p>{paras}{table}"
+                f"<p class=x_sig>--<br>{self.sender(i).split('@')[0].title()}<br>Tel: +40 7{i % 100:02d} 000 000<br>"
+                f"<a href='https://{self.sender(i).split('@')[1]}'>{self.sender(i).split('@')[1]}</a></p></div>"
+                f"<div id=divRplyFwdMsg><hr><b>From:</b> {prev}<br><b>Sent:</b> {_iso(self.received(i + 1))}<br>"
+                f"<b>Subject:</b> {self.subject(i + 1)}</div><blockquote>{quoted}</blockquote>"
+                "<p style='font-size:8pt;color:#999'>CONFIDENTIALITY NOTICE: " + _words(i % 17, 60) + "</p>"
+                f"<img src='https://track.example.com/p.gif?m={i}' width=1 height=1></body></html>")
+
+    def message(self, i, select=None):
+        if not 0 <= i < self.size: return None
+        m = {"id": f"m{i:07d}", "changeKey": f"ck{i % 7}", "subject": self.subject(i),
+             "from": {"emailAddress": {"address": self.sender(i), "name": self.sender(i).split("@")[0]}},
+             "toRecipients": [{"emailAddress": {"address": ME["mail"]}}],
+             "ccRecipients": [{"emailAddress": {"address": self.sender(i + 5)}}] if i % 5 == 0 else [],
+             "receivedDateTime": _iso(self.received(i)), "bodyPreview": self.preview(i),
+             "conversationId": f"conv{i // 3:07d}", "webLink": f"https://outlook.example.com/mail/m{i:07d}"}
+        if select is None or "body" in select:
+            m["body"] = {"contentType": "html", "content": self.body_html(i)}
+        return {k: v for k, v in m.items() if k in select} if select else m
+
+    def matches(self, i, search):
+        """$search KQL minimal: from:adresa|domeniu sau termenii căutați în subiect + preview."""
+        if search.startswith("from:"):
+            who = search[5:].lower()
+            return self.sender(i) == who if "@" in who else self.sender(i).endswith("@" + who.lstrip("@"))
+        text = f"{self.subject(i)} {self.preview(i)}".lower()
+        return all(t in text for t in search.lower().split())
+
+RE_FILTER_GE = re.compile(r"receivedDateTime ge (\S+)")
+
+WINDOW_S = 10.0   # Outlook: 10.000 cereri / 10 min; la scara benchmark-ului, fereastra e de 10s
+
+class MockGraph:
+    """Logica endpoint-urilor, independentă de HTTP (folosită și pentru sub-cererile /$batch)."""
+    def __init__(self, mailbox, latency=0.0, throttle_every=0, retry_after=1, rps=0.0, concurrency=0):
+        self.mailbox = mailbox
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.rps, self.concurrency = rps, concurrency
+        self.window, self.inflight = collections.deque(), 0
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "batch": 0, "throttled": 0, "drafts": 0, "max_inflight": 0}
+
+    def _throttled(self):
+        with self.lock:
+            self.stats["requests"] += 1
+            hit = bool(self.throttle_every) and self.stats["requests"] % self.throttle_every == 0
+            if self.rps:
+                now = time.monotonic()
+                while self.window and self.window[0] <= now - WINDOW_S: self.window.popleft()
+                hit = hit or len(self.window) >= self.rps * WINDOW_S
+                if not hit: self.window.append(now)
+            if hit: self.stats["throttled"] += 1
+        return hit
+
+    def enter(self) -> bool:
+        """O cerere HTTP intra in lucru; False => peste plafonul de concurenta (raspunsul e 429)."""
+        with self.lock:
+            if self.concurrency and self.inflight >= self.concurrency:
+                self.stats["requests"] += 1; self.stats["throttled"] += 1
+                return False
+            self.inflight += 1
+            self.stats["max_inflight"] = max(self.stats["max_inflight"], self.inflight)
+            return True
+
+    def leave(self):
+        with self.lock: self.inflight -= 1
+
+    def handle(self, method, url, body=None, sub=False):
+        """(status, headers, json) pentru o cerere; `url` relativ la /v1.0 (cu query)."""
+        if self._throttled():
+            return 429, {"Retry-After": str(self.retry_after)}, {"error": {"code": "TooManyRequests", "message": "throttled"}}
+        u = urllib.parse.urlsplit(url)
+        q = dict(urllib.parse.parse_qsl(u.query))
+        path = re.sub(r"^/v1\.0", "", u.path).rstrip("/")
+        if method == "POST" and path == "/$batch" and not sub:
+            return 200, {}, self.batch(body or {})
+        if method == "GET" and path == "/me":
+            return 200, {}, ME
+        if method == "GET" and re.fullmatch(r"/me(?:/mailFolders/[^/]+)?/messages/delta", path):
+            return 200, {}, self.delta(path, q)
+        if method == "GET" and re.fullmatch(r"/me(?:/mailFolders/[^/]+)?/messages", path):
+            return self.list(path, q)
+        if (m := re.fullmatch(r"/me/messages/([^/]+)(/createReply)?", path)):
+            i = int(m.group(1)[1:]) if re.fullmatch(r"m\d+", m.group(1)) else -1
+            if self.mailbox.message(i, ("id",)) is None:
+                return 404, {}, {"error": {"code": "ErrorItemNotFound", "message": "The specified object was not found in the store."}}
+            if method == "GET":
+                return 200, {}, self.mailbox.message(i, q["$select"].split(",") if "$select" in q else None)
+            if method == "POST" and m.group(2):
+                with self.lock: self.stats["drafts"] += 1
+                return 201, {}, {"id": f"draft-{m.group(1)}", "webLink": f"https://outlook.example.com/drafts/{m.group(1)}",
+                                 "subject": "RE: " + self.mailbox.subject(i)}
+            if method == "PATCH":
+                return 200, {}, {"id": m.group(1)}
+        return 400, {}, {"error": {"code": "BadRequest", "message": f"mock_graph: {method} {path} nu e emulat"}}
+
+    def list(self, path, q):
+        mb, top = self.mailbox, min(int(q.get("$top", "10")), PAGE_MAX)
+        search = q.get("$search", "").strip('"')
+        if search and ("$filter" in q or "$orderby" in q):
+            return 400, {}, {"error": {"code": "BadRequest", "message": "$search cannot be combined with $filter/$orderby"}}
+        end = mb.size
+        if (f := RE_FILTER_GE.search(q.get("$filter", ""))):
+            end = mb.index_before(datetime.fromisoformat(f.group(1).replace("Z", "+00:00")))
+        select = q["$select"].split(",") if "$select" in q else None
+        i, items = int(q.get("$skiptoken", "0")), []
+        while i < end and len(items) < top:
+            if not search or mb.matches(i, search): items.append(mb.message(i, select))
+            i += 1
+        out = {"value": items}
+        if i < end:
+            out["@odata.nextLink"] = f"{self.base}{path}?" + urllib.parse.urlencode({**q, "$skiptoken": i})
+        return 200, {}, out
+
+    def delta(self, path, q):
+        mb = self.mailbox
+        if q.get("$deltatoken"):
+            return {"value": [], "@odata.deltaLink": f"{self.base}{path}?$deltatoken=1"}
+        end = mb.size
+        if (f := RE_FILTER_GE.search(q.get("$filter", ""))):
+            end = mb.index_before(datetime.fromisoformat(f.group(1).replace("Z", "+00:00")))
+        i = int(q.get("$skiptoken", "0"))
+        select = q["$select"].split(",") if "$select" in q else None
+        out = {"value": [mb.message(k, select) for k in range(i, min(end, i + DELTA_PAGE))]}
+        if i + DELTA_PAGE < end:
+            out["@odata.nextLink"] = f"{self.base}{path}?" + urllib.parse.urlencode({**q, "$skiptoken": i + DELTA_PAGE})
+        else:
+            out["@odata.deltaLink"] = f"{self.base}{path}?$deltatoken=1"
+        return out
+
+    def batch(self, body):
+        with self.lock: self.stats["batch"] += 1
+        reqs = body.get("requests") or []
+        if len(reqs) > 20:
+            return {"error": {"code": "BadRequest", "message": "maximum 20 requests per batch"}}
+        out, failed = [], set()
+        for r in reqs:
+            if set(r.get("dependsOn") or []) & failed:
+                failed.add(r["id"])
+                out.append({"id": r["id"], "status": 424, "body": {"error": {"code": "FailedDependency"}}}); continue
+            status, headers, data = self.handle(r["method"], r["url"], r.get("body"), sub=True)
+            if status >= 400: failed.add(r["id"])
+            out.append({"id": r["id"], "status": status, "headers": headers, "body": data})
+        return {"responses": out}
+
+def _handler(graph):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"    # keep-alive, ca Graph
+        disable_nagle_algorithm = True   # altfel header-ele și corpul scrise separat => ~40 ms delayed-ACK per cerere
+
+        def _dispatch(self, method):
+            n = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(n) or b"null") if n else None
+            if not graph.enter():
+                status, headers, data = 429, {"Retry-After": str(graph.retry_after)}, {"error": {"code": "ApplicationThrottled", "message": "concurrency"}}
+            else:
+                try:
+                    if graph.latency: time.sleep(graph.latency)
+                    status, headers, data = graph.handle(method, self.path, body)
+                finally:
+                    graph.leave()
+            raw = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            for k, v in {"Content-Type": "application/json", "Content-Length": str(len(raw)), **headers}.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self): self._dispatch("GET")
+        def do_POST(self): self._dispatch("POST")
+        def do_PATCH(self): self._dispatch("PATCH")
+        def log_message(self, *a): pass
+    return Handler
+
+def start_graph(size=10000, latency=0.0, throttle_every=0, retry_after=1, port=0, host="127.0.0.1", rps=0.0, concurrency=0):
+    """(server, graph, base_url) — serverul rulează într-un thread daemon; base_url se pune în kb_mail.GRAPH."""
+    graph = MockGraph(Mailbox(size), latency, throttle_every, retry_after, rps, concurrency)
+    server = ThreadingHTTPServer((host, port), _handler(graph))
+    server.daemon_threads = True
+    graph.base = f"http://{host}:{server.server_port}/v1.0"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, graph, graph.base
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Mock Microsoft Graph pentru benchmark-uri")
+    p.add_argument("--size", type=int, default=10000, help="mesaje in cutia virtuala")
+    p.add_argument("--port", type=int, default=8900)
+    p.add_argument("--latency", type=float, default=0.0, help="secunde adaugate fiecarei cereri HTTP")
+    p.add_argument("--throttle-every", type=int, default=0, help="429 la fiecare a N-a cerere (0 = niciodata)")
+    p.add_argument("--retry-after", type=int, default=1)
+    p.add_argument("--rps", type=float, default=0.0, help="plafon de cereri/s (sub-cererile $batch incluse; 0 = fara)")
+    p.add_argument("--concurrency", type=int, default=0, help="plafon de cereri HTTP simultane (0 = fara)")
+    a = p.parse_args()
+    server, _, base = start_graph(a.size, a.latency, a.throttle_every, a.retry_after, a.port, rps=a.rps, concurrency=a.concurrency)
+    print(f"[mock-graph] {a.size} mesaje pe {base}")
+    try: threading.Event().wait()
+    except KeyboardInterrupt: server.shutdown()
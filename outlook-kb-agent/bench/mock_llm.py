@@ -0,0 +1,98 @@
+# mock_llm.py — server chat-completions local (format OpenAI) pentru benchmark-uri offline
+# POST /v1/chat/completions, cu și fără stream (SSE): răspunde cu un JSON valid cu cheile cerute de
+# prompturile din kb_mail/conversations (summary, draft_html, notes). Latența e configurabilă:
+# `latency` = timpul până la primul token, `tokens_per_s` = viteza de generare (0 = instantaneu).
+# Pornire separată: python bench/mock_llm.py --port 8901 --latency 0.5 (OPENAI_BASE_URL=http://127.0.0.1:8901/v1)
+
+import argparse, json, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockLLM:
+    def __init__(self, latency=0.3, tokens_per_s=0.0, summary_words=120):
+        self.latency = latency
+        self.tokens_per_s = tokens_per_s
+        self.summary_words = summary_words
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "streamed": 0, "prompt_chars": 0}
+
+    def content(self) -> str:
+        words = ("actiune termen decizie cifra blocaj cerinta " * (self.summary_words // 6 + 1)).split()[:self.summary_words]
+        bullets = "\n".join(f"- {' '.join(words[k:k + 12])}" for k in range(0, len(words), 12))
+        return json.dumps({"summary": bullets, "notes": bullets,
+                           "draft_html": f"<p>Buna ziua,</p><p>{' '.join(words[:40])}.</p><ol><li>Pasul 1</li><li>Pasul 2</li></ol>"}, ensure_ascii=False)
+
+    def record(self, messages, stream):
+        with self.lock:
+            self.stats["calls"] += 1
+            self.stats["streamed"] += bool(stream)
+            self.stats["prompt_chars"] += sum(len(m.get("content") or "") for m in messages)
+
+def _handler(llm):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True   # altfel header-ele și corpul scrise separat => ~40 ms delayed-ACK per cerere
+
+        def _json(self, status, data):
+            raw = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._json(404, {"error": {"message": f"mock_llm: {self.path} nu e emulat"}})
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            messages, stream, model = req.get("messages") or [], bool(req.get("stream")), req.get("model", "mock")
+            llm.record(messages, stream)
+            content = llm.content()
+            cid, created = f"chatcmpl-{uuid.uuid4().hex[:12]}", int(time.time())
+            prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+            time.sleep(llm.latency)
+            if not stream:
+                if llm.tokens_per_s: time.sleep(len(content) / 4 / llm.tokens_per_s)
+                return self._json(200, {"id": cid, "object": "chat.completion", "created": created, "model": model,
+                                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                                                  "total_tokens": prompt_tokens + len(content) // 4}})
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(obj):
+                raw = f"data: {obj if isinstance(obj, str) else json.dumps(obj)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n"); self.wfile.flush()
+
+            step = 16   # ~4 tokeni per fragment
+            for k in range(0, len(content), step):
+                send({"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                      "choices": [{"index": 0, "delta": {"content": content[k:k + step]}, "finish_reason": None}]})
+                if llm.tokens_per_s: time.sleep(step / 4 / llm.tokens_per_s)
+            send({"id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                  "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *a): pass
+    return Handler
+
+def start_llm(latency=0.3, tokens_per_s=0.0, port=0, host="127.0.0.1"):
+    """(server, llm, base_url) — base_url e pentru OpenAI(base_url=...) / OPENAI_BASE_URL."""
+    llm = MockLLM(latency, tokens_per_s)
+    server = ThreadingHTTPServer((host, port), _handler(llm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, llm, f"http://{host}:{server.server_port}/v1"
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Mock OpenAI chat-completions pentru benchmark-uri")
+    p.add_argument("--port", type=int, default=8901)
+    p.add_argument("--latency", type=float, default=0.3, help="secunde pana la primul token")
+    p.add_argument("--tokens-per-s", type=float, default=0.0, help="viteza de generare (0 = instantaneu)")
+    a = p.parse_args()
+    server, _, base = start_llm(a.latency, a.tokens_per_s, a.port)
+    print(f"[mock-llm] {base}")
+    try: threading.Event().wait()
+    except KeyboardInterrupt: server.shutdown()
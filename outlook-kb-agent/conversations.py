@@ -0,0 +1,98 @@
+# conversations.py — stratul de fire (conversationId) peste mesajele aduse din Graph/store
+# Grupează mesajele pe fire, elimină textul deja citat de un mesaj anterior din același fir și
+# rezumă o singură dată firele lungi. Rezumatul per fir trece prin llm_cache, adresat după conținutul
+# firului => se refolosește până apare un mesaj nou în fir.
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from kb_mail import LLM_MAP_CONCURRENCY, PAYLOAD_LEGEND, _complete_json, email_item, extract_participants, message_text
+import metrics
+from prompt_builder import slim_payload
+
+THREAD_SYSTEM_PROMPT = f"""Esti un asistent care rezuma un singur fir de email (mesajele in ordine cronologica, cel mai vechi primul).
+1) Noteaza evolutia firului: cine a cerut ce, ce s-a decis, ce a ramas deschis, termene, cifre.
+2) Textul deja citat dintr-un mesaj anterior a fost eliminat; nu il semnala ca lipsa.
+3) Daca payload-ul contine "query", pastreaza doar ce e relevant pentru ea.
+{PAYLOAD_LEGEND}
+Returneaza JSON cu cheia: notes (string Markdown, bullet-uri scurte).
+"""
+
+THREAD_SUMMARY_MIN_MESSAGES = 3   # firele mai scurte intra direct in prompt (fara apel separat)
+MIN_DEDUPE_LINE = 20              # liniile scurte ("Multumesc,", "Salut") nu sunt deduplicate
+
+RE_SUBJECT_PREFIX = re.compile(r"^\s*((re|fw|fwd|tr|aw|wg|raspuns|răspuns)\s*:\s*)+", re.I)
+
+def base_subject(subject: str) -> str:
+    return RE_SUBJECT_PREFIX.sub("", subject or "").strip()
+
+def group_by_conversation(messages):
+    """
+    Fire ordonate după cel mai nou mesaj (descrescător); în fiecare fir mesajele sunt cronologice.
+    Mesajele fără conversationId formează fiecare un fir propriu.
+    """
+    by_id = {}
+    for m in messages:
+        by_id.setdefault(m.get("conversationId") or m.get("id"), []).append(m)
+    threads = []
+    for cid, msgs in by_id.items():
+        msgs.sort(key=lambda m: m.get("receivedDateTime", ""))
+        subject = next((base_subject(m.get("subject")) for m in msgs if m.get("subject")), "")
+        threads.append({"conversation_id": cid, "subject": subject, "messages": msgs,
+                        "latest": msgs[-1].get("receivedDateTime", ""), "participants": extract_participants(msgs)})
+    threads.sort(key=lambda t: t["latest"], reverse=True)
+    return threads
+
+def _norm_line(line: str) -> str:
+    return " ".join(line.lstrip("> \t").split()).lower()
+
+def dedupe_quoted(msgs):
+    """
+    Textul curățat (message_text) al fiecărui mesaj din fir, fără liniile deja apărute într-un mesaj
+    anterior — citările inline pe care RE_QUOTED nu le prinde (Outlook fără blockquote, forward-uri).
+    """
+    seen, out = set(), []
+    for m in msgs:
+        lines = message_text(m).split("\n")
+        norms = [_norm_line(l) for l in lines]
+        kept = [l for l, n in zip(lines, norms) if len(n) < MIN_DEDUPE_LINE or n not in seen]
+        seen.update(n for n in norms if len(n) >= MIN_DEDUPE_LINE)
+        out.append(re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip())
+    return out
+
+def _thread_entry(t_index, thread, query=None, summarize=True):
+    """(entry, payload-ul de rezumat al firului sau None dacă firul intră direct cu mesajele)."""
+    msgs = thread["messages"]
+    items = [email_item(i, m, snippet=s) for i, (m, s) in enumerate(zip(msgs, dedupe_quoted(msgs)), 1)]
+    entry = {"t": t_index, "subject": thread["subject"], "participants": thread["participants"],
+             "messages_count": len(msgs), "latest": thread["latest"]}
+    if not summarize or len(msgs) < THREAD_SUMMARY_MIN_MESSAGES:
+        entry["emails"] = items
+        return entry, None
+    return entry, {"task": "thread_notes", "query": query, "subject": thread["subject"], "emails": items}
+
+def plan_threads(base, messages):
+    """
+    (payload, jobs): payload-ul LLM grupat pe fire (cel mai nou fir primul) și jobs = [(entry, payload_fir)]
+    pentru firele lungi; după apelul THREAD_SYSTEM_PROMPT, entry["notes"] primește rezultatul.
+    Dacă totul e un singur fir, nu are rost un apel în plus: mesajele deduplicate intră direct.
+    Payload-ul și cel al fiecărui job trec prin slim_payload (legendă de adrese, boilerplate, buget).
+    """
+    threads = group_by_conversation(messages)
+    query, summarize = base.get("query"), len(threads) > 1
+    entries, jobs = [], []
+    for t_index, thread in enumerate(threads, 1):
+        entry, job = _thread_entry(t_index, thread, query, summarize)
+        entries.append(entry)
+        if job is not None: jobs.append((entry, job))
+    note = ("emailurile sunt grupate pe fire (cel mai nou fir primul); 'emails' = mesajele firului in ordine cronologica, "
+            "fara textul deja citat; 'notes' = rezumatul unui fir lung")
+    return slim_payload({**base, "note": note, "threads": entries}), [(entry, slim_payload(job, map_reduce=False)) for entry, job in jobs]
+
+def threads_payload(base, messages, use_cache=True) -> dict:
+    """Payload-ul din plan_threads, cu firele lungi rezumate în paralel (LLM_MAP_CONCURRENCY)."""
+    payload, jobs = plan_threads(base, messages)
+    with ThreadPoolExecutor(max_workers=max(1, min(LLM_MAP_CONCURRENCY, len(jobs)))) as pool:
+        notes = metrics.ctx_map(pool, lambda job: _complete_json(THREAD_SYSTEM_PROMPT, job[1], use_cache=use_cache, keys=("notes",))["notes"], jobs)
+        for (entry, _), n in zip(jobs, notes): entry["notes"] = n
+    return payload
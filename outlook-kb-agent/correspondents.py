@@ -0,0 +1,264 @@
+# correspondents.py — indexul de corespondenți: cu cine vorbim, cât de des, de când și cât de repede răspundem
+# Per adresă și per domeniu: mesaje (de la ei / de la noi către ei), fire distincte, prima/ultima apariție,
+# ultimul mesaj primit de la ei și latența medie a răspunsurilor (a noastră către ei, a lor către noi).
+# Actualizat incremental din mesajele aduse din Graph (fetch/search) și din sync-ul store-ului local;
+# un mesaj contează o singură dată (după id), deci re-fetch-ul aceluiași mesaj nu dublează nimic.
+# Mesajele șterse/mutate din cutie nu scad contoarele: indexul e istoricul corespondenței.
+# Latența: în fiecare fir, un mesaj de la noi după unul de la X = răspunsul nostru către X (și invers);
+# mesajele sosite în altă ordine decât cronologic refac doar perechile vecine.
+# Un fișier per cont (account_path), ca store-ul; căutarea după adresă/domeniu = cheia primară,
+# autocomplete = interval pe cheia primară (prefix), fără scanarea mesajelor.
+#
+# .env (opțional):
+#   CORRESPONDENTS_PATH=.correspondents.sqlite3   # gol => fără index
+
+import json, os, sqlite3, threading
+
+from kb_mail import BASE_DIR, _parse_iso_dt, account_path
+
+CORRESPONDENTS_PATH = os.getenv("CORRESPONDENTS_PATH", str(BASE_DIR / ".correspondents.sqlite3"))
+SENT_FOLDER = "sentitems"
+BACKFILL_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS correspondents (
+    kind TEXT NOT NULL,                  -- 'address' | 'domain'
+    key TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    messages INTEGER NOT NULL DEFAULT 0,
+    received INTEGER NOT NULL DEFAULT 0, -- mesaje de la ei
+    sent INTEGER NOT NULL DEFAULT 0,     -- mesaje de la noi către ei
+    threads INTEGER NOT NULL DEFAULT 0,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    last_received TEXT,
+    our_reply_n INTEGER NOT NULL DEFAULT 0,
+    our_reply_s REAL NOT NULL DEFAULT 0,
+    their_reply_n INTEGER NOT NULL DEFAULT 0,
+    their_reply_s REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_correspondents_top ON correspondents(kind, messages DESC);
+CREATE INDEX IF NOT EXISTS ix_correspondents_domain ON correspondents(kind, domain, messages DESC);
+CREATE TABLE IF NOT EXISTS correspondent_threads (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    PRIMARY KEY (kind, key, conversation_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS seen_messages (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT,
+    received TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    outgoing INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_seen_conversation ON seen_messages(conversation_id, received, id);
+CREATE TABLE IF NOT EXISTS replies (
+    message_id TEXT PRIMARY KEY,         -- mesajul-răspuns
+    address TEXT NOT NULL,               -- corespondentul
+    outgoing INTEGER NOT NULL,           -- 1 = noi am răspuns, 0 = ei ne-au răspuns
+    seconds REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS self_addresses (address TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS correspondents_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+COLUMNS = ("kind", "key", "domain", "name", "messages", "received", "sent", "threads", "first_seen", "last_seen",
+           "last_received", "our_reply_n", "our_reply_s", "their_reply_n", "their_reply_s")
+
+def _address(obj):
+    a = (obj or {}).get("emailAddress") or {}
+    return (a.get("address") or "").strip().lower(), (a.get("name") or "").strip()
+
+def _domain(address) -> str:
+    return address.rpartition("@")[2]
+
+def _row(row) -> dict:
+    r = dict(zip(COLUMNS, row))
+    r["our_reply_avg_s"] = r["our_reply_s"] / r["our_reply_n"] if r["our_reply_n"] else None
+    r["their_reply_avg_s"] = r["their_reply_s"] / r["their_reply_n"] if r["their_reply_n"] else None
+    return r
+
+class CorrespondentIndex:
+    """Indexul unui cont; thread-safe (o conexiune SQLite WAL + lock), ingest-ul în tranzacții IMMEDIATE (mai mulți workeri)."""
+    def __init__(self, path=CORRESPONDENTS_PATH, account=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        if account: self.db.execute("INSERT OR IGNORE INTO self_addresses(address) VALUES (?)", (account.strip().lower(),))
+        self.me = {r[0] for r in self.db.execute("SELECT address FROM self_addresses")}
+
+    # ----- write path -----
+    def ingest(self, msgs, folder_id=None, me=()) -> int:
+        """
+        Mesaje Graph (listare, search, delta) -> contoare. me = adresele contului (login, /me); în sentitems
+        expeditorul e mereu contul. Întoarce câte mesaje erau noi.
+        """
+        msgs = [m for m in msgs if m.get("id") and m.get("receivedDateTime")]
+        mine = {a.strip().lower() for a in me if a}
+        if folder_id == SENT_FOLDER: mine |= {_address(m.get("from"))[0] for m in msgs} - {""}
+        new = 0
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for a in mine - self.me:
+                    self.db.execute("INSERT OR IGNORE INTO self_addresses(address) VALUES (?)", (a,))
+                self.me |= mine
+                for m in msgs: new += self._ingest_one(m, folder_id)
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK"); raise
+        return new
+
+    def _ingest_one(self, m, folder_id) -> int:
+        db, mid, received = self.db, m["id"], m["receivedDateTime"]
+        if db.execute("SELECT 1 FROM seen_messages WHERE id = ?", (mid,)).fetchone(): return 0
+        sender, sender_name = _address(m.get("from"))
+        outgoing = folder_id == SENT_FOLDER or sender in self.me
+        conv = m.get("conversationId")
+        people = {}   # adresă -> nume; contul nu e propriul corespondent
+        if sender and not outgoing: people[sender] = sender_name
+        for r in (m.get("toRecipients") or []) + (m.get("ccRecipients") or []):
+            a, name = _address(r)
+            if a and a not in self.me: people.setdefault(a, name)
+        db.execute("INSERT INTO seen_messages(id, conversation_id, received, sender, outgoing) VALUES (?, ?, ?, ?, ?)",
+                   (mid, conv, received, sender, int(outgoing)))
+        domains = {}
+        for a, name in people.items():
+            theirs = a == sender and not outgoing
+            self._bump("address", a, name, received, conv, theirs, outgoing)
+            domains[_domain(a)] = domains.get(_domain(a), False) or theirs
+        for d, theirs in domains.items():
+            self._bump("domain", d, "", received, conv, theirs, outgoing)
+        if conv: self._link(mid, conv, received, sender, outgoing)
+        return 1
+
+    def _bump(self, kind, key, name, received, conv, theirs, outgoing):
+        self.db.execute(
+            "INSERT INTO correspondents(kind, key, domain, name, messages, received, sent, first_seen, last_seen, last_received) "
+            "VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?) ON CONFLICT(kind, key) DO UPDATE SET "
+            "name = CASE WHEN excluded.name != '' AND (name = '' OR excluded.last_seen >= last_seen) THEN excluded.name ELSE name END, "
+            "messages = messages + 1, received = received + excluded.received, sent = sent + excluded.sent, "
+            "first_seen = min(first_seen, excluded.first_seen), last_seen = max(last_seen, excluded.last_seen), "
+            "last_received = CASE WHEN excluded.last_received IS NULL THEN last_received "
+            "WHEN last_received IS NULL THEN excluded.last_received ELSE max(last_received, excluded.last_received) END",
+            (kind, key, _domain(key) if kind == "address" else key, name, int(theirs), int(outgoing),
+             received, received, received if theirs else None))
+        if conv and self.db.execute("INSERT OR IGNORE INTO correspondent_threads(kind, key, conversation_id) VALUES (?, ?, ?)",
+                                    (kind, key, conv)).rowcount:
+            self.db.execute("UPDATE correspondents SET threads = threads + 1 WHERE kind = ? AND key = ?", (kind, key))
+
+    def _link(self, mid, conv, received, sender, outgoing):
+        """Perechile de răspuns vecine mesajului nou din fir: (anterior, nou) și (nou, următor)."""
+        cur = (mid, received, sender, outgoing)
+        prev = self.db.execute("SELECT id, received, sender, outgoing FROM seen_messages WHERE conversation_id = ? "
+                               "AND (received, id) < (?, ?) ORDER BY received DESC, id DESC LIMIT 1", (conv, received, mid)).fetchone()
+        nxt = self.db.execute("SELECT id, received, sender, outgoing FROM seen_messages WHERE conversation_id = ? "
+                              "AND (received, id) > (?, ?) ORDER BY received, id LIMIT 1", (conv, received, mid)).fetchone()
+        self._set_reply(cur, prev)
+        if nxt: self._set_reply(nxt, cur)
+
+    def _set_reply(self, msg, prev):
+        db = self.db
+        if (old := db.execute("SELECT address, outgoing, seconds FROM replies WHERE message_id = ?", (msg[0],)).fetchone()):
+            self._add_latency(*old, sign=-1)
+            db.execute("DELETE FROM replies WHERE message_id = ?", (msg[0],))
+        if prev is None or bool(prev[3]) == bool(msg[3]): return
+        who = prev[2] if msg[3] else msg[2]   # noi răspundem expeditorului anterior / expeditorul ne răspunde nouă
+        t0, t1 = _parse_iso_dt(prev[1]), _parse_iso_dt(msg[1])
+        if not who or who in self.me or not (t0 and t1): return
+        seconds = (t1 - t0).total_seconds()
+        db.execute("INSERT INTO replies(message_id, address, outgoing, seconds) VALUES (?, ?, ?, ?)", (msg[0], who, int(msg[3]), seconds))
+        self._add_latency(who, msg[3], seconds)
+
+    def _add_latency(self, address, outgoing, seconds, sign=1):
+        col = "our_reply" if outgoing else "their_reply"
+        for kind, key in (("address", address), ("domain", _domain(address))):
+            self.db.execute(f"UPDATE correspondents SET {col}_n = {col}_n + ?, {col}_s = {col}_s + ? WHERE kind = ? AND key = ?",
+                            (sign, sign * seconds, kind, key))
+
+    def backfill(self, store) -> int:
+        """O singură dată per index: mesajele sincronizate în store înainte să existe indexul."""
+        with self.lock:
+            if self.db.execute("SELECT 1 FROM correspondents_meta WHERE key = 'backfilled'").fetchone(): return 0
+        new, last = 0, 0
+        while True:
+            with store.lock:
+                rows = store.db.execute("SELECT rowid, id, folder_id, data FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                        (last, BACKFILL_BATCH)).fetchall()
+            if not rows: break
+            last = rows[-1][0]
+            with self.lock:
+                ids = [r[1] for r in rows]
+                known = {r[0] for r in self.db.execute(f"SELECT id FROM seen_messages WHERE id IN ({','.join('?' * len(ids))})", ids)}
+            by_folder = {}
+            for _, mid, folder_id, data in rows:
+                if mid not in known: by_folder.setdefault(folder_id, []).append(json.loads(data))
+            for folder_id, msgs in sorted(by_folder.items(), key=lambda kv: kv[0] != SENT_FOLDER):   # întâi adresele contului
+                new += self.ingest(msgs, folder_id)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO correspondents_meta(key, value) VALUES ('backfilled', '1')")
+        return new
+
+    # ----- read path -----
+    def lookup(self, key):
+        """Statisticile unei adrese (cu @) sau ale unui domeniu; None dacă nu apare în index."""
+        key = (key or "").strip().lower()
+        kind = "address" if "@" in key[1:] else "domain"
+        if kind == "domain": key = key.lstrip("@")
+        with self.lock:
+            row = self.db.execute(f"SELECT {','.join(COLUMNS)} FROM correspondents WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        return _row(row) if row else None
+
+    def suggest(self, prefix, kind="address", limit=10) -> list:
+        """Autocomplete: cheile care încep cu `prefix`, cele mai active primele."""
+        prefix = (prefix or "").strip().lower()
+        if not prefix: return []
+        with self.lock:
+            rows = self.db.execute(f"SELECT {','.join(COLUMNS)} FROM correspondents WHERE kind = ? AND key >= ? AND key < ? "
+                                   "ORDER BY messages DESC LIMIT ?", (kind, prefix, prefix + "\U0010ffff", limit + len(self.me))).fetchall()
+        return [_row(r) for r in rows if r[1] not in self.me][:limit]
+
+    def top(self, domain=None, limit=20) -> list:
+        """Cei mai activi corespondenți (adrese), în general sau la un domeniu."""
+        sql, args = f"SELECT {','.join(COLUMNS)} FROM correspondents WHERE kind = 'address'", []
+        if domain:
+            sql += " AND domain = ?"; args.append(domain.strip().lower().lstrip("@"))
+        with self.lock:
+            rows = self.db.execute(sql + " ORDER BY messages DESC LIMIT ?", args + [limit + len(self.me)]).fetchall()
+        return [_row(r) for r in rows if r[1] not in self.me][:limit]
+
+    def top_domains(self, limit=20) -> list:
+        with self.lock:
+            rows = self.db.execute(f"SELECT {','.join(COLUMNS)} FROM correspondents WHERE kind = 'domain' "
+                                   "ORDER BY messages DESC LIMIT ?", (limit,)).fetchall()
+        return [_row(r) for r in rows]
+
+    def stats(self) -> dict:
+        with self.lock:
+            counts = dict(self.db.execute("SELECT kind, count(*) FROM correspondents GROUP BY kind").fetchall())
+            seen = self.db.execute("SELECT count(*) FROM seen_messages").fetchone()[0]
+        return {"messages": seen, "addresses": counts.get("address", 0), "domains": counts.get("domain", 0)}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_correspondents(login=None):
+    """Indexul contului (unul per proces si fisier); None cu CORRESPONDENTS_PATH gol."""
+    if not CORRESPONDENTS_PATH: return None
+    path = account_path(CORRESPONDENTS_PATH, login)
+    idx = _indexes.get(path)
+    if idx is None:
+        with _indexes_lock:
+            idx = _indexes.get(path)
+            if idx is None:
+                idx = _indexes[path] = CorrespondentIndex(path, login)
+    return idx
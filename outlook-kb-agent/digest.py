@@ -0,0 +1,121 @@
+# digest.py — mod batch pentru CLI: multe expeditoare/domenii într-o singură rulare (kb_mail.py --batch FILE)
+# Un singur proces, un token, un pool de conexiuni: fetch-urile rulează cu concurență limitată (DIGEST_CONCURRENCY),
+# apelurile LLM în paralel sub poarta LLMGate din kb_async (LLM_MAX_CONCURRENCY / LLM_RPM), draft-urile
+# într-un singur $batch la final. Fiecare țintă are timpii și eroarea ei; o țintă eșuată nu oprește restul.
+# Cererile Graph ale digest-ului au prioritate BACKGROUND în MailboxGate: cedează locul cererilor interactive.
+#
+# Cu since_last (--since-last) fiecare țintă trece prin watermarks.py: doar mesajele noi, rezumatul actualizat.
+#
+# Fișierul de ținte: câte una pe linie; conține "@" => expeditor, altfel domeniu; "#" = comentariu.
+
+import asyncio, json, os, time
+from datetime import datetime
+
+from kb_mail import BACKGROUND, TZ_NAME, graph_priority
+from kb_async import acreate_reply_drafts, afetch_last_messages, agenerate_summary_and_reply, close_async_transport
+
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "6"))
+
+def read_targets(lines):
+    """[(kind, value)] din liniile fișierului; duplicatele (case-insensitive) apar o singură dată."""
+    out, seen = [], set()
+    for line in lines:
+        v = line.split("#", 1)[0].strip()
+        if not v or v.lower() in seen: continue
+        seen.add(v.lower())
+        out.append(("sender", v) if "@" in v.lstrip("@") else ("domain", v.lstrip("@")))
+    return out
+
+async def _digest_item(token, kind, value, fetch_slots, opts):
+    item = {"target": value, "kind": kind, "messages": 0, "summary": None, "draft_html": None,
+            "newest_id": None, "draft_link": None, "error": None, "timings": {}}
+    t0 = time.perf_counter()
+    try:
+        if opts["since_last"]:
+            from watermarks import asummarize_since_last
+            async with fetch_slots:   # fetch + actualizarea LLM (de regula un singur apel mic) sub acelasi slot
+                r = await asummarize_since_last(token, top=opts["top"], days=opts["days"], folder_id=opts["folder_id"], tone=opts["tone"],
+                                                slot=opts["slot"], use_cache=opts["use_cache"], by_thread=opts["by_thread"], **{kind: value})
+            item.update(messages=r["new_messages"], summary=r["summary"], newest_id=r["newest_id"], incremental=r["incremental"],
+                        draft_html=r["draft_html"] if r["new_messages"] else None, capped=r["capped"])
+            item["timings"]["total"] = round(time.perf_counter() - t0, 3)
+            return item
+        async with fetch_slots:
+            msgs = await afetch_last_messages(token, top=opts["top"], days=opts["days"], folder_id=opts["folder_id"], **{kind: value})
+        item["timings"]["fetch"] = round(time.perf_counter() - t0, 3)
+        item["messages"] = len(msgs)
+        if msgs:
+            t1 = time.perf_counter()
+            item["summary"], item["draft_html"] = await agenerate_summary_and_reply(
+                msgs, sender_hint=value, tone=opts["tone"], propose_slot=opts["slot"], timezone_name=TZ_NAME,
+                use_cache=opts["use_cache"], by_thread=opts["by_thread"])
+            item["timings"]["llm"] = round(time.perf_counter() - t1, 3)
+            item["newest_id"] = msgs[0]["id"]
+    except Exception as e:
+        item["error"] = f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else e}"
+    item["timings"]["total"] = round(time.perf_counter() - t0, 3)
+    return item
+
+async def run_digest(token, targets, top=5, days=None, folder_id=None, tone="brief-firm", slot=None,
+                     use_cache=True, by_thread=True, create_draft=False, concurrency=DIGEST_CONCURRENCY, since_last=False) -> dict:
+    """Digest-ul pentru toate țintele: {generated, elapsed, items: [...]} în ordinea din fișier."""
+    t0 = time.perf_counter()
+    opts = dict(top=top, days=days, folder_id=folder_id, tone=tone, slot=slot, use_cache=use_cache, by_thread=by_thread, since_last=since_last)
+    fetch_slots = asyncio.Semaphore(max(1, concurrency))
+    with graph_priority(BACKGROUND):
+        items = await _run_items(token, targets, fetch_slots, opts, create_draft)
+    return {"generated": datetime.now().astimezone().isoformat(timespec="seconds"),
+            "elapsed": round(time.perf_counter() - t0, 3), "items": list(items)}
+
+async def _run_items(token, targets, fetch_slots, opts, create_draft):
+    try:
+        items = await asyncio.gather(*(_digest_item(token, kind, value, fetch_slots, opts) for kind, value in targets))
+        if create_draft:
+            todo = [it for it in items if it["draft_html"] and not it["error"]]
+            if todo:
+                t1 = time.perf_counter()
+                try:
+                    drafts = await acreate_reply_drafts(token, [(it["newest_id"], it["draft_html"]) for it in todo])
+                except Exception as e:
+                    drafts = [{"error": f"{type(e).__name__}: {e}"}] * len(todo)
+                took = round(time.perf_counter() - t1, 3)
+                for it, d in zip(todo, drafts):
+                    it["draft_link"] = d.get("webLink")
+                    if d.get("error"): it["draft_error"] = d["error"]
+                    it["timings"]["draft"] = took   # un singur $batch pentru toate
+    finally:
+        await close_async_transport()
+    return items
+
+def render_markdown(digest) -> str:
+    items = digest["items"]
+    failed = sum(1 for it in items if it["error"])
+    lines = [f"# Digest — {digest['generated']}", "",
+             f"{len(items)} ținte, {len(items) - failed} ok, {failed} erori, {digest['elapsed']:.1f}s", ""]
+    for it in items:
+        t = it["timings"]
+        label = "expeditor" if it["kind"] == "sender" else "domeniu"
+        timing = " · ".join(f"{k} {v:.1f}s" for k, v in t.items())
+        lines.append(f"## {it['target']} ({label}) — {it['messages']} mesaje · {timing}")
+        lines.append("")
+        if it["error"]:
+            lines.append(f"**EROARE:** {it['error']}")
+        elif not it["messages"] and it.get("summary"):
+            lines += ["_Nimic nou de la ultimul rezumat._", "", it["summary"].strip()]
+        elif not it["messages"]:
+            lines.append("_Niciun mesaj pe criteriile date._")
+        else:
+            if it.get("capped"): lines += [f"_Doar cele mai noi {it['messages']} mesaje (SINCE_LAST_MAX); cele mai vechi de la ultimul rezumat lipsesc._", ""]
+            lines.append(it["summary"].strip())
+            if it.get("draft_link"): lines += ["", f"**Draft:** {it['draft_link']}"]
+            elif it.get("draft_error"): lines += ["", f"**Draft eșuat:** {it['draft_error']}"]
+        lines.append("")
+    return "\n".join(lines)
+
+def write_digest(digest, out=None):
+    """JSON dacă `out` se termină în .json, altfel Markdown; fără `out` => stdout (Markdown)."""
+    text = json.dumps(digest, ensure_ascii=False, indent=2) if out and out.lower().endswith(".json") else render_markdown(digest)
+    if not out:
+        print(text); return
+    with open(out, "w", encoding="utf-8") as f:
+        f.write(text)
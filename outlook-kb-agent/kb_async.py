@@ -0,0 +1,359 @@
+# kb_async.py — varianta asyncio a pipeline-ului kb_mail (Graph prin httpx.AsyncClient, LLM prin AsyncOpenAI)
+# Folosită de app.py: un singur worker uvicorn servește multe rezumate concurente fără să țină ocupat
+# câte un thread pe toată durata cererii. Logica (parametri Graph, paginare, cache LLM, map-reduce, fire)
+# e cea din kb_mail/conversations; aici e doar I/O-ul async. Ce rămâne blocant (store-ul SQLite,
+# cache-ul LLM, curățarea HTML) rulează scurt în asyncio.to_thread.
+
+import asyncio, functools, os, threading, time, weakref
+from contextlib import aclosing, asynccontextmanager
+
+from kb_mail import (
+    DEFAULT_MODEL, GRAPH_BODY_TEXT, GRAPH_CONNECT_TIMEOUT, GRAPH_MAX_RETRIES, GRAPH_POOL_SIZE, GRAPH_READ_TIMEOUT,
+    IDEMPOTENT_METHODS, LLM_MAP_CONCURRENCY, ME_SELECT, MAIL_STORE_MAX_AGE, MAP_SYSTEM_PROMPT, OPENAI_KEY,
+    SEARCH_SYSTEM_PROMPT, SYSTEM_PROMPT, BatchRun, JsonStreamParser, apply_bodies, body_requests, PageCollector, RetryPolicy, _cutoff, _list_request, _search_request,
+    _graph_priority, emails_payload, fetch_last_messages, get_auth, get_scheduler, graph_url, llm_cached, llm_messages, map_reduce_plan, note_correspondents, parse_llm_json,
+    queue_metrics, record_llm_usage, record_prompt, record_response, request_cost, reply_draft_requests, reply_drafts_result, search_base, search_messages,
+    stream_result, summary_base,
+)
+import metrics
+
+# httpx și openai se încarcă la prima folosire (ca în kb_mail): importul app.py nu le plătește
+
+# ---------- LLM (async) ----------
+allm = None   # clientul AsyncOpenAI, construit la primul apel (sau setat din afară, ex. bench); False = indisponibil
+_allm_lock = threading.Lock()
+
+def get_allm():
+    """Clientul async; app.py îl construiește într-un thread la pornire, ca importul SDK-ului să nu blocheze bucla."""
+    global allm
+    if allm is None:
+        with _allm_lock:
+            if allm is None:
+                try:
+                    from openai import AsyncOpenAI
+                    allm = AsyncOpenAI(api_key=OPENAI_KEY) if OPENAI_KEY else False
+                except Exception:
+                    allm = False
+    return allm
+
+def require_allm(build=False):
+    """kb_mail.require_llm pentru clientul async."""
+    client = get_allm() if build else (allm if allm is not None else OPENAI_KEY)
+    if not client: raise RuntimeError("LLM client nu este configurat. Seteaza OPENAI_API_KEY in .env")
+    return client
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))   # apeluri LLM simultane per proces
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))                          # cereri LLM pe minut; 0 => fără limită
+
+class LLMGate:
+    """Poarta apelurilor LLM dintr-un event loop: cel mult `concurrency` simultan și, opțional, `rpm` pornite pe minut."""
+    def __init__(self, concurrency=LLM_MAX_CONCURRENCY, rpm=LLM_RPM):
+        self.sem = asyncio.Semaphore(max(1, concurrency))
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self.next_at = 0.0
+
+    async def __aenter__(self):
+        await self.sem.acquire()
+        if self.interval:
+            now = asyncio.get_running_loop().time()
+            wait, self.next_at = self.next_at - now, max(now, self.next_at) + self.interval
+            if wait > 0: await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc):
+        self.sem.release()
+
+_llm_gates = weakref.WeakKeyDictionary()
+
+def llm_gate() -> LLMGate:
+    loop = asyncio.get_running_loop()
+    g = _llm_gates.get(loop)
+    if g is None:
+        g = _llm_gates[loop] = LLMGate()
+    return g
+
+# ---------- async Graph transport ----------
+@asynccontextmanager
+async def aslot(gate, priority=None, cost=1):
+    """MailboxGate.slot() pentru event loop: aceeasi stare (pauza, bucket, locuri) cu thread-urile sync."""
+    priority = _graph_priority.get() if priority is None else priority
+    loop, ev, t0 = asyncio.get_running_loop(), asyncio.Event(), time.perf_counter()
+    waker = functools.partial(loop.call_soon_threadsafe, ev.set)   # release() poate veni din alt thread
+    try:
+        while (wait := gate.try_acquire(priority, cost, waker)) > 0:
+            try: await asyncio.wait_for(ev.wait(), min(wait, 1.0))
+            except asyncio.TimeoutError: pass
+            ev.clear()
+    except BaseException:
+        gate.cancel(waker); raise
+    queue_metrics(priority, t0)
+    try: yield
+    finally: gate.release()
+
+class AsyncGraphTransport(RetryPolicy):
+    """Echivalentul async al GraphTransport: pool keep-alive httpx, aceleași timeouts și aceeași politică de retry."""
+    def __init__(self, connect_timeout=GRAPH_CONNECT_TIMEOUT, read_timeout=GRAPH_READ_TIMEOUT,
+                 max_retries=GRAPH_MAX_RETRIES, pool_size=GRAPH_POOL_SIZE, backoff_base=0.5, backoff_max=30.0):
+        super().__init__(max_retries, backoff_base, backoff_max)
+        import httpx
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def request(self, method, path, **kwargs):
+        import httpx
+        url = graph_url(path)
+        method = method.upper()
+        gate, cost = get_scheduler().gate(kwargs.get("headers")), request_cost(path, kwargs)
+        attempt, label = 0, metrics.graph_path(url)
+        with metrics.span("graph", "kb_graph_request_seconds", method=method, path=label) as s:
+            while True:
+                try:
+                    async with aslot(gate, cost=cost):
+                        r = await self.client.request(method, url, **kwargs)
+                except (httpx.NetworkError, httpx.TimeoutException) as e:
+                    retriable = not isinstance(e, httpx.ReadTimeout) or method in IDEMPOTENT_METHODS
+                    if not retriable or attempt >= self.max_retries: raise
+                    metrics.count("kb_graph_retries_total", reason="network", level="http")
+                    await asyncio.sleep(self.backoff(attempt)); attempt += 1
+                    continue
+                if s.active: record_response(method, label, r.status_code, len(r.content))
+                if not self.should_retry(method, r.status_code, attempt):
+                    s.set(status=r.status_code, retries=attempt)
+                    return r
+                metrics.count("kb_graph_retries_total", reason=str(r.status_code), level="http")
+                if r.status_code == 429: gate.pause(self.backoff(attempt, r))
+                else: await asyncio.sleep(self.backoff(attempt, r))
+                attempt += 1
+
+    async def aclose(self):
+        await self.client.aclose()
+
+# un client per event loop (conexiunile httpx sunt legate de loop-ul în care au fost deschise)
+_atransports = weakref.WeakKeyDictionary()
+
+def get_async_transport() -> AsyncGraphTransport:
+    loop = asyncio.get_running_loop()
+    t = _atransports.get(loop)
+    if t is None:
+        t = _atransports[loop] = AsyncGraphTransport()
+    return t
+
+async def close_async_transport():
+    t = _atransports.pop(asyncio.get_running_loop(), None)
+    if t is not None: await t.aclose()
+
+# ---------- Graph helpers (async) ----------
+async def agraph_get(path, headers=None, params=None):
+    r = await get_async_transport().request("GET", path, headers=headers, params=params)
+    r.raise_for_status(); return r.json()
+
+async def agraph_post(path, headers=None, data=None):
+    r = await get_async_transport().request("POST", path, headers=headers, json=data or {})
+    r.raise_for_status(); return r.json()
+
+async def agraph_patch(path, headers=None, data=None):
+    r = await get_async_transport().request("PATCH", path, headers=headers, json=data or {})
+    r.raise_for_status(); return r.json() if r.text else {}
+
+async def agraph_me(token, login_hint=None) -> dict:
+    """graph_me async, cu același memo per cont din AuthManager."""
+    auth = get_auth()
+    me = auth.profile(login_hint)
+    if me is None:
+        me = await agraph_get("/me", headers={"Authorization": f"Bearer {token}"}, params={"$select": ME_SELECT})
+        auth.remember_profile(login_hint, me)
+    return me
+
+async def aacquire_token(login_hint=None, interactive=True, on_device_code=None, force=False) -> str:
+    """
+    Token-ul din memorie direct; doar refresh-ul/login-ul MSAL (blocant) merge într-un thread.
+    on_device_code e apelat din acel thread (în app.py trece mesajul în bucla asyncio a jobului).
+    """
+    auth = get_auth()
+    if not force and (tok := auth.cached_token(login_hint)): return tok
+    return await asyncio.to_thread(auth.acquire, login_hint, interactive, on_device_code, force)
+
+async def agraph_batch(reqs, headers=None):
+    """graph_batch async: loturile unei runde pleacă în paralel; retry-ul sub-cererilor e cel din BatchRun."""
+    run = BatchRun(reqs, get_async_transport())
+    while True:
+        pages = await asyncio.gather(*(agraph_post("/$batch", headers=headers, data={"requests": c}) for c in run.chunks()))
+        delay = run.absorb([r for p in pages for r in p.get("responses", [])])
+        if delay is None: return run.results
+        if run.throttled: get_scheduler().gate(headers).pause(delay)
+        else: await asyncio.sleep(delay)
+
+async def aiter_pages(path, headers=None, params=None):
+    """Ca iter_pages: pagina următoare (nextLink) e cerută doar când consumatorul o vrea."""
+    data = await agraph_get(path, headers=headers, params=params)
+    while True:
+        metrics.count("kb_graph_pages_total")
+        yield data.get("value", [])
+        next_link = data.get("@odata.nextLink")
+        if not next_link: return
+        data = await agraph_get(next_link, headers=headers)
+
+async def acollect_messages(pages, top, cutoff=None, match=None):
+    c = PageCollector(top, cutoff, match)
+    with metrics.span("pagination") as s:
+        async with aclosing(pages):
+            async for page in pages:
+                if c.add(page): break
+        out = c.result()
+        s.set(messages=len(out))
+    return out
+
+# ---------- fetch / search (async) ----------
+async def afetch_bodies(token, msgs, text=GRAPH_BODY_TEXT):
+    """fetch_bodies async: body-urile setului final prin agraph_batch."""
+    reqs = body_requests(msgs, text)
+    if reqs:
+        with metrics.span("bodies") as s:
+            s.set(requests=len(reqs), memo_hits=len(msgs) - len(reqs))
+            apply_bodies(msgs, await agraph_batch(reqs, headers={"Authorization": f"Bearer {token}"}))
+    return msgs
+
+async def afetch_last_messages(token, sender=None, domain=None, top=5, folder_id=None, days=None, max_age=MAIL_STORE_MAX_AGE, since=None):
+    """fetch_last_messages fără thread blocat pe Graph; cu store local (SQLite) delegăm varianta sync într-un thread."""
+    if max_age is not None:
+        return await asyncio.to_thread(fetch_last_messages, token, sender, domain, top, folder_id, days, max_age, since)
+    path, headers, params, collect = _list_request(token, sender, domain, top, folder_id, days, since)
+    msgs = await acollect_messages(aiter_pages(path, headers=headers, params=params), top, **collect)
+    await asyncio.to_thread(note_correspondents, token, msgs, folder_id)
+    return await afetch_bodies(token, msgs)
+
+async def asearch_messages(token, phrase, top=20, folder_id=None, days=None, max_age=MAIL_STORE_MAX_AGE, mode="keyword"):
+    if max_age is not None or mode != "keyword":   # store local / index semantic: SQLite + numpy, într-un thread
+        return await asyncio.to_thread(search_messages, token, phrase, top, folder_id, days, max_age, mode)
+    path, headers, params = _search_request(token, phrase, top, folder_id)
+    msgs = await acollect_messages(aiter_pages(path, headers=headers, params=params), top, cutoff=_cutoff(days))
+    await asyncio.to_thread(note_correspondents, token, msgs, folder_id)
+    return await afetch_bodies(token, msgs)
+
+# ---------- LLM pipeline (async) ----------
+async def acomplete_json(system_prompt, payload, use_cache=True, keys=("summary", "draft_html")) -> dict:
+    """_complete_json cu AsyncOpenAI; cache-ul (SQLite) e citit/scris într-un thread."""
+    user_content, cache, key, hit = await asyncio.to_thread(llm_cached, system_prompt, payload, use_cache)
+    if hit is not None: return hit
+    async with llm_gate():
+        with metrics.span("llm", mode="complete") as s:
+            resp = await require_allm(build=True).chat.completions.create(model=DEFAULT_MODEL, temperature=0.2, messages=llm_messages(system_prompt, user_content))
+            if s.active: record_llm_usage(s, getattr(resp, "usage", None))
+    return await asyncio.to_thread(parse_llm_json, resp.choices[0].message.content, keys, cache, key)
+
+async def _anotes(system_prompt, payloads, use_cache):
+    """Câmpul notes pentru fiecare payload, cel mult LLM_MAP_CONCURRENCY apeluri simultan."""
+    sem = asyncio.Semaphore(max(1, LLM_MAP_CONCURRENCY))
+    async def one(p):
+        async with sem:
+            return (await acomplete_json(system_prompt, p, use_cache=use_cache, keys=("notes",)))["notes"]
+    return await asyncio.gather(*(one(p) for p in payloads))
+
+async def asummarize(system_prompt, payload, use_cache=True) -> dict:
+    plan = await asyncio.to_thread(map_reduce_plan, payload)
+    if plan is None:
+        return await acomplete_json(system_prompt, payload, use_cache=use_cache)
+    parts, reduce_payload = plan
+    notes = await _anotes(MAP_SYSTEM_PROMPT, parts, use_cache)
+    return await acomplete_json(system_prompt, reduce_payload(notes), use_cache=use_cache)
+
+async def _abuild_payload(base, emails, by_thread, use_cache):
+    with metrics.span("prompt_build") as s:
+        if by_thread:
+            from conversations import THREAD_SYSTEM_PROMPT, plan_threads
+            payload, jobs = await asyncio.to_thread(plan_threads, base, emails)
+            for (entry, _), n in zip(jobs, await _anotes(THREAD_SYSTEM_PROMPT, [j for _, j in jobs], use_cache)):
+                entry["notes"] = n
+        else:
+            payload = await asyncio.to_thread(emails_payload, base, emails)
+        if s.active: await asyncio.to_thread(record_prompt, s, payload, len(emails))
+    return payload
+
+async def agenerate_summary_and_reply(emails, sender_hint=None, tone="brief-firm", propose_slot=None, timezone_name="Europe/Bucharest", use_cache=True, by_thread=True):
+    require_allm()
+    base = summary_base(sender_hint, tone, propose_slot, timezone_name)
+    data = await asummarize(SYSTEM_PROMPT, await _abuild_payload(base, emails, by_thread, use_cache), use_cache=use_cache)
+    return data["summary"], data["draft_html"]
+
+async def agenerate_search_summary_and_reply(emails, query, tone="brief-firm", timezone_name="Europe/Bucharest", use_cache=True, by_thread=True):
+    require_allm()
+    base = search_base(query, tone, timezone_name)
+    data = await asummarize(SEARCH_SYSTEM_PROMPT, await _abuild_payload(base, emails, by_thread, use_cache), use_cache=use_cache)
+    return data["summary"], data["draft_html"]
+
+# ---------- LLM streaming ----------
+async def astream_complete_json(system_prompt, payload, use_cache=True, keys=("summary", "draft_html")):
+    """
+    acomplete_json cu stream=True: yield (cheie, text) pe măsură ce modelul scrie valorile string,
+    apoi (None, rezultat). Un hit în cache vine ca o singură bucată per cheie.
+    """
+    user_content, cache, key, hit = await asyncio.to_thread(llm_cached, system_prompt, payload, use_cache)
+    if hit is None:
+        parser, parts = JsonStreamParser(), []
+        async with llm_gate():
+            with metrics.span("llm", mode="stream") as s:
+                stream = await require_allm(build=True).chat.completions.create(model=DEFAULT_MODEL, temperature=0.2, stream=True,
+                                                                                response_format={"type": "json_object"},
+                                                                                stream_options={"include_usage": True},
+                                                                                messages=llm_messages(system_prompt, user_content))
+                async for chunk in stream:
+                    if s.active and getattr(chunk, "usage", None): record_llm_usage(s, chunk.usage)
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if not text: continue
+                    if not parts and s.active:
+                        ttft = time.perf_counter() - s.t0
+                        s.set(first_token_ms=round(ttft * 1000, 2))
+                        metrics.observe("kb_llm_first_token_seconds", ttft)
+                    parts.append(text)
+                    for k, delta in parser.feed(text):
+                        if k in keys: yield k, delta
+        yield None, await asyncio.to_thread(stream_result, "".join(parts), parser, keys, cache, key)
+        return
+    for k in keys:
+        if hit.get(k): yield k, hit[k]
+    yield None, hit
+
+async def astream_summarize(system_prompt, payload, use_cache=True):
+    """asummarize, dar apelul final (singurul sau reduce-ul după map) e streamuit."""
+    plan = await asyncio.to_thread(map_reduce_plan, payload)
+    if plan is not None:
+        parts, reduce_payload = plan
+        payload = reduce_payload(await _anotes(MAP_SYSTEM_PROMPT, parts, use_cache))
+    async for item in astream_complete_json(system_prompt, payload, use_cache=use_cache):
+        yield item
+
+async def astream_summary_and_reply(emails, sender_hint=None, tone="brief-firm", propose_slot=None, timezone_name="Europe/Bucharest", use_cache=True, by_thread=True):
+    """agenerate_summary_and_reply streamuit: (cheie, text)..., apoi (None, {summary, draft_html})."""
+    require_allm()
+    base = summary_base(sender_hint, tone, propose_slot, timezone_name)
+    async for item in astream_summarize(SYSTEM_PROMPT, await _abuild_payload(base, emails, by_thread, use_cache), use_cache=use_cache):
+        yield item
+
+async def astream_search_summary_and_reply(emails, query, tone="brief-firm", timezone_name="Europe/Bucharest", use_cache=True, by_thread=True):
+    require_allm()
+    base = search_base(query, tone, timezone_name)
+    async for item in astream_summarize(SEARCH_SYSTEM_PROMPT, await _abuild_payload(base, emails, by_thread, use_cache), use_cache=use_cache):
+        yield item
+
+# ---------- Draft reply (async) ----------
+async def acreate_reply_drafts(token: str, items):
+    """create_reply_drafts async: [(message_id, reply_html)] -> [{message_id, id, webLink, error}]."""
+    import httpx
+    items = list(items)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    reqs = reply_draft_requests(items)
+    with metrics.span("draft") as s:
+        s.set(drafts=len(reqs))
+        if len(reqs) == 1:
+            try:
+                draft = await agraph_post(reqs[0]["url"], headers=headers, data=reqs[0]["body"])
+                return [{"message_id": items[0][0], "id": draft["id"], "webLink": draft.get("webLink"), "error": None}]
+            except httpx.HTTPStatusError as e:
+                return [{"message_id": items[0][0], "id": None, "webLink": None, "error": f"{e} / {e.response.text[:500]}"}]
+        return reply_drafts_result(items, await agraph_batch(reqs, headers=headers))
+
+async def acreate_reply_draft(token: str, message_id: str, reply_html: str) -> str:
+    d = (await acreate_reply_drafts(token, [(message_id, reply_html)]))[0]
+    if d["error"]: raise RuntimeError(f"createReply a esuat: {d['error']}")
+    return d["id"]
@@ -12,86 +12,585 @@
 #   OPENAI_API_KEY=...
 #   DEFAULT_MODEL=gpt-4.1-mini
 #   TIMEZONE=Europe/Bucharest
+#   TOKEN_CACHE_DIR=.tokens       # un cache MSAL per cont (<login>.json); partajat sigur intre procese
+#   AUTH_FLOW=interactive         # interactive (browser local) | device_code (servere headless) | none (doar cache pre-populat)
 
-import os, sys, json, time, argparse, re
+import os, sys, json, time, argparse, re, random, shutil, threading, contextvars, hashlib
+import html as html_lib
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from html.parser import HTMLParser
 from pathlib import Path
 
-import msal, requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+# msal, requests si openai (~0.7 s la import impreuna) se incarca la prima folosire: msal_cache.py la primul
+# login/refresh, requests la prima cerere Graph (GraphTransport), openai la primul apel LLM (get_llm)
+
+if __name__ == "__main__":
+    # rulat ca script (python kb_mail.py): modulele ajutatoare (from kb_mail import ...) trebuie sa vada acest modul,
+    # nu o a doua copie cu AuthManager/scheduler/transport proprii (token_account ar intoarce None in ele)
+    sys.modules.setdefault("kb_mail", sys.modules[__name__])
 
 # ---------- env ----------
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(dotenv_path=BASE_DIR / ".env", override=True)
 
+import metrics   # dupa load_dotenv: citeste METRICS_* din env
+
 CLIENT_ID = os.getenv("CLIENT_ID")
 TENANT_ID = os.getenv("TENANT_ID", "consumers")
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gpt-4.1-mini")
 TZ_NAME = os.getenv("TIMEZONE", "Europe/Bucharest")
-if not CLIENT_ID:
-    raise RuntimeError("CLIENT_ID lipseste din .env")
 
 AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
 SCOPES = ["Mail.Read", "Mail.ReadWrite", "User.Read"]
 GRAPH = "https://graph.microsoft.com/v1.0"
-TOKEN_CACHE_FILE = ".token_cache.json"
+TOKEN_CACHE_FILE = ".token_cache.json"   # cache-ul unic de dinainte de conturi (cwd): doar sursa de import
+TOKEN_CACHE_DIR = os.getenv("TOKEN_CACHE_DIR", str(BASE_DIR / ".tokens"))
+AUTH_FLOW = os.getenv("AUTH_FLOW", "interactive").strip().lower()
 
 # ---------- LLM ----------
-try:
-    from openai import OpenAI
-    llm = OpenAI(api_key=OPENAI_KEY) if OPENAI_KEY else None
-except Exception:
-    llm = None
+llm = None   # clientul OpenAI, construit de get_llm() la primul apel (sau setat din afara, ex. bench); False = indisponibil
+_llm_lock = threading.Lock()
+
+def get_llm():
+    global llm
+    if llm is None:
+        with _llm_lock:
+            if llm is None:
+                try:
+                    from openai import OpenAI
+                    llm = OpenAI(api_key=OPENAI_KEY) if OPENAI_KEY else False
+                except Exception:
+                    llm = False
+    return llm
+
+def require_llm(build=False):
+    """
+    Eroarea "LLM neconfigurat" inainte de fetch si de cache (doar OPENAI_API_KEY, fara import);
+    build=True => clientul insusi, pentru apelul real.
+    """
+    client = get_llm() if build else (llm if llm is not None else OPENAI_KEY)
+    if not client: raise RuntimeError("LLM client nu este configurat. Seteaza OPENAI_API_KEY in .env")
+    return client
 
 # ---------- token cache ----------
-class FileCache(msal.SerializableTokenCache):
-    def __init__(self, filename):
-        super().__init__()
-        self.filename = filename
-        if os.path.exists(filename):
-            with open(filename, "r", encoding="utf-8") as f:
-                self.deserialize(f.read())
-    def persist(self):
-        with open(self.filename, "w", encoding="utf-8") as f:
-            f.write(self.serialize())
-
-def acquire_token_public(login_hint=None) -> str:
-    cache = FileCache(TOKEN_CACHE_FILE)
-    app = msal.PublicClientApplication(CLIENT_ID, authority=AUTHORITY, token_cache=cache)
-    accounts = app.get_accounts()
-    if accounts:
-        res = app.acquire_token_silent(SCOPES, account=accounts[0])
-        if res and "access_token" in res:
-            cache.persist(); return res["access_token"]
-    res = app.acquire_token_interactive(scopes=SCOPES, timeout=300, prompt="login", login_hint=login_hint)
-    if res and "access_token" in res:
-        cache.persist(); return res["access_token"]
-    raise RuntimeError(f"Interactive flow fără token: {res}")
+TOKEN_REFRESH_MARGIN = 300   # secunde: un access token e reinnoit cu atat inainte de expirare
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """
+    Lock exclusiv intre procese pe `path` (fcntl pe POSIX, msvcrt pe Windows); yield True.
+    blocking=False => nu asteapta: yield False daca lock-ul e tinut de altcineva.
+    """
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            try: msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            except OSError:
+                if blocking: raise
+                yield False; return
+            try: yield True
+            finally: f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            try: fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False; return
+            try: yield True
+            finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+RE_ACCOUNT_UNSAFE = re.compile(r"[^a-z0-9@._+-]+")
+
+def account_slug(login) -> str:
+    """Login-ul normalizat, sigur ca nume de fisier; fara login => "default"."""
+    return RE_ACCOUNT_UNSAFE.sub("_", (login or "").strip().lower()).strip("._") or "default"
+
+def account_path(base, login) -> str:
+    """`base` cu contul inaintea extensiei (.mail_store.sqlite3 -> .mail_store.ana@firma.ro.sqlite3); fara login => `base`."""
+    if not (login or "").strip(): return base
+    root, ext = os.path.splitext(base)
+    return f"{root}.{account_slug(login)}{ext}"
+
+class AuthManager:
+    """
+    Per cont: un fisier de cache MSAL (TOKEN_CACHE_DIR/<login>.json) cu propriul PublicClientApplication
+    (discovery-ul authority e comun, prin http_cache) si access token-ul tinut in memorie pana la
+    TOKEN_REFRESH_MARGIN inainte de expirare => o cerere obisnuita e doar un lookup in dict. Profilul /me
+    e memorat per cont. Intre procese (workeri uvicorn/gunicorn) refresh-ul si login-ul unui cont se
+    serializeaza pe <fisier>.auth.lock: urmatorul worker reciteste cache-ul si ia token-ul fara retea.
+    """
+    def __init__(self, cache_dir=TOKEN_CACHE_DIR, flow=AUTH_FLOW):
+        self.cache_dir, self.flow = cache_dir, flow
+        self.lock = threading.Lock()
+        self.apps = {}        # login -> (FileCache, PublicClientApplication), create la primul acquire care chiar are nevoie de MSAL
+        self.http_cache = {}  # raspunsurile de discovery MSAL, comune conturilor
+        self.account_locks = {}
+        self.tokens = {}     # login -> (access_token, expira_la)
+        self.owners = {}     # access_token -> login (cutia postala pentru throttling-ul Graph, store-ul local)
+        self.profiles = {}   # login -> /me
+
+    @staticmethod
+    def _key(login_hint):
+        return (login_hint or "").strip().lower()
+
+    def cache_file(self, login_hint=None) -> str:
+        return os.path.join(self.cache_dir, account_slug(login_hint) + ".json")
+
+    def logins(self) -> list:
+        """Conturile cu cache pe disc (None = contul implicit, fara --login); sync-ul din background le parcurge."""
+        try: names = sorted(n for n in os.listdir(self.cache_dir) if n.endswith(".json"))
+        except FileNotFoundError: return []
+        return [None if n == "default.json" else n[:-5] for n in names]
+
+    def cached_token(self, login_hint=None):
+        """Token-ul din memorie daca mai e valid, altfel None (fara disc, fara retea)."""
+        tok = self.tokens.get(self._key(login_hint))
+        return tok[0] if tok and tok[1] - TOKEN_REFRESH_MARGIN > time.time() else None
+
+    def _app(self, key, login_hint):
+        with self.lock:
+            if key not in self.apps:
+                if not CLIENT_ID: raise RuntimeError("CLIENT_ID lipseste din .env")
+                import msal
+                from msal_cache import FileCache
+                path = self.cache_file(login_hint)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                if not os.path.exists(path) and os.path.exists(TOKEN_CACHE_FILE):
+                    with file_lock(path + ".lock"):   # primul acces: conturile din vechiul cache unic
+                        if not os.path.exists(path): shutil.copyfile(TOKEN_CACHE_FILE, path)
+                cache = FileCache(path)
+                self.apps[key] = (cache, msal.PublicClientApplication(CLIENT_ID, authority=AUTHORITY, token_cache=cache, http_cache=self.http_cache))
+            return self.apps[key], self.account_locks.setdefault(key, threading.Lock())
+
+    def acquire(self, login_hint=None, interactive=True, on_device_code=None, force=False) -> str:
+        """
+        Memorie -> cache MSAL (silent/refresh) -> login dupa AUTH_FLOW. interactive=False => niciodata login
+        (sync-ul din background). force=True => login obligatoriu, chiar cu token in cache (UI_SERVER_MODE:
+        o sesiune noua dovedeste ca detine contul). on_device_code(mesaj) primeste URL-ul si codul device flow.
+        """
+        key = self._key(login_hint)
+        if not force and (tok := self.cached_token(key)): return tok
+        if force and self.flow == "none":
+            raise RuntimeError(f"Login necesar pentru {key or 'contul implicit'}, dar AUTH_FLOW=none")
+        (cache, app), account_lock = self._app(key, login_hint)
+        # un singur refresh/login per cont (thread-uri si procese); celelalte conturi nu asteapta
+        with account_lock, file_lock(cache.filename + ".auth.lock"), metrics.span("auth") as s:
+            if not force and (tok := self.cached_token(key)): return tok
+            cache.reload()
+            res = None
+            if not force:
+                accounts = app.get_accounts(username=login_hint) if key else app.get_accounts()
+                res = app.acquire_token_silent(SCOPES, account=accounts[0]) if accounts else None
+            if not (res and "access_token" in res):
+                if not interactive or self.flow == "none":
+                    raise RuntimeError(f"Nu exista token in cache pentru {key or 'contul implicit'} "
+                                       "(login necesar: python kb_mail.py --login ... --auth-only)")
+                s.set(interactive=True, flow=self.flow)
+                res = self._login(app, key, login_hint, on_device_code)
+                self.profiles.pop(key, None)
+            cache.persist()
+            if (old := self.tokens.get(key)): self.owners.pop(old[0], None)
+            self.tokens[key] = (res["access_token"], time.time() + int(res.get("expires_in", 0)))
+            self.owners[res["access_token"]] = key
+            return res["access_token"]
+
+    def _login(self, app, key, login_hint, on_device_code=None):
+        if self.flow == "device_code":
+            flow = app.initiate_device_flow(scopes=SCOPES)
+            if "user_code" not in flow:
+                raise RuntimeError(f"Device code flow fără cod: {flow.get('error_description') or flow}")
+            (on_device_code or (lambda msg: print(msg, file=sys.stderr, flush=True)))(flow["message"])
+            res = app.acquire_token_by_device_flow(flow)   # blocheaza pana la confirmarea din browser (sau expirarea codului)
+        else:
+            res = app.acquire_token_interactive(scopes=SCOPES, timeout=300, prompt="login", login_hint=login_hint)
+        if not (res and "access_token" in res):
+            raise RuntimeError(f"Login ({self.flow}) fără token: {res}")
+        who = ((res.get("id_token_claims") or {}).get("preferred_username") or "").lower()
+        if key and who and who != key:   # alt cont autentificat => nu ramane in cache-ul lui `key`
+            for a in app.get_accounts(username=who): app.remove_account(a)
+            app.token_cache.persist()
+            raise RuntimeError(f"Autentificat ca {who}, nu ca {key}")
+        return res
+
+    def profile(self, login_hint=None):
+        return self.profiles.get(self._key(login_hint))
+
+    def remember_profile(self, login_hint, me):
+        self.profiles[self._key(login_hint)] = me
+
+_auth = None
+_auth_lock = threading.Lock()
+
+def get_auth() -> AuthManager:
+    global _auth
+    if _auth is None:
+        with _auth_lock:
+            if _auth is None:
+                _auth = AuthManager()
+    return _auth
+
+def acquire_token_public(login_hint=None, interactive=True, on_device_code=None, force=False) -> str:
+    return get_auth().acquire(login_hint, interactive, on_device_code, force)
+
+def token_account(token):
+    """Login-ul (normalizat) caruia AuthManager i-a dat token-ul; None = contul implicit sau token necunoscut."""
+    return get_auth().owners.get(token) or None
+
+# ---------- Graph transport ----------
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+GRAPH_READ_TIMEOUT = float(os.getenv("GRAPH_READ_TIMEOUT", "60"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "4"))
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "16"))
+GRAPH_THROTTLE_RETRIES = int(os.getenv("GRAPH_THROTTLE_RETRIES", "10"))
+# limitele Outlook per aplicatie si cutie postala: 10.000 cereri / 10 min (~16/s) si 4 cereri simultane
+GRAPH_MAILBOX_RPS = float(os.getenv("GRAPH_MAILBOX_RPS", "16"))
+GRAPH_MAILBOX_BURST = float(os.getenv("GRAPH_MAILBOX_BURST", "40"))
+GRAPH_MAILBOX_CONCURRENCY = int(os.getenv("GRAPH_MAILBOX_CONCURRENCY", "4"))
+RETRY_STATUSES = {429, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "PATCH", "PUT", "DELETE"}
+
+def _retry_after_seconds(resp):
+    """Retry-After poate fi secunde sau HTTP-date; None daca lipseste/e invalid."""
+    if resp is None: return None
+    ra = resp.headers.get("Retry-After")
+    if not ra: return None
+    try:
+        return max(0.0, float(ra))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(ra) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+def graph_url(path) -> str:
+    return path if path.startswith("http") else f"{GRAPH}{path}"
+
+class RetryPolicy:
+    """
+    Backoff + decizia de retry, comune transportului sync (requests) si celui async (kb_async.py, httpx).
+    429 are bugetul lui (GRAPH_THROTTLE_RETRIES): asteptarea e pauza comuna a cutiei postale, nu un esec.
+    """
+    def __init__(self, max_retries=GRAPH_MAX_RETRIES, backoff_base=0.5, backoff_max=30.0, throttle_retries=GRAPH_THROTTLE_RETRIES):
+        self.max_retries = max_retries
+        self.throttle_retries = throttle_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt, resp=None) -> float:
+        ra = _retry_after_seconds(resp)
+        if ra is not None:
+            return min(self.backoff_max, ra) + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))  # full jitter
+
+    def should_retry(self, method, status, attempt) -> bool:
+        if status == 429: return attempt < max(self.max_retries, self.throttle_retries)
+        return attempt < self.max_retries and status in RETRY_STATUSES and method in IDEMPOTENT_METHODS
+
+# ---------- Graph throttling (per cutie postala) ----------
+INTERACTIVE, BACKGROUND = 0, 1
+_graph_priority = contextvars.ContextVar("graph_priority", default=INTERACTIVE)
+
+@contextmanager
+def graph_priority(level):
+    """Prioritatea cererilor Graph din contextul curent (thread/task): BACKGROUND cedeaza locul celor INTERACTIVE."""
+    token = _graph_priority.set(level)
+    try: yield
+    finally: _graph_priority.reset(token)
+
+class MailboxGate:
+    """
+    Starea de throttling a unei cutii postale, comuna tuturor thread-urilor si event loop-urilor din proces:
+    token bucket (rate/s, burst), cel mult `limit` cereri in zbor si pauza globala dupa un 429 (Retry-After).
+    try_acquire nu asteapta: intoarce 0 (loc obtinut) sau cat mai e de asteptat (inf = pana la un release);
+    asteptarea e a apelantului (slot() cu threading.Event, kb_async.aslot() cu asyncio.Event), trezit prin `wakers`.
+    O cerere BACKGROUND nu ia locul cat timp asteapta vreo cerere INTERACTIVE.
+    """
+    def __init__(self, rate=GRAPH_MAILBOX_RPS, burst=GRAPH_MAILBOX_BURST, limit=GRAPH_MAILBOX_CONCURRENCY):
+        self.rate, self.burst, self.limit = rate, max(1.0, burst), limit   # rate/limit 0 => fara plafon
+        self.lock = threading.Lock()
+        self.tokens, self.stamp = self.burst, time.monotonic()
+        self.paused_until = 0.0
+        self.active = 0
+        self.waiting = [0, 0]   # asteptatori per prioritate
+        self.wakers = {}        # waker -> prioritate
+
+    def _wait(self, priority, cost, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if now < self.paused_until: return self.paused_until - now
+        if (self.limit and self.active >= self.limit) or (priority > INTERACTIVE and self.waiting[INTERACTIVE]): return float("inf")
+        need = min(cost, self.burst)   # un $batch mai mare decat burst-ul intra pe datorie (tokens < 0)
+        if self.rate > 0 and self.tokens < need: return (need - self.tokens) / self.rate
+        return 0.0
+
+    def try_acquire(self, priority, cost, waker) -> float:
+        with self.lock:
+            wait = self._wait(priority, cost, time.monotonic())
+            if wait == 0:
+                if self.wakers.pop(waker, None) is not None: self.waiting[priority] -= 1
+                self.active += 1
+                if self.rate > 0: self.tokens -= cost
+            elif waker not in self.wakers:
+                self.wakers[waker] = priority; self.waiting[priority] += 1
+            return wait
+
+    def cancel(self, waker):
+        with self.lock:
+            if (p := self.wakers.pop(waker, None)) is not None: self.waiting[p] -= 1
+        self._wake()
+
+    def release(self):
+        with self.lock: self.active -= 1
+        self._wake()
+
+    def pause(self, seconds):
+        """Retry-After: toate cererile cutiei postale (in asteptare sau noi) stau `seconds`; bucket-ul se goleste."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+        metrics.count("kb_graph_throttle_pauses_total")
+        self._wake()
+
+    def _wake(self):
+        with self.lock: wakers = list(self.wakers)
+        for w in wakers: w()
+
+    @contextmanager
+    def slot(self, priority=None, cost=1):
+        """with gate.slot(): ... — o cerere Graph sincrona; asteapta pauza, bucket-ul si un loc liber."""
+        priority = _graph_priority.get() if priority is None else priority
+        ev, t0 = threading.Event(), time.perf_counter()
+        try:
+            while (wait := self.try_acquire(priority, cost, ev.set)) > 0:
+                ev.wait(min(wait, 1.0)); ev.clear()
+        except BaseException:
+            self.cancel(ev.set); raise
+        queue_metrics(priority, t0)
+        try: yield
+        finally: self.release()
+
+def queue_metrics(priority, t0):
+    metrics.observe("kb_graph_queue_seconds", time.perf_counter() - t0, priority="background" if priority else "interactive")
+
+def request_cost(path, kwargs) -> int:
+    """Cat consuma cererea din bucket: un /$batch conteaza cat sub-cererile lui (asa il socoteste si Graph)."""
+    if path.split("?", 1)[0].endswith("/$batch"):
+        return max(1, len((kwargs.get("json") or {}).get("requests") or []))
+    return 1
+
+class GraphScheduler:
+    """Cate un MailboxGate per cutie postala (login-ul token-ului din AuthManager; altfel hash-ul token-ului)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.gates = {}
+
+    def gate(self, headers=None) -> MailboxGate:
+        auth = (headers or {}).get("Authorization", "")
+        token = auth.split(" ", 1)[-1]
+        key = get_auth().owners.get(token)
+        if key is None: key = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16] if token else ""
+        g = self.gates.get(key)
+        if g is None:
+            with self.lock:
+                g = self.gates.get(key)
+                if g is None: g = self.gates[key] = MailboxGate(GRAPH_MAILBOX_RPS, GRAPH_MAILBOX_BURST, GRAPH_MAILBOX_CONCURRENCY)
+        return g
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> GraphScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = GraphScheduler()
+    return _scheduler
+
+def record_response(method, path, status, nbytes):
+    """Contoarele unui raspuns Graph (comune transportului sync si celui async)."""
+    metrics.count("kb_graph_requests_total", method=method, path=path, status=status)
+    metrics.count("kb_graph_bytes_total", nbytes, path=path)
+
+class GraphTransport(RetryPolicy):
+    """
+    O singura sesiune HTTP per proces: conexiuni keep-alive reutilizate (pool urllib3, thread-safe),
+    timeouts connect/read configurabile si retry cu backoff exponential + jitter. Fiecare incercare trece
+    prin MailboxGate-ul cutiei postale (get_scheduler), comun cu transportul async.
+      - 429: retry pentru orice metoda (cererea nu a fost procesata); Retry-After pune pe pauza toata cutia postala.
+      - 503/504 si read timeout: retry doar pentru metode idempotente (createReply e POST).
+      - erori de conectare: retry mereu (nu s-a trimis nimic).
+    """
+    def __init__(self, connect_timeout=GRAPH_CONNECT_TIMEOUT, read_timeout=GRAPH_READ_TIMEOUT,
+                 max_retries=GRAPH_MAX_RETRIES, pool_size=GRAPH_POOL_SIZE, backoff_base=0.5, backoff_max=30.0):
+        super().__init__(max_retries, backoff_base, backoff_max)
+        self.timeout = (connect_timeout, read_timeout)
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, path, **kwargs):
+        import requests
+        url = graph_url(path)
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        gate, cost = get_scheduler().gate(kwargs.get("headers")), request_cost(path, kwargs)
+        attempt, label = 0, metrics.graph_path(url)
+        with metrics.span("graph", "kb_graph_request_seconds", method=method, path=label) as s:
+            while True:
+                try:
+                    with gate.slot(cost=cost):
+                        r = self.session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    retriable = not isinstance(e, requests.ReadTimeout) or method in IDEMPOTENT_METHODS
+                    if not retriable or attempt >= self.max_retries: raise
+                    metrics.count("kb_graph_retries_total", reason="network", level="http")
+                    time.sleep(self.backoff(attempt)); attempt += 1
+                    continue
+                if s.active: record_response(method, label, r.status_code, len(r.content))
+                if not self.should_retry(method, r.status_code, attempt):
+                    s.set(status=r.status_code, retries=attempt)
+                    return r
+                metrics.count("kb_graph_retries_total", reason=str(r.status_code), level="http")
+                if r.status_code == 429: gate.pause(self.backoff(attempt, r))   # asteptarea e in gate.slot()
+                else: time.sleep(self.backoff(attempt, r))
+                attempt += 1
+
+    def close(self):
+        self.session.close()
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> GraphTransport:
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = GraphTransport()
+    return _transport
 
 # ---------- Graph helpers ----------
 def graph_get(path, headers=None, params=None):
-    url = f"{GRAPH}{path}"
-    r = requests.get(url, headers=headers, params=params)
-    if r.status_code == 429:
-        time.sleep(int(r.headers.get("Retry-After", "3"))); r = requests.get(url, headers=headers, params=params)
+    r = get_transport().request("GET", path, headers=headers, params=params)
     r.raise_for_status(); return r.json()
 
 def graph_post(path, headers=None, data=None):
-    url = f"{GRAPH}{path}"
-    r = requests.post(url, headers=headers, json=data or {})
-    if r.status_code == 429:
-        time.sleep(int(r.headers.get("Retry-After", "3"))); r = requests.post(url, headers=headers, json=data or {})
+    r = get_transport().request("POST", path, headers=headers, json=data or {})
     r.raise_for_status(); return r.json()
 
 def graph_patch(path, headers=None, data=None):
-    url = f"{GRAPH}{path}"
-    r = requests.patch(url, headers=headers, json=data or {})
-    if r.status_code == 429:
-        time.sleep(int(r.headers.get("Retry-After", "3"))); r = requests.patch(url, headers=headers, json=data or {})
+    r = get_transport().request("PATCH", path, headers=headers, json=data or {})
     r.raise_for_status(); return r.json() if r.text else {}
 
+ME_SELECT = "userPrincipalName,mail,id,displayName"
+
+def graph_me(token, login_hint=None) -> dict:
+    """Profilul /me, memorat per cont in AuthManager (nu se schimba intre cereri)."""
+    auth = get_auth()
+    me = auth.profile(login_hint)
+    if me is None:
+        me = graph_get("/me", headers={"Authorization": f"Bearer {token}"}, params={"$select": ME_SELECT})
+        auth.remember_profile(login_hint, me)
+    return me
+
+# ---------- JSON $batch ----------
+GRAPH_BATCH_MAX = 20   # limita Graph de sub-cereri per /$batch
+
+def batch_chunks(reqs):
+    """
+    Loturi de cel mult GRAPH_BATCH_MAX sub-cereri, in ordinea data. Un lant dependsOn ramane in acelasi
+    lot (Graph nu rezolva dependente intre loturi); un lant mai lung decat limita e o eroare.
+    """
+    group_of, groups = {}, OrderedDict()
+    for r in reqs:
+        roots = list(OrderedDict.fromkeys(group_of[d] for d in (r.get("dependsOn") or []) if d in group_of))
+        g = roots[0] if roots else r["id"]
+        groups.setdefault(g, [])
+        for other in roots[1:]:   # cererea leaga doua lanturi => le unim
+            for x in groups.pop(other): group_of[x["id"]] = g; groups[g].append(x)
+        groups[g].append(r); group_of[r["id"]] = g
+    chunks, cur = [], []
+    for g in groups.values():
+        if len(g) > GRAPH_BATCH_MAX: raise ValueError(f"lant dependsOn de {len(g)} cereri > {GRAPH_BATCH_MAX}")
+        if len(cur) + len(g) > GRAPH_BATCH_MAX:
+            chunks.append(cur); cur = []
+        cur += g
+    if cur: chunks.append(cur)
+    return chunks
+
+class BatchRun:
+    """
+    Starea unui graph_batch / agraph_batch: sub-cererile ramase si raspunsurile finale (id -> {status, headers, body}).
+    Sub-cererile throttled (429; 503/504 doar idempotente) si cele esuate doar din cauza lor (424) se retrimit
+    intr-o runda urmatoare, dupa cel mai mare Retry-After din runda.
+    """
+    def __init__(self, reqs, policy):
+        self.policy, self.pending, self.results, self.attempt = policy, list(reqs), {}, 0
+        self.throttled = False   # runda curenta a avut 429 => pauza e a cutiei postale, nu doar a batch-ului
+
+    def chunks(self):
+        return batch_chunks(self.pending)
+
+    def absorb(self, responses):
+        """Raspunsurile unei runde; intoarce pauza (s) inainte de runda urmatoare sau None daca am terminat."""
+        by_id = {r["id"]: r for r in self.pending}
+        resp_of = {str(r.get("id")): r for r in responses}
+        retry, waits, self.throttled = set(), [], False
+        for rid, resp in resp_of.items():
+            req = by_id.get(rid)
+            if req and self.policy.should_retry(req["method"].upper(), resp.get("status", 0), self.attempt):
+                metrics.count("kb_graph_retries_total", reason=str(resp.get("status")), level="batch")
+                retry.add(rid); self.throttled |= resp.get("status") == 429
+                waits.append(self.policy.backoff(self.attempt, _SubResponse(resp)))
+        grew = True
+        while grew:   # dependentii (424) ai cererilor retrimise se retrimit si ei
+            extra = {rid for rid, resp in resp_of.items() if rid not in retry and resp.get("status") == 424
+                     and set(by_id.get(rid, {}).get("dependsOn") or []) & retry}
+            grew = bool(extra); retry |= extra
+        for rid, resp in resp_of.items():
+            if rid not in retry: self.results[rid] = resp
+        self.pending = [r for r in self.pending if r["id"] in retry]
+        if not self.pending: return None
+        self.attempt += 1
+        return max(waits, default=0.0)
+
+class _SubResponse:
+    """Adaptor minim ca _retry_after_seconds sa citeasca headerele unei sub-cereri $batch."""
+    def __init__(self, resp):
+        self.headers = {k.title(): v for k, v in (resp.get("headers") or {}).items()}
+
+def graph_batch(reqs, headers=None):
+    """
+    POST /$batch pentru sub-cererile date ({id, method, url relativ, [body, headers, dependsOn]}).
+    Intoarce {id: {status, headers, body}}; statusul fiecarei sub-cereri trebuie verificat de apelant.
+    """
+    run = BatchRun(reqs, get_transport())
+    while True:
+        responses = []
+        for chunk in run.chunks():
+            responses += graph_post("/$batch", headers=headers, data={"requests": chunk}).get("responses", [])
+        delay = run.absorb(responses)
+        if delay is None: return run.results
+        if run.throttled: get_scheduler().gate(headers).pause(delay)   # runda urmatoare asteapta in gate
+        else: time.sleep(delay)
+
+def batch_error(resp) -> str:
+    err = (resp.get("body") or {}).get("error") if isinstance(resp.get("body"), dict) else None
+    return f"{resp.get('status')}: {(err or {}).get('message') or (err or {}).get('code') or 'eroare Graph'}"
+
 # ---------- util: parse datetime ----------
 def _parse_iso_dt(s: str):
     try:
@@ -99,17 +598,168 @@ def _parse_iso_dt(s: str):
     except Exception:
         return None
 
+# ---------- pagination (@odata.nextLink) ----------
+GRAPH_PAGE_SIZE = 50
+MESSAGE_SELECT = "id,changeKey,subject,from,toRecipients,ccRecipients,receivedDateTime,body,bodyPreview,conversationId,webLink"
+LIST_SELECT = MESSAGE_SELECT.replace(",body,", ",")   # faza 1: metadate + bodyPreview, fara body
+
+def iter_pages(path, headers=None, params=None):
+    """
+    Generator lazy peste paginile unei colectii Graph: urmeaza @odata.nextLink doar cand
+    consumatorul cere pagina urmatoare. nextLink contine deja toti parametrii ($search, $skiptoken...).
+    """
+    data = graph_get(path, headers=headers, params=params)
+    while True:
+        metrics.count("kb_graph_pages_total")
+        yield data.get("value", [])
+        next_link = data.get("@odata.nextLink")
+        if not next_link: return
+        data = graph_get(next_link, headers=headers)
+
+def _cutoff(days, since=None):
+    """Limita inferioara de data: ultimele `days` zile si/sau `since` (datetime), cea mai recenta dintre ele."""
+    c = datetime.now(timezone.utc) - timedelta(days=days) if days is not None else None
+    return max(c, since) if c is not None and since is not None else (c or since)
+
+def _sender_matcher(sender=None, domain=None):
+    """Potrivire locala pe adresa expeditorului ($search "from:" e fuzzy, prinde si display name)."""
+    if sender:
+        want = sender.strip().lower()
+        return lambda a: a == want
+    if domain:
+        want = domain.strip().lower().lstrip("@")
+        return lambda a: a.endswith("@" + want) or a.endswith("." + want)
+    return None
+
+def _from_address(m) -> str:
+    return ((m.get("from") or {}).get("emailAddress") or {}).get("address", "").lower()
+
+class PageCollector:
+    """
+    Strange `top` mesaje care trec de cutoff + match, pagina cu pagina (comun iter_pages / aiter_pages).
+    Rezultatele $search vin in ordine descrescatoare dupa data => o pagina integral mai veche
+    decat cutoff inseamna ca paginile urmatoare nu mai pot contribui, ne oprim.
+    """
+    def __init__(self, top, cutoff=None, match=None):
+        self.top, self.cutoff, self.match, self.out = top, cutoff, match, []
+
+    def add(self, page) -> bool:
+        """Adauga o pagina; True => nu mai e nevoie de pagina urmatoare."""
+        older = 0
+        for m in page:
+            dt = _parse_iso_dt(m.get("receivedDateTime", ""))
+            if self.cutoff is not None and (not dt or dt < self.cutoff):
+                older += 1; continue
+            if self.match and not self.match(_from_address(m)): continue
+            self.out.append(m)
+        return len(self.out) >= self.top or (self.cutoff is not None and bool(page) and older == len(page))
+
+    def result(self):
+        return sorted(self.out, key=lambda m: m.get("receivedDateTime", ""), reverse=True)[:self.top]
+
+def collect_messages(pages, top, cutoff=None, match=None):
+    """Consuma pagini (lazy) pana cand PageCollector are destule mesaje."""
+    c = PageCollector(top, cutoff, match)
+    with metrics.span("pagination") as s:
+        for page in pages:
+            if c.add(page): break
+        out = c.result()
+        s.set(messages=len(out))
+    return out
+
+# ---------- faza 2: body doar pentru setul final ----------
+GRAPH_BODY_TEXT = os.getenv("GRAPH_BODY_TEXT", "0") == "1"   # body ca text simplu (Graph converteste), fara parsare HTML
+PREFER_TEXT_BODY = 'outlook.body-content-type="text"'
+
+def body_requests(msgs, text=GRAPH_BODY_TEXT):
+    """
+    Sub-cererile $batch pentru body-urile lipsa din `msgs` (id = pozitia in lista). Un mesaj al carui text
+    curatat e deja in memo (id, changeKey) nu se mai descarca: textul din memo devine direct body-ul lui.
+    """
+    reqs = []
+    for k, m in enumerate(msgs):
+        if m.get("body") is not None: continue
+        if (memo := _memo_get((m.get("id"), m.get("changeKey")))) is not None:
+            m["body"] = {"contentType": "text", "content": memo}; continue
+        r = {"id": str(k), "method": "GET", "url": f"/me/messages/{m['id']}?$select=body,changeKey"}
+        if text: r["headers"] = {"Prefer": PREFER_TEXT_BODY}
+        reqs.append(r)
+    return reqs
+
+def apply_bodies(msgs, responses):
+    """Pune body-urile descarcate in mesaje; un mesaj care nu mai poate fi citit (ex. 404) ramane cu bodyPreview."""
+    for rid, r in responses.items():
+        m = msgs[int(rid)]
+        data = r.get("body") if 200 <= r.get("status", 0) < 300 and isinstance(r.get("body"), dict) else {}
+        if data.get("changeKey"): m["changeKey"] = data["changeKey"]
+        m["body"] = data.get("body") or {"contentType": "text", "content": m.get("bodyPreview", "")}
+    return msgs
+
+def fetch_bodies(token, msgs, text=GRAPH_BODY_TEXT):
+    """Faza 2 a fetch-ului: body-urile setului final, 20 per /$batch. Listarea (faza 1) aduce doar bodyPreview."""
+    reqs = body_requests(msgs, text)
+    if reqs:
+        with metrics.span("bodies") as s:
+            s.set(requests=len(reqs), memo_hits=len(msgs) - len(reqs))
+            apply_bodies(msgs, graph_batch(reqs, headers={"Authorization": f"Bearer {token}"}))
+    return msgs
+
+# ---------- local mailbox store (mail_store.py) ----------
+MAIL_STORE_MAX_AGE = float(os.getenv("MAIL_STORE_MAX_AGE")) if os.getenv("MAIL_STORE_MAX_AGE") else None
+
+def _local_store(token, folder_id=None, max_age=None, sync=True):
+    """
+    Store-ul local daca poate raspunde: folderul cerut e sincronizat si sync-ul nu e mai vechi de max_age
+    secunde (altfel facem intai un sync delta incremental). None => interogam Graph direct.
+    Cu sync=False nu sincronizam: intoarcem store-ul daca a fost sincronizat macar o data.
+    """
+    if max_age is None: return None
+    from mail_store import get_store
+    store = get_store(token_account(token))
+    if folder_id and folder_id not in store.folders: return None
+    folders = [folder_id] if folder_id else store.folders
+    age = store.age(folders)
+    if not sync:
+        return store if age is not None else None
+    if age is None or age > max_age:
+        store.sync(token, folders)
+    return store
+
+# ---------- correspondent index (correspondents.py) ----------
+def note_correspondents(token, msgs, folder_id=None):
+    """Mesajele aduse din Graph -> indexul de corespondenți al contului; contul însuși = login + adresele din /me."""
+    if not msgs: return
+    from correspondents import get_correspondents
+    login = token_account(token)
+    index = get_correspondents(login)
+    if index is None: return
+    me = get_auth().profile(login) or {}
+    index.ingest(msgs, folder_id, me=(login, me.get("mail"), me.get("userPrincipalName")))
+
 # ---------- Email fetch (by sender/domain) ----------
-def fetch_last_messages(token: str, sender=None, domain=None, top=5, folder_id=None, days=None):
+def fetch_last_messages(token: str, sender=None, domain=None, top=5, folder_id=None, days=None, max_age=MAIL_STORE_MAX_AGE, since=None):
     """
     Outlook.com/MSA:
-      - $search NU merge cu $orderby; NU combina $search cu $filter => filtrăm local pe zile.
+      - $search NU merge cu $orderby; NU combina $search cu $filter => filtrăm local pe zile,
+        pe masura ce paginile (nextLink) sosesc, si ne oprim cand avem `top` mesaje.
+    Cu max_age setat (MAIL_STORE_MAX_AGE) raspundem din store-ul local sincronizat delta.
+    since (datetime) = doar mesajele primite de atunci incoace (watermark-ul din watermarks.py).
     """
+    store = _local_store(token, folder_id, max_age)
+    if store is not None:
+        return store.query(sender=sender, domain=domain, since=_cutoff(days, since),
+                           folders=[folder_id] if folder_id else None, limit=top)
+
+    path, headers, params, collect = _list_request(token, sender, domain, top, folder_id, days, since)
+    msgs = collect_messages(iter_pages(path, headers=headers, params=params), top, **collect)
+    note_correspondents(token, msgs, folder_id)
+    return fetch_bodies(token, msgs)
+
+def _list_request(token, sender=None, domain=None, top=5, folder_id=None, days=None, since=None):
+    """(path, headers, params, kwargs PageCollector) pentru listarea Graph — comun variantei sync si async."""
     headers = {"Authorization": f"Bearer {token}"}
     path = f"/me/mailFolders/{folder_id}/messages" if folder_id else "/me/messages"
-    params = {
-        "$select": "id,subject,from,toRecipients,ccRecipients,receivedDateTime,body,bodyPreview,conversationId,webLink",
-    }
+    params = {"$select": LIST_SELECT}
 
     search_term = None
     if sender:
@@ -120,50 +770,79 @@ def fetch_last_messages(token: str, sender=None, domain=None, top=5, folder_id=N
     if search_term:
         headers["ConsistencyLevel"] = "eventual"
         params["$search"] = f"\"{search_term}\""
-        params["$top"] = max(top * 5, 25)  # oversample
-        data = graph_get(path, headers=headers, params=params)
-        items = data.get("value", [])
-        if days is not None:
-            cutoff = datetime.now(timezone.utc) - timedelta(days=days)
-            items = [m for m in items if (dt := _parse_iso_dt(m.get("receivedDateTime",""))) and dt >= cutoff]
-        items.sort(key=lambda m: m.get("receivedDateTime",""), reverse=True)
-        return items[:top]
+        params["$top"] = min(max(top * 2, 10), GRAPH_PAGE_SIZE)
+        return path, headers, params, {"cutoff": _cutoff(days, since), "match": _sender_matcher(sender, domain)}
 
     # fără $search – putem folosi $filter + $orderby
-    if days is not None:
-        dt = datetime.now(timezone.utc) - timedelta(days=days)
-        params["$filter"] = f"receivedDateTime ge {dt.isoformat()}"
+    if (cutoff := _cutoff(days, since)) is not None:
+        params["$filter"] = f"receivedDateTime ge {cutoff.strftime('%Y-%m-%dT%H:%M:%SZ')}"
     params["$orderby"] = "receivedDateTime desc"
-    params["$top"] = top
-    data = graph_get(path, headers=headers, params=params)
-    return data.get("value", [])
+    params["$top"] = min(top, GRAPH_PAGE_SIZE)
+    return path, headers, params, {}
 
 # ---------- NEW: Search by keyword/phrase ----------
-def search_messages(token: str, phrase: str, top=20, folder_id=None, days=None):
+SEARCH_MODES = ("keyword", "semantic", "hybrid")
+
+def search_messages(token: str, phrase: str, top=20, folder_id=None, days=None, max_age=MAIL_STORE_MAX_AGE, mode="keyword"):
     """
     Căutare full-text cu $search="phrase". Nu combinăm cu $filter/$orderby.
-    Facem oversample, apoi sortăm local + filtrăm pe zile local.
+    Paginăm lazy (nextLink), filtrăm pe zile local și ne oprim la `top` rezultate.
+    Cu max_age setat, backend-ul principal e indexul FTS local (frază, from:, after:/before:, sortare pe dată);
+    Graph e întrebat doar pentru coada neindexată (mesaje mai noi decât ultimul sync), dacă store-ul e vechi.
+    mode="semantic"/"hybrid" => indexul vectorial din semantic.py, mereu peste store (sincronizat la nevoie);
+    primele `top` dupa relevanta, intoarse tot in ordinea datei.
     """
+    if mode in ("semantic", "hybrid"):
+        from semantic import semantic_search
+        store = _local_store(token, folder_id, max_age if max_age is not None else float("inf"))
+        if store is None: raise ValueError(f"folderul {folder_id} nu e in MAIL_STORE_FOLDERS (cautarea semantica e locala)")
+        hits = semantic_search(store, phrase, top, since=_cutoff(days), folders=[folder_id] if folder_id else None, mode=mode)
+        # top-k dupa relevanta, apoi ordinea comuna tuturor modurilor (cel mai nou primul): draftul si map-reduce se bazeaza pe ea
+        return sorted(hits, key=lambda m: m.get("receivedDateTime", ""), reverse=True)
+    store = _local_store(token, folder_id, max_age, sync=False)
+    if store is not None:
+        return _search_local(token, store, phrase, top, folder_id, days, max_age)
+    msgs = _search_graph(token, phrase, top, folder_id, cutoff=_cutoff(days))
+    note_correspondents(token, msgs, folder_id)
+    return fetch_bodies(token, msgs)
+
+def _search_graph(token, phrase, top, folder_id=None, cutoff=None, match=None):
+    path, headers, params = _search_request(token, phrase, top, folder_id)
+    return collect_messages(iter_pages(path, headers=headers, params=params), top, cutoff=cutoff, match=match)
+
+def _search_request(token, phrase, top, folder_id=None):
     headers = {"Authorization": f"Bearer {token}", "ConsistencyLevel": "eventual"}
     path = f"/me/mailFolders/{folder_id}/messages" if folder_id else "/me/messages"
     params = {
         "$search": f"\"{phrase}\"",
-        "$top": max(top * 5, 50),  # oversample
-        "$select": "id,subject,from,toRecipients,ccRecipients,receivedDateTime,body,bodyPreview,conversationId,webLink",
+        "$top": min(max(top, 10), GRAPH_PAGE_SIZE),
+        "$select": LIST_SELECT,
     }
-    data = graph_get(path, headers=headers, params=params)
-    items = data.get("value", [])
+    return path, headers, params
 
-    if days is not None:
-        cutoff = datetime.now(timezone.utc) - timedelta(days=days)
-        items = [m for m in items if (dt := _parse_iso_dt(m.get("receivedDateTime",""))) and dt >= cutoff]
+def _search_local(token, store, phrase, top, folder_id, days, max_age):
+    from mail_store import parse_query
+    q = parse_query(phrase)
+    folders = [folder_id] if folder_id else None
+    items = store.search(q, since=_cutoff(days), folders=folders, limit=top)
+    if store.age(folders) <= max_age:
+        return items
 
-    items.sort(key=lambda m: m.get("receivedDateTime",""), reverse=True)
-    return items[:top]
+    # fallback Graph doar pentru mesajele sosite după ultimul sync (încă neindexate)
+    since = max([d for d in (_cutoff(days), q["after"], store.newest_received(folders)) if d is not None], default=None)
+    kql = " ".join(q["phrases"] + q["subject"]) or (f"from:{q['sender'] or q['domain']}" if q["sender"] or q["domain"] else phrase)
+    fresh = _search_graph(token, kql, top, folder_id, cutoff=since, match=_sender_matcher(q["sender"], q["domain"]))
+    if q["before"] is not None:
+        fresh = [m for m in fresh if (dt := _parse_iso_dt(m.get("receivedDateTime", ""))) and dt < q["before"]]
+    note_correspondents(token, fresh, folder_id)
+    merged = {m["id"]: m for m in items}
+    for m in fresh: merged.setdefault(m["id"], m)
+    return fetch_bodies(token, sorted(merged.values(), key=lambda m: m.get("receivedDateTime", ""), reverse=True)[:top])
 
 def extract_participants(messages):
     """
     Returnează setul de adrese unice implicate (from/to/cc) + listă (sortată).
+    Merge identic pe mesaje din Graph sau din store-ul local (același format).
     """
     addrs = set()
     def safe_add(addr_obj):
@@ -181,96 +860,592 @@ def extract_participants(messages):
     return sorted(addrs)
 
 # ---------- email cleaning ----------
-RE_SIGNATURE = re.compile(r"(?is)(--\s*\n.*$|^Sent from my iPhone.*$|^Best regards,.*$|^Cu stima,.*$)")
-RE_QUOTED   = re.compile(r"(?is)(^>.*\n|^On .* wrote:.*$|^De la:.*\n|^From:.*\n.*)$")
+# Extractor HTML -> text in streaming (html.parser din stdlib), fara arbore BeautifulSoup.
+# Reproduce exact vechiul BeautifulSoup(html, "html.parser") + decompose(blockquote) + get_text("\n"):
+# acelasi tokenizer, aceeasi stiva de taguri (_popToTag), aceleasi stringuri excluse (style/script/template/rt/rp,
+# comentarii, doctype) si aceeasi comprimare a stringurilor doar-spatii. Se opreste cand bugetul e atins.
+BODY_CHAR_BUDGET = 8000
+VOID_TAGS = {"area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr", "image", "img",
+             "input", "isindex", "keygen", "link", "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr"}
+SKIP_TAGS = {"blockquote", "style", "script", "template", "rt", "rp"}
+PRESERVE_WS_TAGS = {"pre", "textarea"}
+ASCII_SPACES = " \n\t\x0c\r"
+
+# Vechile RE_QUOTED/RE_SIGNATURE ((?is), fara MULTILINE) se ancorau doar la inceputul textului, plus "--\s*\n.*$"
+# oriunde; echivalentele de mai jos dau acelasi rezultat in timp liniar, fara backtracking pe .*$.
+RE_QUOTED_START = re.compile(r"(?i)>|on |de la:|from:")
+RE_SIGNATURE_START = re.compile(r"(?i)sent from my iphone|best regards,|cu stima,")
+RE_WROTE = re.compile(r"(?i) wrote:")
+RE_WS = re.compile(r"\s*")
+RE_BLANK_LINES = re.compile(r"\n{3,}")
+
+@lru_cache(maxsize=1)
+def _entity_table():
+    from html.entities import html5
+    table = {}
+    for name, char in sorted(html5.items()):
+        table.setdefault(name[:-1] if name.endswith(";") else name, char)
+    return table
+
+RE_NUMERIC_PREFIX = {10: re.compile("^([0-9]+)(.*)"), 16: re.compile("^([0-9a-f]+)(.*)")}
+
+class _BudgetReached(Exception):
+    pass
+
+class _BodyTextParser(HTMLParser):
+    """
+    Documentul e dat integral la feed() (tokenizarea ramane identica cu a parserului folosit de bs4),
+    dar cu budget setat parsarea e abandonata din handler imediat ce prefixul extras fixeaza rezultatul.
+    """
+    def __init__(self, budget=None):
+        super().__init__(convert_charrefs=False)
+        self.stack, self.already_closed = [], []
+        self.open = {}
+        self.data, self.strings, self.size = [], [], 0
+        self.budget, self.next_check, self.result = budget, budget or 0, None
+
+    def _is_open(self, names):
+        return any(self.open.get(n) for n in names)
+
+    def _flush(self, cdata=False):
+        if not self.data: return
+        text = "".join(self.data); self.data = []
+        if not self._is_open(PRESERVE_WS_TAGS) and not text.strip(ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+        # CDATA ramane CData si in style/script/template (get_text il include); blockquote e sters oricum
+        if not self._is_open(("blockquote",) if cdata else SKIP_TAGS):
+            self.strings.append(text); self.size += len(text) + 1
+            if self.budget and self.size > self.next_check:
+                self._check_budget()
+
+    def _check_budget(self):
+        self.next_check = self.size + self.budget // 2   # verificari rare => cost total liniar
+        txt = self.text()
+        if (m := RE_QUOTED_START.match(txt)) and m.group(0).lower() in (">", "de la:"):
+            self.budget = None; return   # rezultatul depinde de sfarsitul textului: parsam tot
+        out = _finish_text(txt, complete=False, budget=self.budget)
+        if out is not None:
+            self.result = out; raise _BudgetReached()
+
+    def _push(self, tag):
+        self.stack.append(tag); self.open[tag] = self.open.get(tag, 0) + 1
+
+    def _pop_to(self, tag):
+        if not self.open.get(tag): return
+        while self.stack:
+            t = self.stack.pop(); self.open[t] -= 1
+            if t == tag: return
+
+    def handle_starttag(self, tag, attrs, void=True):
+        self._flush(); self._push(tag)
+        if void and tag in VOID_TAGS:
+            self._flush(); self._pop_to(tag); self.already_closed.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, void=False)
+        self._flush(); self._pop_to(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.already_closed:
+            self.already_closed.remove(tag); return
+        self._flush(); self._pop_to(tag)
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_entityref(self, name):
+        self.data.append(_entity_table().get(name, "&" + name))
+
+    def handle_charref(self, name):
+        base = 16 if name[:1] in "xX" else 10
+        digits = name[1:] if base == 16 else name
+        extra = ""
+        try:
+            num = int(digits, base)
+        except ValueError:
+            m = RE_NUMERIC_PREFIX[base].search(digits)
+            num, extra = (int(m.group(1), base), m.group(2)) if m else (None, digits)
+        self.data.append(html_lib.unescape(f"&#{num};") if num is not None else "")
+        self.data.append(extra)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.upper().startswith("CDATA["):
+            self.data.append(data[len("CDATA["):])
+            self._flush(cdata=True)
+
+    def text(self) -> str:
+        return "\n".join(self.strings)
+
+def _quoted_wipes(txt, complete=True):
+    """Vechiul RE_QUOTED sterge fie tot textul, fie nimic. None = nu se poate decide pe un prefix."""
+    m = RE_QUOTED_START.match(txt)
+    if not m: return False
+    head = m.group(0).lower()
+    if head in (">", "de la:"):
+        return txt.endswith("\n") if complete else None
+    if head == "on ":
+        return True if RE_WROTE.search(txt, 3) else (False if complete else None)
+    return txt.find("\n", 5) != -1 or (False if complete else None)
+
+def _signature_cut(txt, complete=True):
+    """(index, sigur): unde ar fi taiat vechiul RE_SIGNATURE; pe un prefix, un '--' urmat doar de spatii pana la capat e nesigur."""
+    if RE_SIGNATURE_START.match(txt): return 0, True
+    i = txt.find("--")
+    while i != -1:
+        end = RE_WS.match(txt, i + 2).end()
+        if txt.find("\n", i + 2, end) != -1: return i, True
+        if end == len(txt) and not complete: return i, False
+        i = txt.find("--", i + 1)
+    return len(txt), complete
+
+def _finish_text(txt, complete=True, budget=BODY_CHAR_BUDGET):
+    """Quote/semnatura/linii goale + taiere la buget. Pe un prefix intoarce None daca rezultatul nu e inca sigur."""
+    wipes = _quoted_wipes(txt, complete)
+    if wipes is None: return None
+    if wipes: return ""
+    cut, certain = _signature_cut(txt, complete)
+    if certain:
+        return RE_BLANK_LINES.sub("\n\n", txt[:cut]).strip()[:budget]
+    out = RE_BLANK_LINES.sub("\n\n", txt[:cut].rstrip()).lstrip()
+    return out[:budget] if len(out) >= budget else None
 
 def html_to_text(html_content: str) -> str:
-    soup = BeautifulSoup(html_content or "", "html.parser")
-    for bq in soup.find_all("blockquote"): bq.decompose()
-    return soup.get_text("\n")
+    parser = _BodyTextParser()
+    parser.feed(html_content or ""); parser.close(); parser._flush()
+    return parser.text()
 
 def trim_email_body(raw_html: str) -> str:
-    txt = html_to_text(raw_html)
-    txt = RE_QUOTED.sub("", txt); txt = RE_SIGNATURE.sub("", txt)
-    txt = re.sub(r"\n{3,}", "\n\n", txt).strip()
-    return txt[:8000]
+    """
+    Text curatat, max BODY_CHAR_BUDGET caractere. Parsarea se opreste imediat ce prefixul extras
+    determina complet rezultatul (un newsletter de 2 MB nu mai e parsat integral).
+    """
+    parser = _BodyTextParser(budget=BODY_CHAR_BUDGET)
+    try:
+        parser.feed(raw_html or ""); parser.close(); parser._flush()
+    except _BudgetReached:
+        return parser.result
+    return _finish_text(parser.text())
+
+def body_text(body) -> str:
+    """Textul curatat al unui body Graph: HTML prin trim_email_body, text simplu direct prin _finish_text."""
+    body = body or {}
+    if (body.get("contentType") or "").lower() == "text":
+        return _finish_text((body.get("content") or "").replace("\r\n", "\n"))
+    return trim_email_body(body.get("content", ""))
+
+BODY_MEMO_SIZE = 4096
+_body_memo = OrderedDict()
+_body_memo_lock = threading.Lock()
+
+def _memo_get(key):
+    with _body_memo_lock:
+        if (hit := _body_memo.get(key)) is not None:
+            _body_memo.move_to_end(key)
+        return hit
+
+def message_text(m) -> str:
+    """body_text(body) pentru un mesaj Graph, memoizat pe (id, changeKey): changeKey se schimba la orice editare."""
+    key = (m.get("id"), m.get("changeKey"))
+    if None in key:
+        return body_text(m.get("body"))
+    if (hit := _memo_get(key)) is not None:
+        return hit
+    with metrics.span("clean") as s:
+        txt = body_text(m.get("body"))
+        if s.active: metrics.count("kb_clean_bytes_total", len((m.get("body") or {}).get("content") or ""))
+    with _body_memo_lock:
+        _body_memo[key] = txt
+        if len(_body_memo) > BODY_MEMO_SIZE: _body_memo.popitem(last=False)
+    return txt
 
 # ---------- LLM prompts ----------
-SYSTEM_PROMPT = """Esti un asistent de email concis, precis, fara emoticoane.
+# Payload-ul e comprimat de prompt_builder.slim_payload: adresele sunt indici intr-o legenda, textul poate fi scurtat.
+PAYLOAD_LEGEND = ('Payload: "people" = legenda adreselor; from/to/cc/participants sunt indici in "people" (de la 0); '
+                  '"boilerplate" = liniile comune mai multor emailuri (disclaimere, footere), scoase din snippet; '
+                  '"…" marcheaza text omis pentru buget.')
+
+SYSTEM_PROMPT = f"""Esti un asistent de email concis, precis, fara emoticoane.
 1) Rezumi ultimile emailuri (cel mai nou primul) in 4-8 bullet-uri: intentii, cerinte, blocaje, termene, cifre.
 2) Redactezi un draft de raspuns business: 2 paragrafe scurte + lista next steps numerotata. Ton: ferm, politicos.
 3) Daca lipsesc atasamente sau info, cere-le explicit.
+{PAYLOAD_LEGEND}
 Returneaza JSON cu cheile: summary (string Markdown), draft_html (string HTML).
 """
 
-SEARCH_SYSTEM_PROMPT = """Esti un asistent de email care sintetizeaza rezultate pentru o cautare text.
+SEARCH_SYSTEM_PROMPT = f"""Esti un asistent de email care sintetizeaza rezultate pentru o cautare text.
 1) Construieste un rezumat focalizat strict pe cuvintele/fraza data: concluzii, actiuni, decizii, cifre, termene.
 2) Listeaza clar lacunele de informatie sau contradictiile aparute in firul de discutie.
 3) Genereaza un draft de reply (HTML) care abordeaza tema cautarii si propune next steps concrete.
+{PAYLOAD_LEGEND}
 Returneaza JSON cu cheile: summary (string Markdown), draft_html (string HTML).
 """
 
-def generate_summary_and_reply(emails, sender_hint=None, tone="brief-firm", propose_slot=None, timezone_name="Europe/Bucharest"):
-    if not llm: raise RuntimeError("LLM client nu este configurat. Seteaza OPENAI_API_KEY in .env")
-    items = []
-    for i, m in enumerate(emails, 1):
-        body_html = m.get("body", {}).get("content", "")
-        items.append({
-            "i": i,
-            "subject": m.get("subject", ""),
-            "from": (m.get("from") or {}).get("emailAddress", {}).get("address", ""),
-            "to": [(r.get("emailAddress") or {}).get("address","") for r in (m.get("toRecipients") or [])],
-            "cc": [(r.get("emailAddress") or {}).get("address","") for r in (m.get("ccRecipients") or [])],
-            "received": m.get("receivedDateTime", ""),
-            "snippet": trim_email_body(body_html)
-        })
-    payload = {"task":"summarize_and_draft","tone":tone,"timezone":timezone_name,"propose_slot":propose_slot,"sender_hint":sender_hint,"emails":items}
-    resp = llm.chat.completions.create(
-        model=DEFAULT_MODEL, temperature=0.2,
-        messages=[{"role":"system","content":SYSTEM_PROMPT},{"role":"user","content":json.dumps(payload, ensure_ascii=False)}]
-    )
-    content = resp.choices[0].message.content
+MAP_SYSTEM_PROMPT = f"""Esti un asistent care extrage note dintr-un lot de emailuri (o parte dintr-un set mai mare).
+1) Pentru fiecare email relevant noteaza: intentii, cerinte, blocaje, termene, cifre, decizii; pastreaza indexul i si data.
+2) Daca payload-ul contine "query", pastreaza doar ce e relevant pentru ea.
+3) Fara introduceri, fara concluzii generale: notele vor fi combinate ulterior cu ale altor loturi.
+{PAYLOAD_LEGEND}
+Returneaza JSON cu cheia: notes (string Markdown, bullet-uri scurte).
+"""
+
+# ---------- token budget (map-reduce) ----------
+LLM_CHUNK_TOKENS = int(os.getenv("LLM_CHUNK_TOKENS", "24000"))
+LLM_MAP_CONCURRENCY = int(os.getenv("LLM_MAP_CONCURRENCY", "4"))
+
+@lru_cache(maxsize=1)
+def _token_encoder():
+    try:
+        import tiktoken
+        try: return tiktoken.encoding_for_model(DEFAULT_MODEL)
+        except KeyError: return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+def payload_json(payload) -> str:
+    """Serializarea compacta (fara spatii) folosita pentru apel, cache si numararea tokenilor."""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+def count_tokens(text: str) -> int:
+    """Tokeni exacti cu tiktoken (optional); altfel estimare ~4 caractere/token."""
+    enc = _token_encoder()
+    return len(enc.encode(text)) if enc else len(text) // 4 + 1
+
+def pack_chunks(items, budget):
+    """
+    Imparte emailurile/firele (in ordine, cel mai nou primul) in loturi de cel mult `budget` tokeni.
+    Un element care singur depaseste bugetul e scurtat proportional (snippet, notes sau snippet-urile unui fir scurt).
+    """
+    chunks, cur, used = [], [], 0
+    for it in items:
+        n = count_tokens(payload_json(it))
+        field = next((f for f in ("snippet", "notes") if isinstance(it.get(f), str)), None)
+        if n > budget and field:
+            keep = max(200, int(len(it[field]) * budget / n * 0.9))
+            it = dict(it, **{field: it[field][:keep]}); n = budget
+        elif n > budget and isinstance(it.get("emails"), list):
+            ratio = budget / n * 0.9
+            it = dict(it, emails=[dict(e, snippet=e["snippet"][:max(200, int(len(e["snippet"]) * ratio))])
+                                  if isinstance(e.get("snippet"), str) else e for e in it["emails"]]); n = budget
+        if cur and used + n > budget:
+            chunks.append(cur); cur, used = [], 0
+        cur.append(it); used += n
+    if cur: chunks.append(cur)
+    return chunks
+
+def map_reduce_plan(payload):
+    """
+    None => payload-ul incape intr-un singur apel. Altfel (payload-urile map, functie notes -> payload reduce).
+    Planul e comun variantei sync (_summarize) si celei async (kb_async.asummarize).
+    """
+    list_key = "threads" if "threads" in payload else "emails"
+    emails = payload[list_key]
+    base = {k: v for k, v in payload.items() if k != list_key}
+    if count_tokens(payload_json(payload)) <= LLM_CHUNK_TOKENS:
+        return None
+    if list_key == "threads" and len(emails) == 1 and emails[0].get("emails"):
+        # un singur fir (plan_threads il pune direct, cu toate mesajele): loturile se fac pe mesaje, cel mai nou primul
+        thread = emails[0]
+        base = {**{k: v for k, v in base.items() if k != "note"}, "thread": {k: v for k, v in thread.items() if k != "emails"},
+                "note": "un singur fir de email; 'thread' = antetul firului, 'emails' = mesajele lui (cel mai nou primul)"}
+        list_key, emails = "emails", thread["emails"][::-1]
+    if len(emails) < 2:
+        return None
+
+    chunks = pack_chunks(emails, LLM_CHUNK_TOKENS)
+    parts = [{**base, "task": "extract_notes", "part": k, "parts": len(chunks), list_key: chunk}
+             for k, chunk in enumerate(chunks, 1)]
+    newest = {k: v for k, v in emails[0].items() if k not in ("snippet", "notes", "emails")}
+    def reduce_payload(notes):
+        return {**base, f"{list_key}_count": len(emails), "newest": newest,
+                "note": "emailurile au fost pre-rezumate pe loturi; lotul 1 contine cele mai noi",
+                "batch_notes": [{"part": k, "notes": n} for k, n in enumerate(notes, 1)]}
+    return parts, reduce_payload
+
+def _summarize(system_prompt, payload, use_cache=True) -> dict:
+    """
+    Payload mic => un singur apel. Payload peste LLM_CHUNK_TOKENS => map-reduce:
+    map: note per lot, in paralel (LLM_MAP_CONCURRENCY); reduce: prompt-ul original peste notele loturilor.
+    Fiecare apel trece prin cache, deci un lot neschimbat nu se mai re-rezuma.
+    """
+    plan = map_reduce_plan(payload)
+    if plan is None:
+        return _complete_json(system_prompt, payload, use_cache=use_cache)
+    parts, reduce_payload = plan
+    with ThreadPoolExecutor(max_workers=max(1, min(LLM_MAP_CONCURRENCY, len(parts)))) as pool:
+        notes = list(metrics.ctx_map(pool, lambda part: _complete_json(MAP_SYSTEM_PROMPT, part, use_cache=use_cache, keys=("notes",))["notes"], parts))
+    return _complete_json(system_prompt, reduce_payload(notes), use_cache=use_cache)
+
+def llm_cached(system_prompt, payload, use_cache=True):
+    """(user_content, cache, key, hit) — partea de cache a unui apel LLM, comuna sync/async."""
+    from llm_cache import cache_key, get_llm_cache
+    user_content = payload_json(payload)
+    cache = get_llm_cache()
+    key = cache_key(DEFAULT_MODEL, system_prompt, user_content)
+    hit = cache.get(key) if use_cache and cache is not None else None
+    metrics.count("kb_llm_calls_total", cache="hit" if hit is not None else "miss")
+    return user_content, cache, key, hit
+
+def record_llm_usage(s, usage):
+    """Tokenii raportati de API (raspunsul complet sau ultimul chunk cu include_usage) in span si contoare."""
+    if usage is None: return
+    s.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    metrics.count("kb_llm_tokens_total", usage.prompt_tokens, type="prompt")
+    metrics.count("kb_llm_tokens_total", usage.completion_tokens, type="completion")
+
+def llm_messages(system_prompt, user_content):
+    return [{"role":"system","content":system_prompt},{"role":"user","content":user_content}]
+
+def parse_llm_json(content, keys, cache=None, key=None) -> dict:
+    """JSON-ul din raspunsul modelului, redus la `keys`; memorat in cache daca e dat."""
     m = re.search(r"\{.*\}\s*$", content, re.S); data = json.loads(m.group(0) if m else content)
+    data = {k: data[k] for k in keys}
+    if cache is not None: cache.put(key, data)
+    return data
+
+class JsonStreamParser:
+    """
+    Parser JSON incremental pentru raspunsul streamuit al modelului. feed(chunk) intoarce [(cheie, text_nou)]
+    pentru valorile string de pe primul nivel al obiectului, pe masura ce sosesc (escape-uri decodate, si cand
+    sunt taiate intre chunk-uri). `values` pastreaza ce s-a decodat: un raspuns cu coada JSON stricata nu se pierde.
+    Textul dinaintea primului "{" (ex. ```json) e ignorat.
+    """
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.buf, self.i, self.state = "", 0, "start"
+        self.key, self.keybuf, self.values = None, [], {}
+        self.depth, self.raw_str = 0, False
+
+    def _escape(self):
+        """(caracter decodat, lungime) pentru escape-ul de la self.i; None daca nu a sosit inca integral."""
+        b, i = self.buf, self.i
+        if i + 1 >= len(b): return None
+        c = b[i + 1]
+        if c != "u": return self.ESCAPES.get(c, c), 2
+        if i + 6 > len(b): return None
+        try: code = int(b[i + 2:i + 6], 16)
+        except ValueError: return b[i + 1:i + 6], 6
+        if 0xD800 <= code < 0xDC00:   # surogat inalt: are nevoie de perechea \uDC00-\uDFFF
+            if i + 12 > len(b): return None
+            if b[i + 6:i + 8] == "\\u":
+                try: low = int(b[i + 8:i + 12], 16)
+                except ValueError: low = 0
+                if 0xDC00 <= low < 0xE000:
+                    return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), 12
+        return chr(code), 6
+
+    def _string(self, out):
+        """Consuma caracterele unui string pana la ghilimeaua de inchidere; True daca s-a inchis."""
+        b = self.buf
+        while self.i < len(b):
+            j = self.i
+            while j < len(b) and b[j] not in '"\\': j += 1
+            out.append(b[self.i:j]); self.i = j
+            if j == len(b): return False
+            if b[j] == '"':
+                self.i += 1; return True
+            esc = self._escape()
+            if esc is None: return False
+            out.append(esc[0]); self.i += esc[1]
+        return False
+
+    def feed(self, chunk):
+        self.buf += chunk
+        b, deltas = self.buf, []
+        while self.i < len(b):
+            c, st = b[self.i], self.state
+            if st == "start":
+                j = b.find("{", self.i)
+                if j == -1: self.i = len(b); break
+                self.i, self.state = j + 1, "key?"
+            elif st in ("key?", "colon", "value?") and c in " \t\r\n,":
+                self.i += 1
+            elif st == "key?":
+                if c == '"': self.i += 1; self.keybuf, self.state = [], "key"
+                elif c == "}": self.i += 1; self.state = "end"
+                else: self.i += 1
+            elif st == "key":
+                if self._string(self.keybuf): self.key, self.state = "".join(self.keybuf), "colon"
+                else: break
+            elif st == "colon":
+                self.i += 1
+                if c == ":": self.state = "value?"
+            elif st == "value?":
+                if c == '"':
+                    self.i += 1; self.state = "str"; self.values[self.key] = ""
+                else:
+                    self.state, self.depth, self.raw_str = "raw", 0, False
+            elif st == "str":
+                out = []
+                closed = self._string(out)
+                text = "".join(out)
+                if text:
+                    self.values[self.key] += text; deltas.append((self.key, text))
+                if closed: self.state = "key?"
+                else: break
+            elif st == "raw":   # valoare non-string (numar, obiect, lista): doar o sarim
+                self.i += 1
+                if self.raw_str:
+                    if c == "\\": self.i += 1
+                    elif c == '"': self.raw_str = False
+                elif c == '"': self.raw_str = True
+                elif c in "{[": self.depth += 1
+                elif c in "}]":
+                    self.depth -= 1
+                    if self.depth < 0: self.state = "end"
+                elif c == "," and self.depth == 0: self.state = "key?"
+            else:   # "end"
+                self.i = len(b)
+        return deltas
+
+def stream_result(content, parser, keys, cache=None, key=None) -> dict:
+    """
+    Rezultatul final al unui apel streamuit: JSON-ul complet daca e valid (si atunci intra in cache),
+    altfel ce a decodat parserul incremental. Un raspuns din care nu s-a putut extrage nimic e o eroare.
+    """
+    try:
+        return parse_llm_json(content, keys, cache, key)
+    except (ValueError, KeyError):
+        if not any(parser.values.get(k) for k in keys): raise
+        return {k: parser.values.get(k, "") for k in keys}
+
+def _complete_json(system_prompt, payload, use_cache=True, keys=("summary", "draft_html")) -> dict:
+    """
+    Un apel chat.completions care intoarce JSON-ul cu cheile `keys` (implicit {summary, draft_html}).
+    Rezultatul e memorat in llm_cache dupa hash(model + system prompt + payload exact).
+    use_cache=False ocoleste citirea (regenerare fortata), dar rezultatul nou inlocuieste intrarea veche.
+    """
+    user_content, cache, key, hit = llm_cached(system_prompt, payload, use_cache)
+    if hit is not None: return hit
+    with metrics.span("llm", mode="complete") as s:
+        resp = require_llm(build=True).chat.completions.create(model=DEFAULT_MODEL, temperature=0.2, messages=llm_messages(system_prompt, user_content))
+        if s.active: record_llm_usage(s, getattr(resp, "usage", None))
+    return parse_llm_json(resp.choices[0].message.content, keys, cache, key)
+
+def email_item(i, m, snippet=None) -> dict:
+    """Reprezentarea unui email in payload-ul LLM; snippet=None => textul curatat (memoizat) al body-ului."""
+    return {
+        "i": i,
+        "subject": m.get("subject", ""),
+        "from": (m.get("from") or {}).get("emailAddress", {}).get("address", ""),
+        "to": [(r.get("emailAddress") or {}).get("address","") for r in (m.get("toRecipients") or [])],
+        "cc": [(r.get("emailAddress") or {}).get("address","") for r in (m.get("ccRecipients") or [])],
+        "received": m.get("receivedDateTime", ""),
+        "snippet": message_text(m) if snippet is None else snippet
+    }
+
+def emails_payload(base, emails) -> dict:
+    """Payload-ul fara grupare pe fire: email_item pentru fiecare mesaj, comprimat de prompt_builder."""
+    from prompt_builder import slim_payload
+    return slim_payload({**base, "emails": [email_item(i, m) for i, m in enumerate(emails, 1)]})
+
+def _build_payload(base, emails, by_thread, use_cache):
+    with metrics.span("prompt_build") as s:
+        if by_thread:
+            from conversations import threads_payload
+            payload = threads_payload(base, emails, use_cache=use_cache)
+        else:
+            payload = emails_payload(base, emails)
+        record_prompt(s, payload, len(emails))
+    return payload
+
+def record_prompt(s, payload, n):
+    """Tokenii payload-ului construit (doar cu metricile active: numararea nu e gratuita)."""
+    if not s.active: return
+    tokens = count_tokens(payload_json(payload))
+    s.set(emails=n, tokens=tokens)
+    metrics.observe("kb_prompt_tokens", tokens, metrics.TOKEN_BUCKETS)
+
+def summary_base(sender_hint=None, tone="brief-firm", propose_slot=None, timezone_name="Europe/Bucharest"):
+    return {"task":"summarize_and_draft","tone":tone,"timezone":timezone_name,"propose_slot":propose_slot,"sender_hint":sender_hint}
+
+def search_base(query, tone="brief-firm", timezone_name="Europe/Bucharest"):
+    return {"task":"search_summarize_and_draft","tone":tone,"timezone":timezone_name,"query":query}
+
+def generate_summary_and_reply(emails, sender_hint=None, tone="brief-firm", propose_slot=None, timezone_name="Europe/Bucharest", use_cache=True, by_thread=True):
+    require_llm()
+    base = summary_base(sender_hint, tone, propose_slot, timezone_name)
+    data = _summarize(SYSTEM_PROMPT, _build_payload(base, emails, by_thread, use_cache), use_cache=use_cache)
     return data["summary"], data["draft_html"]
 
-def generate_search_summary_and_reply(emails, query, tone="brief-firm", timezone_name="Europe/Bucharest"):
-    if not llm: raise RuntimeError("LLM client nu este configurat. Seteaza OPENAI_API_KEY in .env")
-    items = []
-    for i, m in enumerate(emails, 1):
-        body_html = m.get("body", {}).get("content", "")
-        items.append({
-            "i": i,
-            "subject": m.get("subject", ""),
-            "from": (m.get("from") or {}).get("emailAddress", {}).get("address", ""),
-            "to": [(r.get("emailAddress") or {}).get("address","") for r in (m.get("toRecipients") or [])],
-            "cc": [(r.get("emailAddress") or {}).get("address","") for r in (m.get("ccRecipients") or [])],
-            "received": m.get("receivedDateTime", ""),
-            "snippet": trim_email_body(body_html)
-        })
-    payload = {"task":"search_summarize_and_draft","tone":tone,"timezone":timezone_name,"query":query,"emails":items}
-    resp = llm.chat.completions.create(
-        model=DEFAULT_MODEL, temperature=0.2,
-        messages=[{"role":"system","content":SEARCH_SYSTEM_PROMPT},{"role":"user","content":json.dumps(payload, ensure_ascii=False)}]
-    )
-    content = resp.choices[0].message.content
-    m = re.search(r"\{.*\}\s*$", content, re.S); data = json.loads(m.group(0) if m else content)
+def generate_search_summary_and_reply(emails, query, tone="brief-firm", timezone_name="Europe/Bucharest", use_cache=True, by_thread=True):
+    require_llm()
+    base = search_base(query, tone, timezone_name)
+    data = _summarize(SEARCH_SYSTEM_PROMPT, _build_payload(base, emails, by_thread, use_cache), use_cache=use_cache)
     return data["summary"], data["draft_html"]
 
 # ---------- Draft reply ----------
-def create_reply_draft(token: str, message_id: str, reply_html: str) -> str:
+def reply_draft_requests(items):
+    """
+    Sub-cererile $batch pentru draft-uri: createReply primeste direct body-ul (message.body), deci
+    un singur apel per draft intoarce id + webLink, fara PATCH si GET ulterior.
+    """
+    return [{"id": str(k), "method": "POST", "url": f"/me/messages/{mid}/createReply",
+             "headers": {"Content-Type": "application/json"},
+             "body": {"message": {"body": {"contentType": "HTML", "content": reply_html}}}}
+            for k, (mid, reply_html) in enumerate(items, 1)]
+
+def reply_drafts_result(items, responses):
+    """[{message_id, id, webLink, error}] in ordinea items."""
+    out = []
+    for k, (mid, _) in enumerate(items, 1):
+        r = responses.get(str(k)) or {"status": 0}
+        body = r.get("body") if isinstance(r.get("body"), dict) else {}
+        ok = 200 <= r.get("status", 0) < 300
+        out.append({"message_id": mid, "id": body.get("id") if ok else None, "webLink": body.get("webLink") if ok else None,
+                    "error": None if ok else batch_error(r)})
+    return out
+
+def create_reply_drafts(token: str, items):
+    """
+    Draft-uri de raspuns pentru mai multe mesaje deodata: items = [(message_id, reply_html)].
+    Un singur draft => un POST direct; mai multe => /$batch (20 per cerere HTTP).
+    """
+    import requests
+    items = list(items)
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    draft = graph_post(f"/me/messages/{message_id}/createReply", headers=headers, data={})
-    draft_id = draft["id"]
-    patch = {"body": {"contentType": "HTML", "content": reply_html}}
-    graph_patch(f"/me/messages/{draft_id}", headers=headers, data=patch)
-    return draft_id
+    reqs = reply_draft_requests(items)
+    with metrics.span("draft") as s:
+        s.set(drafts=len(reqs))
+        if len(reqs) == 1:
+            try:
+                draft = graph_post(reqs[0]["url"], headers=headers, data=reqs[0]["body"])
+                return [{"message_id": items[0][0], "id": draft["id"], "webLink": draft.get("webLink"), "error": None}]
+            except requests.HTTPError as e:
+                return [{"message_id": items[0][0], "id": None, "webLink": None, "error": f"{e} / {e.response.text[:500]}"}]
+        return reply_drafts_result(items, graph_batch(reqs, headers=headers))
+
+def create_reply_draft(token: str, message_id: str, reply_html: str) -> str:
+    d = create_reply_drafts(token, [(message_id, reply_html)])[0]
+    if d["error"]: raise RuntimeError(f"createReply a esuat: {d['error']}")
+    return d["id"]
 
 # ---------- CLI (ramane util pentru terminal) ----------
+def write_trace(tr, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tr.to_dict(), f, ensure_ascii=False, indent=2)
+    print(f"[TRACE] {len(tr.spans)} etape, {tr.to_dict()['elapsed_ms']:.0f} ms -> {path}", file=sys.stderr)
+
 def main():
     p = argparse.ArgumentParser(description="Outlook KB Agent (summarize + draft reply via Graph)")
     g = p.add_mutually_exclusive_group(required=True)
     g.add_argument("--from-sender", help="email exact al expeditorului (ex: john@company.com)")
     g.add_argument("--from-domain", help="domeniu (ex: company.com)")
+    g.add_argument("--sync", action="store_true", help="sincronizeaza incremental store-ul local (delta) si iese")
+    g.add_argument("--cache-stats", action="store_true", help="afiseaza statisticile cache-ului LLM si iese")
+    g.add_argument("--batch", metavar="FILE", help="digest pentru mai multi expeditori/domenii (cate unul pe linie; - = stdin)")
+    g.add_argument("--who", nargs="?", const="", metavar="ADRESA|DOMENIU", help="statisticile unui corespondent din indexul local (fara valoare: top --last) si iese")
+    g.add_argument("--auth-only", action="store_true", help="doar login (AUTH_FLOW) si salvarea token-ului in TOKEN_CACHE_DIR, apoi iese")
     p.add_argument("--last", type=int, default=5, help="cate mesaje luam (default 5)")
     p.add_argument("--days", type=int, default=None, help="limiteaza la ultimele N zile")
     p.add_argument("--folder-id", help="restrict la un folder anume")
@@ -278,46 +1453,106 @@ def main():
     p.add_argument("--slot", default=None, help="propune un slot: Thu 14:00-15:00 Europe/Bucharest")
     p.add_argument("--create-draft", action="store_true", help="creeaza draft reply la cel mai nou mesaj")
     p.add_argument("--login", default=None, help="login_hint (ex: nume@outlook.com)")
+    p.add_argument("--no-cache", action="store_true", help="ignora cache-ul LLM (forteaza un apel nou)")
+    p.add_argument("--no-threads", action="store_true", help="nu grupa pe fire (conversationId); trimite mesajele individual")
+    p.add_argument("--since-last", action="store_true", help="doar mesajele sosite de la rezumatul anterior; LLM-ul actualizeaza rezumatul salvat")
+    p.add_argument("--out", default=None, help="--batch: fisierul digest (.md sau .json); implicit Markdown la stdout")
+    p.add_argument("--concurrency", type=int, default=None, help="--batch: cate tinte se aduc din Graph simultan")
+    p.add_argument("--trace", metavar="FILE", default=None, help="scrie in FILE trace-ul JSON al etapelor (auth, Graph, clean, LLM, draft)")
     args = p.parse_args()
 
+    if args.trace:
+        import atexit
+        tr, _ = metrics.start_trace("cli", argv=sys.argv[1:])
+        atexit.register(write_trace, tr, args.trace)   # si la iesirile cu eroare din __main__
+
+    if args.cache_stats:
+        from llm_cache import get_llm_cache
+        cache = get_llm_cache()
+        print("[CACHE]", json.dumps(cache.stats() if cache else {"disabled": True}, ensure_ascii=False)); return 0
+
+    if args.who is not None:   # doar indexul local (correspondents.py), fara token
+        from correspondents import get_correspondents
+        index = get_correspondents(args.login)
+        if index is None:
+            print("[WHO]", json.dumps({"disabled": True})); return 0
+        rows = [index.lookup(args.who)] if args.who else index.top(limit=args.last)
+        if rows == [None]:
+            print(f"Nu am date despre {args.who}."); return 0
+        for r in rows: print("[WHO]", json.dumps(r, ensure_ascii=False))
+        return 0
+
     token = acquire_token_public(login_hint=args.login)
+    if args.auth_only:   # fisierul se poate copia pe un server headless (AUTH_FLOW=none)
+        print(f"[AUTH] token salvat in {get_auth().cache_file(args.login)}"); return 0
+    if args.sync:
+        from mail_store import get_store
+        store = get_store(args.login)
+        folders = [args.folder_id] if args.folder_id else None
+        t0 = time.time(); changed = store.sync(token, folders)
+        print(f"[SYNC] {changed} modificari in {time.time() - t0:.1f}s -> {store.path}")
+        if os.path.exists(store.path + ".vectors"):   # indexul semantic, daca a fost construit
+            from semantic import refresh_existing
+            t0 = time.time(); n = refresh_existing(store)
+            print(f"[SEMANTIC] {n} mesaje vectorizate in {time.time() - t0:.1f}s")
+        return 0
+
+    if args.batch:
+        import asyncio
+        from digest import DIGEST_CONCURRENCY, read_targets, run_digest, write_digest
+        with (sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")) as f:
+            targets = read_targets(f)
+        digest = asyncio.run(run_digest(token, targets, top=args.last, days=args.days, folder_id=args.folder_id, tone=args.tone,
+                                        slot=args.slot, use_cache=not args.no_cache, by_thread=not args.no_threads,
+                                        create_draft=args.create_draft, concurrency=args.concurrency or DIGEST_CONCURRENCY,
+                                        since_last=args.since_last))
+        write_digest(digest, args.out)
+        failed = sum(1 for it in digest["items"] if it["error"])
+        print(f"[DIGEST] {len(targets)} tinte, {failed} erori, {digest['elapsed']:.1f}s" + (f" -> {args.out}" if args.out else ""), file=sys.stderr)
+        return 0 if not failed else 3
+
     try:
-        who = graph_get("/me", headers={"Authorization": f"Bearer {token}"},
-                        params={"$select":"userPrincipalName,mail,id,displayName,surname,givenName,preferredLanguage,ageGroup,mobilePhone,jobTitle,officeLocation,businessPhones"})
-        print("[ME]", who)
+        print("[ME]", graph_me(token, args.login))   # memorat per cont: indexul de corespondenti il foloseste la ingest
     except Exception as e:
         print("[WARN] /me check failed:", e)
 
-    if args.from_sender:
-        msgs = fetch_last_messages(token, sender=args.from_sender, top=args.last, days=args.days, folder_id=args.folder_id)
-        hint = args.from_sender
+    target = {"sender": args.from_sender} if args.from_sender else {"domain": args.from_domain}
+    if args.since_last:
+        from watermarks import summarize_since_last
+        r = summarize_since_last(token, top=args.last, days=args.days, folder_id=args.folder_id, tone=args.tone, slot=args.slot,
+                                 use_cache=not args.no_cache, by_thread=not args.no_threads, **target)
+        if r["summary"] is None:
+            print("Nu am gasit mesaje pe criteriile date."); return 0
+        print(f"[SINCE-LAST] {r['new_messages']} mesaje noi" + (" (actualizare)" if r["incremental"] and r["new_messages"] else ""))
+        if r["capped"]:
+            print(f"[WARN] plafonul SINCE_LAST_MAX atins: mesajele sosite dupa rezumatul anterior, mai vechi decat cele {r['new_messages']} aduse, nu intra in actualizare")
+        if not r["new_messages"]:
+            print("\n=== SUMMARY (nimic nou de la ultimul rezumat) ===\n"); print(r["summary"]); return 0
+        msgs, summary_md, draft_html = [{"id": r["newest_id"]}], r["summary"], r["draft_html"]
     else:
-        msgs = fetch_last_messages(token, domain=args.from_domain, top=args.last, days=args.days, folder_id=args.folder_id)
-        hint = args.from_domain
-
-    if not msgs:
-        print("Nu am gasit mesaje pe criteriile date."); return 0
-
-    summary_md, draft_html = generate_summary_and_reply(msgs, sender_hint=hint, tone=args.tone, propose_slot=args.slot, timezone_name=TZ_NAME)
+        msgs = fetch_last_messages(token, top=args.last, days=args.days, folder_id=args.folder_id, **target)
+        if not msgs:
+            print("Nu am gasit mesaje pe criteriile date."); return 0
+        summary_md, draft_html = generate_summary_and_reply(msgs, sender_hint=args.from_sender or args.from_domain, tone=args.tone, propose_slot=args.slot, timezone_name=TZ_NAME, use_cache=not args.no_cache, by_thread=not args.no_threads)
 
     print("\n=== SUMMARY ===\n"); print(summary_md)
     print("\n=== DRAFT (HTML) ===\n"); print(draft_html)
 
     if args.create_draft:
-        newest = msgs[0]["id"]
-        draft_id = create_reply_draft(token, newest, draft_html)
-        link = graph_get(f"/me/messages/{draft_id}", headers={"Authorization": f"Bearer {token}"}, params={"$select":"webLink"}).get("webLink")
-        print(f"\nDraft creat: {link or '(fara link)'}")
+        d = create_reply_drafts(token, [(msgs[0]["id"], draft_html)])[0]
+        if d["error"]: print(f"\n[WARN] Draft esuat: {d['error']}")
+        else: print(f"\nDraft creat: {d['webLink'] or '(fara link)'}")
 
     return 0
 
 if __name__ == "__main__":
     try:
         sys.exit(main())
-    except requests.HTTPError as e:
+    except Exception as e:
+        import requests   # deja incarcat daca eroarea vine de la Graph
+        if not isinstance(e, requests.HTTPError):
+            print(f"[ERROR] {e}"); sys.exit(1)
         body = ""
         try: body = e.response.text
         except Exception: pass
         print(f"[HTTP ERROR] {e} / {body}"); sys.exit(2)
-    except Exception as e:
-        print(f"[ERROR] {e}"); sys.exit(1)
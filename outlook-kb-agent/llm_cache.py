@@ -0,0 +1,119 @@
+# llm_cache.py — cache persistent (SQLite) pentru rezultatele LLM, adresat după conținut
+# Cheia = sha256(model + system prompt + payload-ul JSON exact trimis), deci orice schimbare de mesaje,
+# ton, slot, query sau model produce altă cheie. Evicție după TTL și după dimensiune (LRU).
+# Fișierul e partajat de toate conturile și de toți workerii (SQLite WAL): cheia depinde doar de conținut.
+#
+# .env (opțional):
+#   LLM_CACHE_PATH=.llm_cache.sqlite3
+#   LLM_CACHE_TTL=604800            # secunde; 0 => cache dezactivat
+#   LLM_CACHE_MAX_ENTRIES=2000
+#   LLM_CACHE_MAX_BYTES=52428800
+
+import hashlib, json, os, sqlite3, threading, time
+
+from kb_mail import BASE_DIR
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(BASE_DIR / ".llm_cache.sqlite3"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_llm_cache_last_used ON llm_cache(last_used);
+CREATE TABLE IF NOT EXISTS llm_cache_stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def cache_key(model: str, system_prompt: str, user_content: str) -> str:
+    h = hashlib.sha256()
+    for part in (model, system_prompt, user_content):
+        h.update(part.encode("utf-8")); h.update(b"\0")
+    return h.hexdigest()
+
+class LLMCache:
+    """Cache cheie -> JSON, thread-safe (o conexiune SQLite WAL + lock), cu statistici hits/misses persistate."""
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)   # timeout: alti workeri scriu in acelasi fisier
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def _bump(self, name, n=1):
+        self.db.execute("INSERT INTO llm_cache_stats(name, value) VALUES (?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.ttl:
+                self.db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._bump("expired"); row = None
+            if row is None:
+                self._bump("misses"); self.db.commit()
+                return None
+            self.db.execute("UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._bump("hits"); self.db.commit()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        raw = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO llm_cache(key, value, size, created, last_used) VALUES (?,?,?,?,?)",
+                            (key, raw, len(raw.encode("utf-8")), now, now))
+            self._evict(now)
+            self.db.commit()
+
+    def _evict(self, now):
+        expired = self.db.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,)).rowcount
+        if expired: self._bump("expired", expired)
+        count, total = self.db.execute("SELECT count(*), coalesce(sum(size), 0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes: return
+        evicted = 0
+        for key, size in self.db.execute("SELECT key, size FROM llm_cache ORDER BY last_used").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes: break
+            self.db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            count -= 1; total -= size; evicted += 1
+        self._bump("evicted", evicted)
+
+    def stats(self) -> dict:
+        with self.lock:
+            out = dict(self.db.execute("SELECT name, value FROM llm_cache_stats").fetchall())
+            out["entries"], out["bytes"] = self.db.execute("SELECT count(*), coalesce(sum(size), 0) FROM llm_cache").fetchone()
+        for k in ("hits", "misses", "expired", "evicted"): out.setdefault(k, 0)
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 3) if lookups else 0.0
+        return out
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM llm_cache")
+            self.db.commit()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """Cache-ul partajat al procesului; None dacă e dezactivat (LLM_CACHE_TTL=0)."""
+    global _cache
+    if LLM_CACHE_TTL <= 0: return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
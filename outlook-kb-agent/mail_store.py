@@ -0,0 +1,323 @@
+# mail_store.py — cache local SQLite al cutiei postale, ținut la zi cu Graph /messages/delta
+# Un rând per mesaj (JSON-ul Graph original + coloane indexate) și un delta link per folder.
+# Index full-text FTS5 (subject, participanți, body curățat cu trim_email_body), actualizat prin triggere
+# la fiecare upsert/delete => căutări cu frază, from:, after:/before:, sortate după receivedDateTime.
+# Coloana embedded (0 = text nou/modificat) e coada de vectorizare a indexului semantic din semantic.py.
+# Sync incremental:  python kb_mail.py --sync   (sau hook-ul de background din app.py)
+# Un store per cont: MAIL_STORE_PATH cu login-ul în nume (account_path); fără login => MAIL_STORE_PATH.
+# Sync-ul unui store se serializează între procese pe <store>.sync.lock (workerii nu dublează delta-ul).
+# Fiecare pagină delta alimentează și indexul de corespondenți al contului (correspondents.py).
+#
+# .env (opțional):
+#   MAIL_STORE_PATH=.mail_store.sqlite3
+#   MAIL_STORE_FOLDERS=inbox,sentitems
+#   MAIL_STORE_SYNC_DAYS=365        # limitează sync-ul inițial la ultimele N zile
+#   MAIL_STORE_MAX_AGE=300          # în kb_mail: răspunde din store dacă e sincronizat de < N secunde
+
+import json, os, re, sqlite3, threading, time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from kb_mail import BASE_DIR, MESSAGE_SELECT, account_path, file_lock, graph_get, message_text, note_correspondents, token_account
+
+MAIL_STORE_PATH = os.getenv("MAIL_STORE_PATH", str(BASE_DIR / ".mail_store.sqlite3"))
+MAIL_STORE_FOLDERS = [f.strip() for f in os.getenv("MAIL_STORE_FOLDERS", "inbox,sentitems").split(",") if f.strip()]
+MAIL_STORE_SYNC_DAYS = int(os.getenv("MAIL_STORE_SYNC_DAYS", "365"))
+DELTA_PAGE_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    folder_id TEXT NOT NULL,
+    conversation_id TEXT,
+    received TEXT NOT NULL DEFAULT '',
+    from_addr TEXT NOT NULL DEFAULT '',
+    from_domain TEXT NOT NULL DEFAULT '',
+    subject TEXT NOT NULL DEFAULT '',
+    body_text TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL,
+    participants TEXT NOT NULL DEFAULT '',
+    embedded INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_messages_received ON messages(received DESC);
+CREATE INDEX IF NOT EXISTS ix_messages_from ON messages(from_addr, received DESC);
+CREATE INDEX IF NOT EXISTS ix_messages_domain ON messages(from_domain, received DESC);
+CREATE TABLE IF NOT EXISTS sync_state (
+    folder_id TEXT PRIMARY KEY,
+    delta_link TEXT,
+    synced_at REAL
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, participants, body_text,
+    content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, subject, participants, body_text) VALUES (new.rowid, new.subject, new.participants, new.body_text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, subject, participants, body_text) VALUES ('delete', old.rowid, old.subject, old.participants, old.body_text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, subject, participants, body_text) VALUES ('delete', old.rowid, old.subject, old.participants, old.body_text);
+    INSERT INTO messages_fts(rowid, subject, participants, body_text) VALUES (new.rowid, new.subject, new.participants, new.body_text);
+END;
+"""
+
+RE_QUERY_TOKEN = re.compile(r'(\w+):("[^"]*"|\S+)|"([^"]*)"|(\S+)')
+QUERY_OPERATORS = {"from", "subject", "after", "before"}
+
+def parse_query(q: str) -> dict:
+    """
+    Sintaxa /search:  "frază exactă"  from:ana@firma.com | from:firma.com  subject:oferta  after:2024-01-31  before:2024-03-01
+    Textul liber rămas e tratat ca o singură frază (ca $search="..." din Graph).
+    """
+    out = {"phrases": [], "subject": [], "sender": None, "domain": None, "after": None, "before": None}
+    free = []
+    for op, op_val, quoted, word in RE_QUERY_TOKEN.findall(q or ""):
+        op = op.lower()
+        if op in QUERY_OPERATORS:
+            val = op_val.strip('"')
+            if op == "from":
+                if "@" in val.strip("@"): out["sender"] = val.lower()
+                else: out["domain"] = val.lower().lstrip("@")
+            elif op == "subject":
+                out["subject"].append(val)
+            else:
+                try: dt = datetime.fromisoformat(val.replace("Z", "+00:00"))
+                except ValueError:
+                    free.append(f"{op}:{op_val}"); continue
+                out[op] = dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)   # fără offset => UTC
+        elif op:
+            free.append(f"{op}:{op_val}")
+        elif quoted:
+            out["phrases"].append(quoted)
+        else:
+            free.append(word)
+    if free: out["phrases"].append(" ".join(free))
+    out["phrases"] = [p for p in out["phrases"] if p.strip()]
+    return out
+
+def query_since(q, since=None):
+    return max([d for d in (since, q["after"]) if d is not None], default=None)
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+def fts_match(query: dict, any_terms=False):
+    """
+    Expresia MATCH FTS5 pentru un query parsat; None dacă are doar filtre (from:/dată).
+    any_terms=True => oricare dintre cuvinte (OR), pentru clasarea bm25 din căutarea hibridă (semantic.py).
+    """
+    if any_terms:
+        words = {w for p in query["phrases"] + query["subject"] for w in re.findall(r"\w+", p)}
+        return " OR ".join(_fts_phrase(w) for w in sorted(words)) or None
+    terms = [_fts_phrase(p) for p in query["phrases"]]
+    terms += [f"subject : {_fts_phrase(s)}" for s in query["subject"]]
+    return " AND ".join(terms) or None
+
+def _participants_text(m):
+    parts = []
+    for a in [(m.get("from") or {}).get("emailAddress")] + [r.get("emailAddress") for r in (m.get("toRecipients") or []) + (m.get("ccRecipients") or [])]:
+        if a: parts += [a.get("name") or "", (a.get("address") or "").lower()]
+    return " ".join(p for p in parts if p)
+
+class MailStore:
+    """
+    Store SQLite (WAL) partajat între thread-uri: o conexiune, serializată cu un lock.
+    Mesajele se întorc în forma Graph (dict), deci extract_participants/generate_* merg neschimbate.
+    """
+    def __init__(self, path=MAIL_STORE_PATH, folders=None):
+        self.path = path
+        self.folders = list(folders or MAIL_STORE_FOLDERS)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)   # timeout: alti workeri scriu in acelasi fisier
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self._migrate()
+        self.db.executescript(FTS_SCHEMA)
+
+    def _migrate(self):
+        cols = {r[1] for r in self.db.execute("PRAGMA table_info(messages)")}
+        if "participants" not in cols:  # store creat înainte de indexul FTS
+            self.db.execute("ALTER TABLE messages ADD COLUMN participants TEXT NOT NULL DEFAULT ''")
+            for rowid, data in self.db.execute("SELECT rowid, data FROM messages").fetchall():
+                self.db.execute("UPDATE messages SET participants = ? WHERE rowid = ?", (_participants_text(json.loads(data)), rowid))
+            self.db.executescript(FTS_SCHEMA)
+            self.db.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+            self.db.commit()
+        if "embedded" not in cols:  # store creat înainte de indexul semantic (semantic.py)
+            self.db.execute("ALTER TABLE messages ADD COLUMN embedded INTEGER NOT NULL DEFAULT 0")
+            self.db.commit()
+
+    # ----- write path -----
+    def upsert(self, folder_id, m):
+        addr = ((m.get("from") or {}).get("emailAddress") or {}).get("address", "").lower()
+        body_text = message_text(m)
+        # upsert (nu INSERT OR REPLACE): păstrează rowid-ul, deci triggerele FTS actualizează în loc să dubleze;
+        # embedded = 0 doar dacă s-a schimbat textul (un delta pentru isRead nu re-vectorizează mesajul)
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO messages(id, folder_id, conversation_id, received, from_addr, from_domain, subject, body_text, data, participants) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?) ON CONFLICT(id) DO UPDATE SET folder_id=excluded.folder_id, "
+                "conversation_id=excluded.conversation_id, received=excluded.received, from_addr=excluded.from_addr, "
+                "from_domain=excluded.from_domain, subject=excluded.subject, body_text=excluded.body_text, "
+                "data=excluded.data, participants=excluded.participants, embedded=CASE WHEN messages.subject = excluded.subject "
+                "AND messages.body_text = excluded.body_text THEN messages.embedded ELSE 0 END",
+                (m["id"], folder_id, m.get("conversationId"), m.get("receivedDateTime", ""), addr,
+                 addr.rpartition("@")[2], m.get("subject") or "", body_text, json.dumps(m, ensure_ascii=False),
+                 _participants_text(m)))
+
+    def remove(self, message_id):
+        with self.lock:
+            self.db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+    def _save_state(self, folder_id, delta_link, synced_at):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO sync_state(folder_id, delta_link, synced_at) VALUES (?,?,?)",
+                            (folder_id, delta_link, synced_at))
+            self.db.commit()
+
+    def _reset_folder(self, folder_id):
+        with self.lock:
+            self.db.execute("DELETE FROM messages WHERE folder_id = ?", (folder_id,))
+            self.db.execute("DELETE FROM sync_state WHERE folder_id = ?", (folder_id,))
+            self.db.commit()
+
+    def sync_folder(self, token, folder_id) -> int:
+        """
+        Sync incremental pentru un folder. Primul sync pornește de la /delta (limitat la MAIL_STORE_SYNC_DAYS),
+        apoi doar deltaLink-ul salvat. nextLink-ul e salvat după fiecare pagină => un sync întrerupt se reia.
+        Delta token expirat (410 Gone) => resetăm folderul și refacem sync-ul complet.
+        """
+        headers = {"Authorization": f"Bearer {token}", "Prefer": f"odata.maxpagesize={DELTA_PAGE_SIZE}"}
+        with self.lock:
+            row = self.db.execute("SELECT delta_link, synced_at FROM sync_state WHERE folder_id = ?", (folder_id,)).fetchone()
+        link, synced_at = row if row else (None, None)
+        params = None
+        if not link:
+            link = f"/me/mailFolders/{folder_id}/messages/delta"
+            params = {"$select": MESSAGE_SELECT}
+            if MAIL_STORE_SYNC_DAYS:
+                since = datetime.now(timezone.utc) - timedelta(days=MAIL_STORE_SYNC_DAYS)
+                params["$filter"] = f"receivedDateTime ge {since.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+        try:
+            data = graph_get(link, headers=headers, params=params)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 410: raise
+            self._reset_folder(folder_id)
+            return self.sync_folder(token, folder_id)
+
+        changed = 0
+        while True:
+            for m in data.get("value", []):
+                if "@removed" in m: self.remove(m["id"])
+                else: self.upsert(folder_id, m)
+                changed += 1
+            note_correspondents(token, [m for m in data.get("value", []) if "@removed" not in m], folder_id)
+            if "@odata.nextLink" in data:
+                self._save_state(folder_id, data["@odata.nextLink"], synced_at)
+                data = graph_get(data["@odata.nextLink"], headers=headers)
+                continue
+            self._save_state(folder_id, data.get("@odata.deltaLink"), time.time())
+            return changed
+
+    def sync(self, token, folders=None) -> int:
+        with file_lock(self.path + ".sync.lock"):   # un worker care asteapta continua de la delta link-ul celuilalt
+            changed = sum(self.sync_folder(token, f) for f in (folders or self.folders))
+            from correspondents import get_correspondents
+            if (index := get_correspondents(token_account(token))) is not None:
+                index.backfill(self)   # o singura data: mesajele sincronizate inainte de indexul de corespondenti
+            return changed
+
+    def age(self, folders=None):
+        """Secunde de la cel mai vechi sync complet al folderelor date; None dacă vreunul nu a fost sincronizat."""
+        folders = list(folders or self.folders)
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT synced_at FROM sync_state WHERE folder_id IN ({','.join('?' * len(folders))})", folders).fetchall()
+        stamps = [r[0] for r in rows if r[0] is not None]
+        if len(stamps) < len(folders): return None
+        return time.time() - min(stamps)
+
+    def newest_received(self, folders=None):
+        """receivedDateTime-ul celui mai nou mesaj indexat (datetime UTC) sau None."""
+        folders = list(folders or self.folders)
+        with self.lock:
+            row = self.db.execute(
+                f"SELECT max(received) FROM messages WHERE folder_id IN ({','.join('?' * len(folders))})", folders).fetchone()
+        return datetime.fromisoformat(row[0].replace("Z", "+00:00")) if row and row[0] else None
+
+    # ----- read path -----
+    def _select(self, where, args, limit, folders=None, match=None, rank=False):
+        folders = list(folders or self.folders)
+        where = list(where) + [f"m.folder_id IN ({','.join('?' * len(folders))})"]
+        args = list(args) + folders
+        src = "messages m"
+        if match:
+            src = "messages_fts JOIN messages m ON m.rowid = messages_fts.rowid"
+            where.insert(0, "messages_fts MATCH ?"); args.insert(0, match)
+        order = "bm25(messages_fts)" if match and rank else "m.received DESC"
+        sql = f"SELECT m.data FROM {src} WHERE {' AND '.join(where)} ORDER BY {order} LIMIT ?"
+        with self.lock:
+            rows = self.db.execute(sql, args + [limit]).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    @staticmethod
+    def _since(since):
+        return since.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def _filters(self, sender=None, domain=None, since=None, before=None):
+        where, args = [], []
+        if sender:
+            where.append("m.from_addr = ?"); args.append(sender.strip().lower())
+        elif domain:
+            d = domain.strip().lower().lstrip("@")
+            where.append("(m.from_domain = ? OR m.from_domain LIKE ?)"); args += [d, f"%.{d}"]
+        if since is not None:
+            where.append("m.received >= ?"); args.append(self._since(since))
+        if before is not None:
+            where.append("m.received < ?"); args.append(self._since(before))
+        return where, args
+
+    def query(self, sender=None, domain=None, since=None, folders=None, limit=5):
+        where, args = self._filters(sender, domain, since)
+        return self._select(where, args, limit, folders)
+
+    def search(self, query, since=None, folders=None, limit=20, rank=False, any_terms=False):
+        """
+        O singură interogare indexată: MATCH FTS5 + filtre from/dată + ORDER BY received (rank=True => bm25).
+        `query` e textul din /search (vezi parse_query) sau un dict deja parsat.
+        """
+        q = parse_query(query) if isinstance(query, str) else query
+        where, args = self._filters(q["sender"], q["domain"], query_since(q, since), q["before"])
+        return self._select(where, args, limit, folders, match=fts_match(q, any_terms), rank=rank)
+
+    def by_ids(self, ids, query=None, since=None, folders=None) -> dict:
+        """{id: mesaj} pentru id-urile date care trec de filtrele lui `query` (from:, after:, before:) si de folder."""
+        if not ids: return {}
+        q = query or parse_query("")
+        where, args = self._filters(q["sender"], q["domain"], query_since(q, since), q["before"])
+        where.append(f"m.id IN ({','.join('?' * len(ids))})")
+        return {m["id"]: m for m in self._select(where, args + list(ids), len(ids), folders)}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+_stores = {}
+_store_lock = threading.Lock()
+
+def get_store(login=None) -> MailStore:
+    """Store-ul contului (unul per proces si fisier); fara login => MAIL_STORE_PATH."""
+    path = account_path(MAIL_STORE_PATH, login)
+    store = _stores.get(path)
+    if store is None:
+        with _store_lock:
+            store = _stores.get(path)
+            if store is None:
+                store = _stores[path] = MailStore(path)
+    return store
@@ -0,0 +1,190 @@
+# metrics.py — timpi per etapă și contoare (auth, Graph, paginare, curățare, prompt, LLM, draft)
+# Registry in-process expus de app.py pe /metrics (format text Prometheus) și, opțional, un trace JSON
+# per cerere: lista etapelor cu start/durată și contoarele cererii (retry-uri 429, bytes descărcați...).
+# Trace-ul curent e într-un ContextVar => urmează cererea prin task-uri asyncio și asyncio.to_thread.
+# Nu importă nimic din proiect: kb_mail îl importă direct.
+#
+# .env (opțional):
+#   METRICS_ENABLED=1   # 0 => span()/count() nu mai fac nimic (în afara unui trace cerut explicit)
+#   METRICS_TRACE=0     # 1 => fiecare job din UI își păstrează trace-ul (GET /jobs/{id}/trace)
+
+import contextvars, os, re, threading, time
+from datetime import datetime
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no", "")
+METRICS_TRACE = os.getenv("METRICS_TRACE", "0").lower() not in ("0", "false", "no", "")
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+HELP = {
+    "kb_stage_seconds": ("histogram", "Durata etapelor pipeline-ului (auth, pagination, bodies, clean, prompt_build, llm, draft, job)"),
+    "kb_graph_request_seconds": ("histogram", "Durata cererilor Graph (cu retry-uri), pe metoda si path"),
+    "kb_graph_requests_total": ("counter", "Raspunsuri Graph pe metoda, path si status"),
+    "kb_graph_retries_total": ("counter", "Retry-uri Graph pe cauza (429, 503, 504, network) si nivel (http, batch)"),
+    "kb_graph_bytes_total": ("counter", "Bytes descarcati din Graph, pe path"),
+    "kb_graph_queue_seconds": ("histogram", "Asteptarea in MailboxGate (pauza Retry-After, token bucket, locuri), pe prioritate"),
+    "kb_graph_throttle_pauses_total": ("counter", "Pauze globale ale unei cutii postale dupa un 429"),
+    "kb_graph_pages_total": ("counter", "Pagini de listare/cautare Graph citite"),
+    "kb_clean_bytes_total": ("counter", "Bytes de body (HTML/text) curatati"),
+    "kb_prompt_tokens": ("histogram", "Tokeni in payload-ul construit pentru LLM"),
+    "kb_llm_calls_total": ("counter", "Apeluri LLM pe mod (complete, stream) si cache (hit, miss)"),
+    "kb_llm_tokens_total": ("counter", "Tokeni raportati de API-ul LLM (prompt, completion)"),
+    "kb_llm_first_token_seconds": ("histogram", "Timpul pana la primul fragment al unui apel LLM streamuit"),
+    "kb_jobs_inflight": ("gauge", "Joburi UI in lucru"),
+}
+
+class Registry:
+    """Histograme, contoare si gauge-uri etichetate; thread-safe (un lock, operatii O(1))."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hist = {}     # (nume, etichete) -> [bucket-uri..., sum, count]
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value, labels=(), buckets=STAGE_BUCKETS):
+        key = (name, labels)
+        with self.lock:
+            h = self.hist.get(key)
+            if h is None: h = self.hist[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for k, b in enumerate(buckets):
+                if value <= b: h[1][k] += 1; break
+            h[2] += value; h[3] += 1
+
+    def inc(self, name, n=1, labels=()):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def set(self, name, value, labels=()):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def render(self) -> str:
+        """Formatul text Prometheus 0.0.4."""
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}" if items else ""
+        with self.lock:
+            hist = {k: (v[0], list(v[1]), v[2], v[3]) for k, v in self.hist.items()}
+            series = {**self.counters, **self.gauges}
+        lines, names = [], sorted({n for n, _ in hist} | {n for n, _ in series})
+        for name in names:
+            kind, text = HELP.get(name, ("untyped", name))
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            for (n, labels), (buckets, counts, total, count) in sorted(hist.items()):
+                if n != name: continue
+                cum = 0
+                for b, c in zip(buckets, counts):
+                    cum += c
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', repr(float(b)))])} {cum}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {count}")
+                lines += [f"{name}_sum{fmt(labels)} {total:.6f}", f"{name}_count{fmt(labels)} {count}"]
+            for (n, labels), v in sorted(series.items()):
+                if n == name: lines.append(f"{name}{fmt(labels)} {v}")
+        return "\n".join(lines) + "\n"
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+REGISTRY = Registry()
+_trace = contextvars.ContextVar("kb_trace", default=None)
+
+class Trace:
+    """Etapele si contoarele unei singure cereri (job UI / rulare CLI)."""
+    def __init__(self, name, **attrs):
+        self.name, self.attrs = name, attrs
+        self.started, self.t0 = datetime.now().astimezone(), time.perf_counter()
+        self.spans, self.counts = [], {}
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, **self.attrs, "started": self.started.isoformat(timespec="milliseconds"),
+                "elapsed_ms": round((time.perf_counter() - self.t0) * 1000, 2),
+                "counts": dict(self.counts), "spans": list(self.spans)}
+
+class Span:
+    """Context manager pentru o etapa: histograma + intrarea din trace-ul curent. set() adauga atribute (tokeni...)."""
+    active = True
+    __slots__ = ("stage", "metric", "labels", "trace", "attrs", "t0")
+
+    def __init__(self, stage, metric, labels, trace):
+        self.stage, self.metric, self.labels, self.trace, self.attrs = stage, metric, labels, trace, {}
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        dt = time.perf_counter() - self.t0
+        if METRICS_ENABLED:
+            REGISTRY.observe(self.metric, dt, self.labels)
+        if self.trace is not None:
+            entry = {"stage": self.stage, **dict(self.labels), **self.attrs,
+                     "start_ms": round((self.t0 - self.trace.t0) * 1000, 2), "ms": round(dt * 1000, 2)}
+            if exc_type is not None: entry["error"] = exc_type.__name__
+            self.trace.spans.append(entry)
+
+class _NoSpan:
+    active = False
+    def set(self, **attrs): pass
+    def __enter__(self): return self
+    def __exit__(self, *exc): pass
+
+_NOSPAN = _NoSpan()
+
+def span(stage, metric=None, **labels):
+    """
+    with span("llm") as s: ...  => kb_stage_seconds{stage="llm"}; cu metric dat, histograma `metric` cu `labels`.
+    Dezactivat (si fara trace) => un singur obiect no-op partajat, fara ceas si fara lock.
+    """
+    tr = _trace.get()
+    if not METRICS_ENABLED and tr is None: return _NOSPAN
+    if metric is None:
+        metric, labels = "kb_stage_seconds", {"stage": stage, **labels}
+    return Span(stage, metric, tuple(labels.items()), tr)
+
+def count(name, n=1, **labels):
+    """Contor in registry si, daca exista, in trace-ul cererii curente (cheia = nume + etichete)."""
+    tr = _trace.get()
+    if METRICS_ENABLED:
+        REGISTRY.inc(name, n, tuple(labels.items()))
+    if tr is not None:
+        key = name + "".join(f":{v}" for v in labels.values())
+        tr.counts[key] = tr.counts.get(key, 0) + n
+
+def observe(name, value, buckets=STAGE_BUCKETS, **labels):
+    if METRICS_ENABLED:
+        REGISTRY.observe(name, value, tuple(labels.items()), buckets)
+
+def gauge(name, value, **labels):
+    REGISTRY.set(name, value, tuple(labels.items()))
+
+def start_trace(name, **attrs):
+    """Trace nou pentru contextul curent; (trace, token) — token-ul e pentru end_trace."""
+    tr = Trace(name, **attrs)
+    return tr, _trace.set(tr)
+
+def end_trace(token):
+    _trace.reset(token)
+
+def current_trace():
+    return _trace.get()
+
+def ctx_map(pool, fn, items):
+    """pool.map care duce contextul apelantului (trace-ul curent) in thread-urile pool-ului."""
+    return pool.map(lambda a: a[0].run(fn, a[1]), [(contextvars.copy_context(), x) for x in items])
+
+RE_GRAPH_ID = re.compile(r"/(messages|mailFolders|users|contacts|events)/(?!delta\b)[^/?]+")
+
+def graph_path(url: str) -> str:
+    """Path-ul Graph ca eticheta cu cardinalitate mica: fara host, query si id-uri (/me/messages/{id}/createReply)."""
+    path = url.split("?", 1)[0]
+    if "://" in path: path = "/" + path.split("://", 1)[1].split("/", 1)[-1]
+    path = re.sub(r"^/(v1\.0|beta)(?=/)", "", path)
+    return RE_GRAPH_ID.sub(lambda m: f"/{m.group(1)}/{{id}}", path)
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,37 @@
+# msal_cache.py — cache-ul de token-uri MSAL pe disc, un fișier per cont (TOKEN_CACHE_DIR/<login>.json)
+# Separat de kb_mail ca `import kb_mail` să nu încarce msal: AuthManager îl importă la primul login/refresh.
+
+import os
+
+import msal
+
+from kb_mail import file_lock
+
+class FileCache(msal.SerializableTokenCache):
+    """
+    Cache-ul MSAL pe disc. Se recitește doar dacă fișierul s-a schimbat (alt proces/worker) și se scrie doar
+    când has_state_changed, atomic (tmp + replace) și sub file_lock.
+    """
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        self.mtime = None
+        self.reload()
+
+    def reload(self):
+        try: mtime = os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError: return
+        if mtime == self.mtime: return
+        with file_lock(self.filename + ".lock"), open(self.filename, "r", encoding="utf-8") as f:
+            self.deserialize(f.read())
+        self.mtime = mtime
+
+    def persist(self):
+        if not self.has_state_changed: return
+        with file_lock(self.filename + ".lock"):
+            tmp = f"{self.filename}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.serialize())
+            os.replace(tmp, self.filename)
+            self.mtime = os.stat(self.filename).st_mtime_ns
+            self.has_state_changed = False
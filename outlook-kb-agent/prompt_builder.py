@@ -0,0 +1,195 @@
+# prompt_builder.py — payload-ul LLM compact: legendă de participanți, boilerplate eliminat, buget per mesaj
+# email_item/plan_threads dau reprezentarea completă a emailurilor; slim_payload o comprimă înainte de apel:
+#   - adresele (from/to/cc, participants) devin indici într-o singură legendă "people" (cele mai frecvente primele);
+#   - datele ISO devin "YYYY-MM-DD HH:MM" în fusul orar al payload-ului (fără secunde, fără sufix);
+#   - liniile comune mai multor mesaje (disclaimere, footere, citări între fire) se detectează prin n-grame de cuvinte:
+#     cele prezente în >= PROMPT_BOILERPLATE_MIN mesaje trec o singură dată în "boilerplate", celelalte rămân doar
+#     la prima apariție — nimic nu se pierde, doar nu se mai repetă;
+#   - bugetul de caractere se împarte pe mesaje după recență și relevanța pentru query; un text scurtat păstrează
+#     liniile cu termenii căutați și începutul mesajului, cu "…" în locul liniilor omise. Un set care depășește
+#     oricum LLM_CHUNK_TOKENS nu e scurtat: merge la map-reduce, unde fiecare lot are bugetul lui.
+#
+# .env (opțional):
+#   PROMPT_BUDGET_TOKENS=6000    # bugetul textului emailurilor dintr-un payload (0 = fără buget, doar BODY_CHAR_BUDGET)
+#   PROMPT_BOILERPLATE_MIN=3     # o linie repetată în atâtea mesaje e boilerplate (0 = fără detecție)
+
+import math, os, re, unicodedata
+from collections import Counter
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from kb_mail import LLM_CHUNK_TOKENS, TZ_NAME
+
+PROMPT_BUDGET_TOKENS = int(os.getenv("PROMPT_BUDGET_TOKENS", "6000"))
+PROMPT_BOILERPLATE_MIN = int(os.getenv("PROMPT_BOILERPLATE_MIN", "3"))
+
+CHARS_PER_TOKEN = 4        # aceeași estimare ca count_tokens fără tiktoken
+MIN_MESSAGE_CHARS = 400    # orice mesaj păstrează cel puțin atât; un payload tot prea mare ajunge la map-reduce
+RECENCY_HALF_LIFE = 8      # ponderea unui mesaj se înjumătățește la fiecare 8 mesaje mai noi decât el
+SHINGLE_WORDS = 6          # n-grame lungi: frazele uzuale ("va rog sa imi trimiteti") nu fac o linie comuna
+MIN_SHARED_LINE = 20       # ca MIN_DEDUPE_LINE: liniile scurte ("Multumesc,", "Salut") nu sunt atinse
+SHARED_FRACTION = 0.8      # o linie e comună dacă >= 80% din n-gramele ei sunt comune
+ELLIPSIS = "…"
+
+RE_WORD = re.compile(r"\w+")
+
+def _fold(text: str) -> str:
+    if text.isascii(): return text.lower()
+    return "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+
+def query_terms(query) -> list:
+    return sorted({w for w in RE_WORD.findall(_fold(query or "")) if len(w) >= 3})
+
+def _zone(name):
+    try: return ZoneInfo(name or TZ_NAME)
+    except Exception: return None
+
+def short_time(iso, tz=None) -> str:
+    """"2024-05-02T07:15:09Z" -> "2024-05-02 10:15" (în tz, dacă e dat)."""
+    if not iso: return ""
+    try:
+        dt = datetime.fromisoformat(iso)
+    except ValueError:
+        return iso[:16].replace("T", " ")
+    if tz is not None and dt.tzinfo is not None: dt = dt.astimezone(tz)
+    return dt.strftime("%Y-%m-%d %H:%M")
+
+# ---------- boilerplate ----------
+def _shingles(line: str) -> set:
+    words = RE_WORD.findall(_fold(line))
+    if len(" ".join(words)) < MIN_SHARED_LINE: return set()
+    if len(words) < SHINGLE_WORDS: return {" ".join(words)}
+    return {" ".join(words[k:k + SHINGLE_WORDS]) for k in range(len(words) - SHINGLE_WORDS + 1)}
+
+def strip_shared(texts, min_messages=None):
+    """
+    (texte, boilerplate): o linie ale cărei n-grame apar (>= SHARED_FRACTION) în >= min_messages mesaje e
+    boilerplate — scoasă din toate textele și păstrată o dată în listă; una deja apărută într-un mesaj anterior
+    (din listă) nu se mai repetă.
+    """
+    min_messages = PROMPT_BOILERPLATE_MIN if min_messages is None else min_messages
+    if min_messages <= 0 or len(texts) < 2: return list(texts), []
+    split = [[(line, _shingles(line)) for line in t.split("\n")] for t in texts]
+    df = Counter(s for lines in split for s in set().union(*(sh for _, sh in lines)))
+    seen, out, shared = set(), [], []
+    for lines in split:
+        kept = []
+        for line, sh in lines:
+            if sh:
+                need = SHARED_FRACTION * len(sh)
+                if sum(s in seen for s in sh) >= need: continue
+                seen.update(sh)
+                if sum(df[s] >= min_messages for s in sh) >= need:
+                    shared.append(line.strip()); continue
+            kept.append(line)
+        out.append(re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip())
+    return out, shared
+
+# ---------- buget ----------
+def allocate(lengths, weights, total, floor=MIN_MESSAGE_CHARS) -> list:
+    """
+    Limita de caractere per mesaj: cote proporționale cu ponderile (water-filling) — un mesaj mai scurt decât
+    cota lui o cedează celorlalte. Niciun mesaj nu coboară sub `floor` (sau sub lungimea lui).
+    """
+    limits, open_, left = list(lengths), set(range(len(lengths))), total
+    while open_:
+        wsum = sum(weights[k] for k in open_)
+        fits = {k for k in open_ if lengths[k] <= left * weights[k] / wsum}
+        if not fits: break
+        left -= sum(lengths[k] for k in fits); open_ -= fits
+    for k in open_:
+        limits[k] = min(lengths[k], max(floor, int(left * weights[k] / wsum)))
+    return limits
+
+def fit_text(text, limit, terms=()) -> str:
+    """Textul în ~limit caractere: întâi liniile cu termenii din query, apoi începutul mesajului; "…" = linii omise."""
+    if len(text) <= limit: return text
+    lines = text.split("\n")
+    hot = [k for k, line in enumerate(lines) if terms and any(t in _fold(line) for t in terms)]
+    keep, used = {}, 0
+    for k in hot:
+        if used + len(lines[k]) + 1 <= limit:
+            keep[k] = lines[k]; used += len(lines[k]) + 1
+    for k in range(len(lines)):
+        if k in keep: continue
+        if used + len(lines[k]) + 1 > limit:
+            if limit - used >= 80:   # linia la care s-a epuizat bugetul: un prefix, la granița unui cuvânt
+                keep[k] = lines[k][:limit - used].rsplit(" ", 1)[0] + ELLIPSIS
+            break
+        keep[k] = lines[k]; used += len(lines[k]) + 1
+    if not keep: return text[:limit] + ELLIPSIS
+    out, prev = [], -1
+    for k in sorted(keep):
+        if k > prev + 1: out.append(ELLIPSIS)
+        out.append(keep[k]); prev = k
+    if prev < len(lines) - 1 and not out[-1].endswith(ELLIPSIS): out.append(ELLIPSIS)
+    return "\n".join(out)
+
+def budget_texts(items, texts, terms=(), budget_tokens=None) -> list:
+    """Textele scurtate la bugetul payload-ului; pondere = recență (după received) x relevanță (aparițiile termenilor)."""
+    budget_tokens = PROMPT_BUDGET_TOKENS if budget_tokens is None else budget_tokens
+    if budget_tokens <= 0 or not texts: return list(texts)
+    order = sorted(range(len(items)), key=lambda k: items[k].get("received") or "", reverse=True)
+    rank = {k: r for r, k in enumerate(order)}
+    weights = []
+    for k, (it, text) in enumerate(zip(items, texts)):
+        hits = sum(_fold(f"{it.get('subject') or ''}\n{text}").count(t) for t in terms) if terms else 0
+        weights.append(0.5 ** (rank[k] / RECENCY_HALF_LIFE) * (1 + math.log1p(hits)))
+    limits = allocate([len(t) for t in texts], weights, budget_tokens * CHARS_PER_TOKEN)
+    return [fit_text(t, n, terms) for t, n in zip(texts, limits)]
+
+# ---------- payload ----------
+def _legend(items, threads) -> list:
+    freq = Counter()
+    for it in items:
+        freq.update(a for a in [it.get("from"), *(it.get("to") or ()), *(it.get("cc") or ())] if a)
+    for t in threads:
+        freq.update(a for a in t.get("participants") or () if a)
+    return [a for a, _ in freq.most_common()]   # egalitate => ordinea primei apariții
+
+def _slim_item(it, text, ref, tz, thread_subject=None) -> dict:
+    from conversations import base_subject
+    out = {"i": it["i"]}
+    subject = it.get("subject") or ""
+    if subject and not (thread_subject and base_subject(subject) == thread_subject): out["subject"] = subject
+    if it.get("from"): out["from"] = ref[it["from"]]
+    for f in ("to", "cc"):
+        if it.get(f): out[f] = [ref[a] for a in it[f] if a]
+    out["received"] = short_time(it.get("received"), tz)
+    out["snippet"] = text
+    return out
+
+def slim_payload(payload: dict, map_reduce=True) -> dict:
+    """
+    Copia compactă a unui payload cu "emails" (plat sau fir unic) sau "threads" (plan_threads). Intrările din
+    "threads" sunt modificate pe loc: plan_threads le leagă de joburile de rezumat al firelor.
+    map_reduce=False: payload-ul merge într-un singur apel (rezumatul unui fir), deci bugetul se aplică mereu.
+    """
+    tz = _zone(payload.get("timezone"))
+    threads = payload.get("threads")
+    groups = [(t, t.get("emails") or []) for t in threads] if threads is not None else [(None, payload.get("emails") or [])]
+    items = [it for _, g in groups for it in g]
+    people = _legend(items, threads or ())
+    ref = {a: k for k, a in enumerate(people)}
+    terms = query_terms(payload.get("query"))
+    texts, shared = strip_shared([it.get("snippet") or "" for it in items])
+    # peste LLM_CHUNK_TOKENS map_reduce_plan împarte oricum mesajele pe loturi: tăiate aici la PROMPT_BUDGET_TOKENS,
+    # n-ar mai ajunge la map-reduce și ar rămâne câteva sute de caractere fiecare
+    over = map_reduce and sum(map(len, texts)) > LLM_CHUNK_TOKENS * CHARS_PER_TOKEN
+    texts = iter(budget_texts(items, texts, terms, 0 if over else None))
+
+    out = {k: v for k, v in payload.items() if v is not None and k not in ("emails", "threads")}
+    out["people"] = people
+    if shared:   # cu buget: cel mult 1/10 din el (o listă mare înseamnă mai degrabă citări decât footere)
+        cap = max(MIN_MESSAGE_CHARS, PROMPT_BUDGET_TOKENS * CHARS_PER_TOKEN // 10) if PROMPT_BUDGET_TOKENS > 0 else math.inf
+        out["boilerplate"] = fit_text("\n".join(shared), cap, terms)
+    for t, group in groups:
+        subject = (t or payload).get("subject")
+        slim = [_slim_item(it, next(texts), ref, tz, subject) for it in group]
+        if t is None:
+            out["emails"] = slim; continue
+        t["participants"] = [ref[a] for a in t.get("participants") or () if a in ref]
+        t["latest"] = short_time(t.get("latest"), tz)
+        if "emails" in t: t["emails"] = slim
+    if threads is not None: out["threads"] = threads
+    return out
@@ -23,6 +23,8 @@ required = {
     "fastapi": "fastapi",
     "uvicorn": "uvicorn[standard]",
     "multipart": "python-multipart",
+    "httpx": "httpx",
+    "numpy": "numpy",
 }
 missing = []
 for module, package in required.items():
@@ -0,0 +1,336 @@
+# semantic.py — căutare semantică locală peste store-ul mail_store (modurile "semantic" și "hybrid" din /search)
+# Textul curățat al fiecărui mesaj (body_text din store, cu subiectul în față) e tăiat în bucăți de cel mult
+# SEMANTIC_CHUNK_CHARS caractere și transformat în vectori normalizați de un embedder pluggable:
+#   hashing (implicit): cuvinte + n-grame de caractere hash-uite cu semn în SEMANTIC_DIM dimensiuni; offline,
+#            fără model — prinde formele flexionare (factura/facturii, renegotiate/renegotiation), nu sinonimele
+#   orice alt SEMANTIC_MODEL = un model sentence-transformers local, pe CPU (parafraze: "revised quote" ~ "price renegotiation")
+# Vectorii stau într-un fișier float16 memory-mapped (numpy.memmap) lângă store; tabela semantic_chunks din
+# același SQLite leagă rândurile de mesaje. Upsert incremental: store-ul pune embedded = 0 când se schimbă textul
+# unui mesaj, refresh() le (re)vectorizează; rândurile eliberate (mesaj modificat/șters) se refolosesc.
+# Căutarea = produs matrice-vector pe blocuri + argpartition (top-k); scorul unui mesaj = cea mai bună bucată.
+# Mai mulți workeri pe același store: refresh() se serializează pe <vectors>.lock, iar fiecare commit crește
+# `generation` din semantic_meta => celelalte procese își recitesc harta rândurilor înainte de următoarea căutare.
+# numpy se importă doar în funcțiile care îl folosesc (ca sentence-transformers): modulul se încarcă și fără el.
+#
+# .env (opțional):
+#   SEMANTIC_MODEL=hashing          # sau numele/calea unui model sentence-transformers
+#   SEMANTIC_DIM=1024               # dimensiunea vectorilor hashing (2 KB float16 per bucată)
+#   SEMANTIC_CHUNK_CHARS=1200
+#   SEMANTIC_HYBRID_WEIGHT=0.5      # hybrid: ponderea rangului semantic față de cel FTS (0..1)
+
+import os, re, threading, unicodedata, zlib
+from functools import lru_cache
+
+from kb_mail import file_lock
+from mail_store import parse_query
+
+SEMANTIC_MODEL = os.getenv("SEMANTIC_MODEL", "hashing")
+SEMANTIC_DIM = int(os.getenv("SEMANTIC_DIM", "1024"))
+SEMANTIC_CHUNK_CHARS = int(os.getenv("SEMANTIC_CHUNK_CHARS", "1200"))
+SEMANTIC_HYBRID_WEIGHT = float(os.getenv("SEMANTIC_HYBRID_WEIGHT", "0.5"))
+MAX_CHUNKS = 8          # bucăți per mesaj: un email uriaș nu umple indexul
+EMBED_BATCH = 256       # mesaje vectorizate per rundă de refresh
+SCORE_BLOCK = 8192      # rânduri float16 convertite la float32 odată (~32 MB la 1024 dimensiuni)
+RRF_K = 60              # constanta reciprocal rank fusion
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS semantic_chunks (
+    row INTEGER PRIMARY KEY,
+    message_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_semantic_chunks_message ON semantic_chunks(message_id);
+CREATE TABLE IF NOT EXISTS semantic_free (row INTEGER PRIMARY KEY);
+CREATE INDEX IF NOT EXISTS ix_messages_pending ON messages(embedded) WHERE embedded = 0;
+CREATE TABLE IF NOT EXISTS semantic_meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TRIGGER IF NOT EXISTS messages_semantic_ad AFTER DELETE ON messages BEGIN
+    INSERT OR IGNORE INTO semantic_free(row) SELECT row FROM semantic_chunks WHERE message_id = old.id;
+    DELETE FROM semantic_chunks WHERE message_id = old.id;
+END;
+"""
+
+# ---------- embedders ----------
+RE_WORD = re.compile(r"\w+")
+
+def _fold(text: str) -> str:
+    """lowercase fără diacritice (ca tokenizer-ul FTS: unicode61 remove_diacritics)."""
+    return "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+
+class HashingEmbedder:
+    """
+    Feature hashing fără vocabular: fiecare cuvânt (pondere 1) și n-gramele lui de 4 caractere (bloc de normă 1)
+    cad, cu semn, într-una din `dim` dimensiuni (crc32 => stabil între procese). tf sublinear, normă L2.
+    Trăsăturile unui cuvânt se calculează o singură dată (lru_cache): vocabularul unei cutii poștale e mic.
+    """
+    def __init__(self, dim=SEMANTIC_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @lru_cache(maxsize=200_000)
+    def _features(self, word):
+        import numpy as np
+        word = _fold(word)
+        feats = ["w:" + word]
+        if len(word) > 3:
+            w = f"<{word}>"
+            feats += [w[i:i + 4] for i in range(len(w) - 3)]
+        h = np.array([zlib.crc32(f.encode("utf-8")) for f in feats], dtype=np.uint32)
+        weights = np.full(len(feats), 1.0, dtype=np.float32)
+        if len(feats) > 1: weights[1:] = 1.0 / np.sqrt(len(feats) - 1)   # doua forme ale aceluiasi cuvant => ~ ponderea unui cuvant
+        signs = np.where(h & 0x80000000, -1.0, 1.0).astype(np.float32)
+        return (h % self.dim).astype(np.int64), weights * signs
+
+    def embed(self, texts) -> "np.ndarray":
+        import numpy as np
+        idx, val = [], []
+        for row, text in enumerate(texts):
+            counts = {}
+            for w in RE_WORD.findall(text.lower()):
+                counts[w] = counts.get(w, 0) + 1
+            for w, c in counts.items():
+                f, v = self._features(w)
+                idx.append(f + row * self.dim); val.append(v * (1.0 + np.log(c)))
+        out = np.zeros(len(texts) * self.dim, dtype=np.float32)
+        if idx:
+            out += np.bincount(np.concatenate(idx), weights=np.concatenate(val), minlength=out.size).astype(np.float32)
+        return _normalize(out.reshape(len(texts), self.dim))
+
+class SentenceTransformerEmbedder:
+    """Model sentence-transformers local (CPU); pachetul e opțional și se importă doar când e folosit."""
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st:{model_name}"
+
+    def embed(self, texts) -> "np.ndarray":
+        import numpy as np
+        return self.model.encode(list(texts), batch_size=32, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+def _normalize(v):
+    import numpy as np
+    norms = np.linalg.norm(v, axis=1, keepdims=True)
+    return v / np.where(norms == 0, 1.0, norms)
+
+def make_embedder(model=SEMANTIC_MODEL):
+    return HashingEmbedder() if model in ("", "hashing") else SentenceTransformerEmbedder(model)
+
+def chunk_text(subject, body, size=SEMANTIC_CHUNK_CHARS):
+    """Bucăți de cel mult `size` caractere, tăiate la paragraf (sau la spațiu), fiecare cu subiectul în față."""
+    head = f"{subject}\n" if subject else ""
+    chunks, cur = [], ""
+    for para in re.split(r"\n\s*\n", body or ""):
+        para = para.strip()
+        while len(para) > size:
+            cut = para.rfind(" ", 0, size)
+            cut = cut if cut > size // 2 else size
+            if cur: chunks.append(cur); cur = ""
+            chunks.append(para[:cut]); para = para[cut:].strip()
+        if cur and len(cur) + len(para) + 2 > size:
+            chunks.append(cur); cur = ""
+        cur = f"{cur}\n\n{para}" if cur else para
+    if cur: chunks.append(cur)
+    return [head + c for c in chunks[:MAX_CHUNKS]] or [head.strip()]
+
+# ---------- index ----------
+class SemanticIndex:
+    """
+    Vectorii float16 (memmap, rândul r = o bucată) + metadatele din SQLite-ul store-ului. Thread-safe:
+    refresh() și search() se serializează pe un lock (refresh poate remapa fișierul când crește);
+    între procese, refresh() ține și file_lock-ul indexului.
+    """
+    def __init__(self, store, embedder=None, path=None):
+        self.store = store
+        self.embedder = embedder or make_embedder()
+        self.dim = self.embedder.dim
+        self.path = path or store.path + ".vectors"
+        self.lock = threading.RLock()
+        with store.lock:
+            store.db.executescript(SCHEMA)
+            row = store.db.execute("SELECT value FROM semantic_meta WHERE key = 'embedder'").fetchone()
+            if row is None or row[0] != self.embedder.name:   # alt embedder => alt spațiu vectorial: reindexăm tot
+                store.db.execute("DELETE FROM semantic_chunks")
+                store.db.execute("DELETE FROM semantic_free")
+                store.db.execute("UPDATE messages SET embedded = 0")
+                store.db.execute("INSERT OR REPLACE INTO semantic_meta(key, value) VALUES ('embedder', ?)", (self.embedder.name,))
+                store.db.commit()
+                if os.path.exists(self.path): os.remove(self.path)
+        self.vectors, self.capacity = None, 0
+        self._load()
+
+    def _generation(self) -> int:
+        with self.store.lock:
+            row = self.store.db.execute("SELECT value FROM semantic_meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _load(self):
+        """Harta rândurilor din semantic_chunks și maparea fișierului (la deschidere și după refresh-ul altui proces)."""
+        import numpy as np
+        with self.store.lock:
+            self.generation = self._generation()
+            rows = self.store.db.execute("SELECT row, message_id FROM semantic_chunks").fetchall()
+        self._map(os.path.getsize(self.path) // (2 * self.dim) if os.path.exists(self.path) else 0)
+        self.size = max((r for r, _ in rows), default=-1) + 1   # rânduri folosite vreodată (high-water mark)
+        self.owner = [None] * self.capacity                      # rând -> message_id (None = liber)
+        self.alive = np.zeros(self.capacity, dtype=bool)
+        for r, mid in rows:
+            self.owner[r] = mid; self.alive[r] = True
+
+    def _fresh(self):
+        if self._generation() != self.generation: self._load()
+
+    def _map(self, capacity):
+        """(Re)mapează fișierul la `capacity` rânduri; îl mărește dacă e nevoie."""
+        import numpy as np
+        self.vectors = None
+        if capacity <= 0: self.capacity = 0; return
+        with open(self.path, "ab") as f:
+            if f.tell() < capacity * 2 * self.dim: f.truncate(capacity * 2 * self.dim)
+        self.vectors = np.memmap(self.path, dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def _grow(self, need):
+        import numpy as np
+        capacity = max(need, 2 * self.capacity, 1024)
+        if self.vectors is not None: self.vectors.flush()
+        self._map(capacity)
+        self.owner += [None] * (capacity - len(self.owner))
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - len(self.alive), dtype=bool)])
+
+    def _sync_freed(self):
+        """Rândurile eliberate în SQLite de triggerul de ștergere (sync delta) dispar și din vedere."""
+        with self.store.lock:
+            freed = [r for (r,) in self.store.db.execute("SELECT row FROM semantic_free").fetchall()]
+        for r in freed:
+            if r < self.capacity: self.alive[r] = False; self.owner[r] = None
+        return freed
+
+    def refresh(self) -> int:
+        """Vectorizează mesajele noi/modificate din store (embedded = 0); întoarce câte mesaje au fost indexate."""
+        import numpy as np
+        db, done = self.store.db, 0
+        with self.lock, file_lock(self.path + ".lock"):
+            self._fresh()
+            free = self._sync_freed()
+            while True:
+                with self.store.lock:
+                    batch = db.execute("SELECT id, subject, body_text FROM messages WHERE embedded = 0 LIMIT ?", (EMBED_BATCH,)).fetchall()
+                    if not batch: return done
+                    ids = [b[0] for b in batch]
+                    old = [r for (r,) in db.execute(f"SELECT row FROM semantic_chunks WHERE message_id IN ({','.join('?' * len(ids))})", ids)]
+                pieces = [(mid, c) for mid, subject, body in batch for c in chunk_text(subject, body)]
+                emb = self.embedder.embed([c for _, c in pieces]).astype(np.float16)
+                avail = sorted(set(free) | set(old))
+                rows = avail[:len(pieces)] + list(range(self.size, self.size + max(0, len(pieces) - len(avail))))
+                free = avail[len(pieces):]
+                if rows[-1] >= self.capacity: self._grow(rows[-1] + 1)
+                self.vectors[rows] = emb
+                self.vectors.flush()   # vectorii pe disc înainte ca SQLite să-i refere
+                with self.store.lock:
+                    db.execute(f"DELETE FROM semantic_chunks WHERE message_id IN ({','.join('?' * len(ids))})", ids)
+                    db.executemany("INSERT OR IGNORE INTO semantic_free(row) VALUES (?)", [(r,) for r in old])
+                    db.executemany("DELETE FROM semantic_free WHERE row = ?", [(r,) for r in rows])
+                    db.executemany("INSERT INTO semantic_chunks(row, message_id) VALUES (?,?)", [(r, mid) for r, (mid, _) in zip(rows, pieces)])
+                    # doar dacă textul nu s-a schimbat între timp (un sync concurent l-ar fi pus din nou pe 0)
+                    db.executemany("UPDATE messages SET embedded = 1 WHERE id = ? AND subject = ? AND body_text = ?", batch)
+                    db.execute("INSERT INTO semantic_meta(key, value) VALUES ('generation', 1) "
+                               "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+                    db.commit()
+                    self.generation = self._generation()
+                for r in old: self.alive[r] = False; self.owner[r] = None
+                for r, (mid, _) in zip(rows, pieces): self.alive[r] = True; self.owner[r] = mid
+                self.size = max(self.size, rows[-1] + 1)
+                done += len(batch)
+
+    def scores(self, text) -> "np.ndarray":
+        """Similaritatea cosinus a fiecărui rând cu `text` (-inf pentru rândurile libere)."""
+        import numpy as np
+        q = self.embedder.embed([text])[0].astype(np.float32)
+        # un query hashing are câteva zeci de dimensiuni nenule: citim doar coloanele lor (conversia float16 e scumpă)
+        cols = np.flatnonzero(q)
+        if len(cols) > self.dim // 8: cols = slice(None)
+        out = np.full(self.size, -np.inf, dtype=np.float32)
+        for start in range(0, self.size, SCORE_BLOCK):
+            end = min(self.size, start + SCORE_BLOCK)
+            out[start:end] = self.vectors[start:end, cols].astype(np.float32) @ q[cols]
+        out[~self.alive[:self.size]] = -np.inf
+        return out
+
+    def ranked(self, text, first=20):
+        """
+        Generator de loturi [(message_id, scor)], descrescător: primul lot are cel mult `first` mesaje, apoi
+        fereastra se dublează (pentru filtrele care elimină candidați). Scorurile se calculează o singură dată.
+        """
+        import numpy as np
+        with self.lock:
+            self._fresh()
+            if self.size == 0: return
+            scores, owner = self.scores(text), self.owner[:self.size]
+            alive = int(self.alive[:self.size].sum())
+        seen, take = set(), min(alive, first * MAX_CHUNKS)
+        while take > 0:
+            top = np.argpartition(-scores, take - 1)[:take] if take < len(scores) else np.arange(len(scores))
+            batch = []
+            for r in top[np.argsort(-scores[top])]:
+                mid = owner[r]
+                if mid is not None and mid not in seen:
+                    seen.add(mid); batch.append((mid, float(scores[r])))
+            if batch: yield batch
+            if take >= alive: return
+            scores[top] = -np.inf   # lotul următor: doar rândurile rămase
+            alive, take = alive - take, min(alive - take, 2 * take)
+
+    def search(self, text, k=20):
+        """[(message_id, scor)] — cele mai bune `k` mesaje (scorul mesajului = cea mai bună bucată)."""
+        return next(self.ranked(text, k), [])[:k]
+
+    def count(self) -> int:
+        with self.lock:
+            self._fresh()
+            return int(self.alive[:self.size].sum())
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_semantic_index(store) -> SemanticIndex:
+    """Un index per store (cale); creat la prima căutare semantică."""
+    idx = _indexes.get(store.path)
+    if idx is None:
+        with _indexes_lock:
+            idx = _indexes.get(store.path)
+            if idx is None:
+                idx = _indexes[store.path] = SemanticIndex(store)
+    return idx
+
+def refresh_existing(store) -> int:
+    """După un sync: ține la zi indexul, dacă a fost deja construit (nu îl creează la primul sync)."""
+    if store.path not in _indexes and not os.path.exists(store.path + ".vectors"): return 0
+    return get_semantic_index(store).refresh()
+
+# ---------- căutare ----------
+def semantic_search(store, query, top=20, since=None, folders=None, mode="semantic"):
+    """
+    Mesajele (forma Graph) cele mai apropiate de textul liber din `query`; filtrele from:/after:/before:
+    și folderul se aplică peste candidați. mode="hybrid" => fuziune RRF ponderată cu rezultatele FTS (bm25).
+    """
+    q = parse_query(query)
+    text = " ".join(q["phrases"] + q["subject"]).strip()
+    if not text:   # doar filtre: nimic de comparat semantic
+        return store.search(q, since=since, folders=folders, limit=top)
+    idx = get_semantic_index(store)
+    idx.refresh()
+    ranked, found = [], {}
+    for batch in idx.ranked(text, top * 4):   # loturi tot mai mari cât timp filtrele elimină candidați
+        found.update(store.by_ids([mid for mid, _ in batch], q, since, folders))
+        ranked += [mid for mid, _ in batch if mid in found]
+        if len(ranked) >= top: break
+    if mode != "hybrid":
+        return [found[mid] for mid in ranked[:top]]
+
+    keyword = store.search(q, since=since, folders=folders, limit=top * 4, rank=True, any_terms=True)
+    w, fused = min(1.0, max(0.0, SEMANTIC_HYBRID_WEIGHT)), {}
+    for rank, mid in enumerate(ranked):
+        fused[mid] = fused.get(mid, 0.0) + w / (RRF_K + rank)
+    for rank, m in enumerate(keyword):
+        found.setdefault(m["id"], m)
+        fused[m["id"]] = fused.get(m["id"], 0.0) + (1 - w) / (RRF_K + rank)
+    return [found[mid] for mid in sorted(fused, key=fused.get, reverse=True)[:top]]
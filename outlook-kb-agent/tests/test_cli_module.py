@@ -0,0 +1,30 @@
+# test_cli_module.py — python kb_mail.py (modulul rulat ca __main__) și modulele care fac `from kb_mail import ...`
+# trebuie să împartă același AuthManager: altfel token_account(token) e None în watermarks/digest/mail_store
+# și --login X scrie în starea contului implicit.
+
+import subprocess, sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SCRIPT = """
+import runpy, sys
+sys.argv = ["kb_mail.py", "--cache-stats"]
+try: runpy.run_path("kb_mail.py", run_name="__main__")
+except SystemExit: pass
+main = sys.modules["kb_mail"]
+assert main.__name__ == "__main__", main.__name__
+main.get_auth().owners["tok"] = "ana@firma.ro"
+import watermarks, mail_store
+for mod in (watermarks, mail_store):
+    assert mod.token_account("tok") == "ana@firma.ro", mod.__name__
+assert watermarks.watermark_key("bob@alt.ro", account=watermarks.token_account("tok")).startswith("ana@firma.ro/")
+print("ok")
+"""
+
+def test_cli_shares_auth_with_helper_modules(tmp_path):
+    env = {"PATH": "", "LLM_CACHE_PATH": str(tmp_path / "llm.sqlite3"), "WATERMARK_PATH": str(tmp_path / "wm.sqlite3"),
+           "CORRESPONDENTS_PATH": str(tmp_path / "c.sqlite3"), "MAIL_STORE_PATH": str(tmp_path / "ms.sqlite3")}
+    r = subprocess.run([sys.executable, "-c", SCRIPT], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60)
+    assert r.returncode == 0, r.stderr
+    assert r.stdout.strip().endswith("ok")
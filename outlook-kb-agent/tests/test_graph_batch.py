@@ -0,0 +1,75 @@
+# test_graph_batch.py — JSON $batch: loturile de cel mult GRAPH_BATCH_MAX sub-cereri (lanțurile dependsOn
+# rămân împreună, în ordine) și rundele de retry ale BatchRun (429 + dependenții 424 ai cererilor retrimise).
+# Rulare:  cd outlook-kb-agent && python -m pytest -q tests
+
+import sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import kb_mail
+from kb_mail import GRAPH_BATCH_MAX, BatchRun, RetryPolicy, batch_chunks
+
+def req(rid, *depends, method="POST"):
+    r = {"id": rid, "method": method, "url": f"/me/messages/{rid}/createReply"}
+    if depends: r["dependsOn"] = list(depends)
+    return r
+
+def ids(chunks):
+    return [[r["id"] for r in c] for c in chunks]
+
+def test_chunks_respect_limit_and_order():
+    reqs = [req(str(k)) for k in range(GRAPH_BATCH_MAX * 2 + 3)]
+    chunks = batch_chunks(reqs)
+    assert [len(c) for c in chunks] == [GRAPH_BATCH_MAX, GRAPH_BATCH_MAX, 3]
+    assert [r for c in chunks for r in c] == reqs
+
+def test_depends_on_chain_stays_in_one_chunk():
+    # 18 independente, apoi un lanț de 3 => lanțul nu încape în primul lot și trece întreg în al doilea
+    reqs = [req(f"x{k}") for k in range(GRAPH_BATCH_MAX - 2)] + [req("a"), req("b", "a"), req("c", "b")]
+    chunks = batch_chunks(reqs)
+    assert ids(chunks)[1] == ["a", "b", "c"]
+
+def test_request_joining_two_chains():
+    reqs = [req("a"), req("x"), req("b", "a"), req("y", "x"), req("z", "b", "y")]
+    assert ids(batch_chunks(reqs)) == [["a", "b", "x", "y", "z"]]
+
+def test_chain_longer_than_limit_fails():
+    reqs = [req("0")] + [req(str(k), str(k - 1)) for k in range(1, GRAPH_BATCH_MAX + 1)]
+    with pytest.raises(ValueError):
+        batch_chunks(reqs)
+
+def test_throttled_round_retries_dependents():
+    run = BatchRun([req("a"), req("b", "a"), req("c")], RetryPolicy(backoff_base=0))
+    delay = run.absorb([
+        {"id": "a", "status": 429, "headers": {"retry-after": "3"}},
+        {"id": "b", "status": 424},
+        {"id": "c", "status": 201, "body": {"id": "draft-c"}},
+    ])
+    assert delay == 3 and run.throttled
+    assert [r["id"] for r in run.pending] == ["a", "b"]   # b a eșuat doar din cauza lui a
+    assert set(run.results) == {"c"}
+
+    assert run.absorb([{"id": "a", "status": 201}, {"id": "b", "status": 201}]) is None
+    assert {k: v["status"] for k, v in run.results.items()} == {"a": 201, "b": 201, "c": 201}
+
+def test_non_idempotent_5xx_is_final():
+    run = BatchRun([req("a")], RetryPolicy(backoff_base=0))
+    assert run.absorb([{"id": "a", "status": 503}]) is None
+    assert run.results["a"]["status"] == 503 and not run.throttled
+
+def test_graph_batch_resends_throttled_requests(monkeypatch):
+    rounds = []
+    def fake_post(path, headers=None, data=None):
+        rounds.append([r["id"] for r in data["requests"]])
+        if len(rounds) == 1:
+            return {"responses": [{"id": "a", "status": 429, "headers": {"Retry-After": "0"}}, {"id": "b", "status": 201}]}
+        return {"responses": [{"id": "a", "status": 201}]}
+    monkeypatch.setattr(kb_mail, "graph_post", fake_post)
+    monkeypatch.setattr(kb_mail.get_transport(), "backoff_base", 0)
+    results = kb_mail.graph_batch([req("a"), req("b")])
+    assert rounds == [["a", "b"], ["a"]]
+    assert {k: v["status"] for k, v in results.items()} == {"a": 201, "b": 201}
@@ -0,0 +1,78 @@
+# test_map_reduce.py — planul map-reduce (map_reduce_plan / pack_chunks): loturi sub LLM_CHUNK_TOKENS,
+# cel mai nou primul, și firul unic peste buget (plan_threads îl pune direct) împărțit pe mesaje.
+# Rulare:  cd outlook-kb-agent && python -m pytest -q tests
+
+import sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import kb_mail
+import prompt_builder
+from conversations import plan_threads
+
+BUDGET = 2000
+
+@pytest.fixture(autouse=True)
+def small_budget(monkeypatch):
+    monkeypatch.setattr(kb_mail, "LLM_CHUNK_TOKENS", BUDGET)
+    monkeypatch.setattr(prompt_builder, "LLM_CHUNK_TOKENS", BUDGET)
+
+def message(k, words=250, conversation=None):
+    """Mesajul k (k mai mare = mai nou), cu un body fără rânduri comune cu celelalte."""
+    body = " ".join(f"punct{k}x{w}" for w in range(words))
+    return {"id": f"m{k}", "conversationId": conversation or f"c{k}", "subject": f"Oferta {k}",
+            "receivedDateTime": f"2026-03-{k:02d}T10:00:00Z",
+            "from": {"emailAddress": {"address": "ana@firma.ro"}}, "toRecipients": [{"emailAddress": {"address": "eu@firma.ro"}}],
+            "body": {"contentType": "text", "content": body}}
+
+def tokens(x):
+    return kb_mail.count_tokens(kb_mail.payload_json(x))
+
+def test_small_payload_is_one_call():
+    payload = kb_mail.emails_payload(kb_mail.summary_base("ana@firma.ro"), [message(k, words=20) for k in (3, 2, 1)])
+    assert kb_mail.map_reduce_plan(payload) is None
+
+def test_chunks_stay_under_budget_newest_first():
+    msgs = [message(k) for k in range(20, 0, -1)]   # ordinea lui fetch_last_messages: cel mai nou primul
+    payload = kb_mail.emails_payload(kb_mail.summary_base("ana@firma.ro"), msgs)
+    parts, reduce_payload = kb_mail.map_reduce_plan(payload)
+
+    assert len(parts) > 1
+    assert [p["part"] for p in parts] == list(range(1, len(parts) + 1))
+    assert all(p["parts"] == len(parts) and p["task"] == "extract_notes" for p in parts)
+    assert all(tokens(p["emails"]) <= BUDGET for p in parts)
+    assert [e for p in parts for e in p["emails"]] == payload["emails"]   # nimic pierdut, ordinea păstrată
+
+    final = reduce_payload([f"note {p['part']}" for p in parts])
+    assert final["emails_count"] == 20
+    assert [n["notes"] for n in final["batch_notes"]] == [f"note {p['part']}" for p in parts]
+    assert final["newest"]["i"] == 1 and "snippet" not in final["newest"]
+    assert "emails" not in final
+
+def test_oversize_item_is_trimmed_to_budget():
+    item = {"i": 1, "snippet": "x " * 20000}
+    (chunk,), = kb_mail.pack_chunks([item], 500)
+    assert len(chunk["snippet"]) < len(item["snippet"])
+    assert tokens(chunk) <= 500
+
+def test_single_thread_over_budget_is_split_by_message():
+    msgs = [message(k, conversation="c-unic") for k in range(1, 21)]
+    payload, jobs = plan_threads(kb_mail.summary_base("ana@firma.ro"), msgs)
+    assert not jobs and len(payload["threads"]) == 1
+    thread = payload["threads"][0]
+
+    parts, reduce_payload = kb_mail.map_reduce_plan(payload)
+    assert len(parts) > 1
+    assert all("threads" not in p and p["thread"]["subject"] == thread["subject"] for p in parts)
+    assert all(tokens(p["emails"]) <= BUDGET for p in parts)
+    # firul e cronologic; loturile îl iau de la cel mai nou mesaj
+    assert [e for p in parts for e in p["emails"]] == thread["emails"][::-1]
+    assert reduce_payload(["a"] * len(parts))["emails_count"] == 20
+
+def test_single_email_over_budget_is_not_split():
+    payload = kb_mail.emails_payload(kb_mail.summary_base("ana@firma.ro"), [message(1, words=3000)])
+    assert kb_mail.map_reduce_plan(payload) is None
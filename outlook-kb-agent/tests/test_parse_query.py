@@ -0,0 +1,77 @@
+# test_parse_query.py — sintaxa /search (mail_store.parse_query): fraze, from:/subject:, after:/before:
+# mereu cu fus orar (fără offset => UTC), ca să se poată compara cu `since` și cu datele din store.
+# Rulare:  cd outlook-kb-agent && python -m pytest -q tests
+
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from mail_store import MailStore, fts_match, parse_query, query_since
+
+UTC = timezone.utc
+
+def test_free_text_and_phrases():
+    q = parse_query('ofertă nouă "termen de plată" pret')
+    assert q["phrases"] == ["termen de plată", "ofertă nouă pret"]
+    assert q["sender"] is q["domain"] is q["after"] is q["before"] is None
+    assert fts_match(q) == '"termen de plată" AND "ofertă nouă pret"'
+
+def test_empty_query():
+    q = parse_query("")
+    assert q["phrases"] == [] and fts_match(q) is None
+
+@pytest.mark.parametrize("value, sender, domain", [
+    ("Ana@Firma.ro", "ana@firma.ro", None),
+    ("firma.ro", None, "firma.ro"),
+    ("@firma.ro", None, "firma.ro"),
+])
+def test_from_sender_or_domain(value, sender, domain):
+    q = parse_query(f"from:{value}")
+    assert (q["sender"], q["domain"]) == (sender, domain)
+    assert q["phrases"] == []
+
+def test_subject_and_unknown_operator():
+    q = parse_query('subject:"oferta revizuita" subject:factura cc:ion@firma.ro')
+    assert q["subject"] == ["oferta revizuita", "factura"]
+    assert q["phrases"] == ["cc:ion@firma.ro"]   # operator necunoscut => text liber
+    assert fts_match(q) == '"cc:ion@firma.ro" AND subject : "oferta revizuita" AND subject : "factura"'
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-01-31", datetime(2024, 1, 31, tzinfo=UTC)),
+    ("2024-01-31T08:30", datetime(2024, 1, 31, 8, 30, tzinfo=UTC)),
+    ("2024-01-31T08:30:00Z", datetime(2024, 1, 31, 8, 30, tzinfo=UTC)),
+    ("2024-01-31T10:30:00+02:00", datetime(2024, 1, 31, 8, 30, tzinfo=UTC)),
+])
+def test_dates_are_aware(value, expected):
+    q = parse_query(f"after:{value} before:{value}")
+    assert q["after"] == expected and q["after"].tzinfo is not None
+    assert q["before"] == expected and q["before"].tzinfo is not None
+
+def test_invalid_date_stays_text():
+    q = parse_query("after:ieri raport")
+    assert q["after"] is None
+    assert q["phrases"] == ["after:ieri raport"]
+
+def test_query_since_takes_the_later_bound():
+    since = datetime(2024, 2, 1, tzinfo=UTC)
+    assert query_since(parse_query("raport"), since) == since
+    assert query_since(parse_query("after:2024-03-01"), since) == datetime(2024, 3, 1, tzinfo=UTC)
+    assert query_since(parse_query("after:2024-01-01"), since) == since
+    assert query_since(parse_query("raport")) is None
+    # cutoff-ul din kb_mail (ultimele N zile) e aware: comparația cu after: fără offset nu trebuie să crape
+    recent = datetime.now(UTC) - timedelta(days=7)
+    assert query_since(parse_query("after:2000-01-01"), recent) == recent
+
+def test_store_filters_by_date(tmp_path):
+    store = MailStore(str(tmp_path / "store.sqlite3"))
+    for k, when in enumerate(("2024-01-15T09:00:00Z", "2024-02-15T09:00:00Z", "2024-03-15T09:00:00Z"), 1):
+        store.upsert("inbox", {"id": f"m{k}", "subject": f"Raport {k}", "receivedDateTime": when,
+                               "from": {"emailAddress": {"address": "ana@firma.ro"}},
+                               "body": {"contentType": "text", "content": "raport lunar"}})
+    found = store.search(parse_query("raport after:2024-02-01 before:2024-03-01T00:00+02:00 from:firma.ro"))
+    assert [m["id"] for m in found] == ["m2"]
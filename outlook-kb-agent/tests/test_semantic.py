@@ -0,0 +1,64 @@
+# test_semantic.py — căutarea semantică/hibridă peste un MailStore temporar (embedder hashing, offline):
+# formele flexionare se potrivesc, filtrele se aplică peste candidați, iar fuziunea RRF păstrează rezultatele FTS.
+# Rulare:  cd outlook-kb-agent && python -m pytest -q tests   (sărit fără numpy)
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("numpy")
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import semantic
+from mail_store import MailStore
+
+MESSAGES = [
+    ("m1", "ana@firma.ro", "Factura ianuarie", "trimitem factura pentru luna ianuarie"),
+    ("m2", "ion@client.ro", "Intalnire", "ne vedem marti la birou pentru proiect"),
+    ("m3", "ana@firma.ro", "Oferta", "renegotiation of the price quote for the project"),
+    ("m4", "dan@client.ro", "Proiect", "proiect proiect: stadiul lucrarilor si planul pe luna viitoare"),
+]
+
+@pytest.fixture
+def store(tmp_path):
+    store = MailStore(str(tmp_path / "store.sqlite3"))
+    for k, (mid, sender, subject, body) in enumerate(MESSAGES, 1):
+        store.upsert("inbox", {"id": mid, "subject": subject, "receivedDateTime": f"2026-01-0{k}T10:00:00Z",
+                               "from": {"emailAddress": {"address": sender}},
+                               "body": {"contentType": "text", "content": body}})
+    return store
+
+def ids(found):
+    return [m["id"] for m in found]
+
+def test_inflected_form_matches(store):
+    assert ids(semantic.semantic_search(store, "facturii", top=1)) == ["m1"]
+    assert ids(semantic.semantic_search(store, "renegotiate price", top=1)) == ["m3"]
+
+def test_filters_apply_to_candidates(store):
+    assert set(ids(semantic.semantic_search(store, "proiect from:client.ro", top=5))) <= {"m2", "m4"}
+
+class FakeIndex:
+    """Rangul semantic fixat de test (SemanticIndex.ranked dă loturi [(message_id, scor)])."""
+    def __init__(self, order): self.order = order
+    def refresh(self): return 0
+    def ranked(self, text, first=20): yield [(mid, 1.0 - k / 10) for k, mid in enumerate(self.order)]
+
+def hybrid(store, monkeypatch, semantic_order, keyword_order, weight, top):
+    monkeypatch.setattr(semantic, "get_semantic_index", lambda st: FakeIndex(semantic_order))
+    by_id = store.by_ids(keyword_order, semantic.parse_query(""), None, None)
+    monkeypatch.setattr(store, "search", lambda q, **kw: [by_id[mid] for mid in keyword_order])
+    monkeypatch.setattr(semantic, "SEMANTIC_HYBRID_WEIGHT", weight)
+    return ids(semantic.semantic_search(store, "proiect", top=top, mode="hybrid"))
+
+def test_rrf_fuses_both_rankings(store, monkeypatch):
+    # m1: 1/60 + 1/61 (în ambele); m3: 1/60 (doar FTS) > m2: 1/61 (doar semantic)
+    assert hybrid(store, monkeypatch, ["m1", "m2"], ["m3", "m1"], 0.5, top=3) == ["m1", "m3", "m2"]
+    assert hybrid(store, monkeypatch, ["m1", "m2"], ["m3", "m1"], 0.5, top=2) == ["m1", "m3"]
+
+@pytest.mark.parametrize("weight, expected", [(1.0, ["m2", "m1"]), (0.0, ["m4", "m3"])])
+def test_rrf_weight_extremes(store, monkeypatch, weight, expected):
+    assert hybrid(store, monkeypatch, ["m2", "m1"], ["m4", "m3"], weight, top=2) == expected
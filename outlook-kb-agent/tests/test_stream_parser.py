@@ -0,0 +1,53 @@
+# test_stream_parser.py — JsonStreamParser: valorile string de pe primul nivel, decodate incremental,
+# oricum ar fi tăiat răspunsul modelului în chunk-uri; stream_result păstrează ce s-a decodat dacă JSON-ul e stricat.
+# Rulare:  cd outlook-kb-agent && python -m pytest -q tests
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from kb_mail import JsonStreamParser, stream_result
+
+RESPONSE = "```json\n" + json.dumps({
+    "summary": "Ana cere \"oferta\" revizuită\nTermen: vineri \\ 12:00 🙂",
+    "meta": {"tags": ["a", "}"], "n": 2},
+    "draft_html": "<p>Bună ziua,</p>\t<p>Revin până vineri.</p>",
+}) + "\n```"
+EXPECTED = {"summary": "Ana cere \"oferta\" revizuită\nTermen: vineri \\ 12:00 🙂",
+            "draft_html": "<p>Bună ziua,</p>\t<p>Revin până vineri.</p>"}
+
+def feed_all(parser, chunks):
+    got = {}
+    for ch in chunks:
+        for key, delta in parser.feed(ch):
+            got[key] = got.get(key, "") + delta
+    return got
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, len(RESPONSE)])
+def test_any_chunking_gives_same_values(size):
+    parser = JsonStreamParser()
+    got = feed_all(parser, [RESPONSE[k:k + size] for k in range(0, len(RESPONSE), size)])
+    assert got == EXPECTED
+    assert parser.values == EXPECTED
+
+def test_escape_split_between_chunks():
+    parser = JsonStreamParser()
+    assert feed_all(parser, ['{"summary": "a\\', 'u00e', '2b\\ud83d', '\\ude42"}']) == {"summary": "aâb🙂"}
+
+def test_truncated_response_keeps_decoded_text():
+    cut = RESPONSE[:RESPONSE.index("Revin")]
+    parser = JsonStreamParser()
+    parser.feed(cut)
+    out = stream_result(cut, parser, ("summary", "draft_html"))
+    assert out == {"summary": EXPECTED["summary"], "draft_html": "<p>Bună ziua,</p>\t<p>"}
+
+def test_nothing_decoded_is_an_error():
+    parser = JsonStreamParser()
+    parser.feed("nu e JSON")
+    with pytest.raises(ValueError):
+        stream_result("nu e JSON", parser, ("summary", "draft_html"))
@@ -0,0 +1,34 @@
+# test_trim_email_body.py — corpusul golden al curățării body-urilor (trim_email_body)
+# fixtures/bodies/<caz>.html = body-ul Graph, <caz>.txt = rezultatul implementării anterioare (BeautifulSoup
+# html.parser + RE_QUOTED/RE_SIGNATURE, max 8000 caractere). Extractorul streaming trebuie să dea exact același text.
+# Rulare:  cd outlook-kb-agent && python -m pytest -q tests
+
+import sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+import kb_mail
+
+BODIES = HERE / "fixtures" / "bodies"
+CASES = sorted(p.stem for p in BODIES.glob("*.html"))
+
+@pytest.fixture(autouse=True)
+def legacy_budget(monkeypatch):
+    monkeypatch.setattr(kb_mail, "BODY_CHAR_BUDGET", 8000)   # bugetul implementării din care provin fișierele .txt
+
+@pytest.mark.parametrize("case", CASES)
+def test_matches_golden(case):
+    raw = (BODIES / f"{case}.html").read_text(encoding="utf-8")
+    expected = (BODIES / f"{case}.txt").read_text(encoding="utf-8")
+    assert kb_mail.trim_email_body(raw) == expected
+
+def test_corpus_covers_required_cases():
+    assert {"blockquote_style_script", "signature_dashes", "quoted_reply_outlook", "oversize_newsletter"} <= set(CASES)
+
+def test_oversize_stops_at_budget():
+    raw = (BODIES / "oversize_newsletter.html").read_text(encoding="utf-8")
+    assert len(kb_mail.trim_email_body(raw)) == 8000
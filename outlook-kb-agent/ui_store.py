@@ -0,0 +1,165 @@
+# ui_store.py — starea UI-ului comună workerilor uvicorn/gunicorn (SQLite WAL)
+# Un job rulează în workerul care a primit cererea, dar pagina și SSE-ul lui pot ajunge la oricare alt worker:
+# evenimentele se scriu și aici, iar ceilalți workeri le citesc (polling scurt) prin JobView.
+# Tot aici: dedupe-ul între workeri (un job în lucru per cheie; jobul unui proces mort e închis la următoarea
+# cerere identică) și conturile dovedite de fiecare sesiune de browser (UI_SERVER_MODE).
+# Fără UI_STORE_PATH store-ul e în memorie: un singur proces, joburile rămân doar în app.py.
+#
+# .env (opțional):
+#   UI_STORE_PATH=.ui_store.sqlite3   # obligatoriu cu mai mulți workeri (uvicorn --workers N)
+
+import asyncio, json, os, sqlite3, threading, time
+
+UI_STORE_PATH = os.getenv("UI_STORE_PATH", "")
+EVENT_POLL = 0.2   # secunde între citirile unui job din alt worker
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    title TEXT NOT NULL,
+    session TEXT,
+    pid INTEGER NOT NULL,
+    created REAL NOT NULL,
+    done_at REAL,
+    trace TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_inflight ON jobs(key) WHERE done_at IS NULL;
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT NOT NULL,
+    login TEXT NOT NULL,
+    since REAL NOT NULL,
+    PRIMARY KEY (session, login)
+) WITHOUT ROWID;
+"""
+
+def _alive(pid) -> bool:
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except OSError: return True   # există, dar al altui utilizator
+    return True
+
+class JobView:
+    """Un job din alt worker, cu aceeași interfață de citire ca app.Job (events_from / wait / trace_data)."""
+    def __init__(self, store, job_id, title, session):
+        self.store, self.id, self.title, self.session = store, job_id, title, session
+
+    def events_from(self, i) -> list:
+        return self.store.events_from(self.id, i)
+
+    async def wait(self, i, timeout) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(EVENT_POLL)
+            if self.store.has_events(self.id, i): return True
+        return False
+
+    def trace_data(self):
+        return self.store.trace(self.id)
+
+class UiStore:
+    """Joburi, evenimente și sesiuni; thread-safe (o conexiune SQLite WAL + lock), ca WatermarkStore."""
+    def __init__(self, path=UI_STORE_PATH):
+        self.path, self.shared = path or ":memory:", bool(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        if self.shared:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")   # stare efemeră: durabilitatea la crash nu contează
+        self.db.executescript(SCHEMA)
+
+    # ---------- joburi ----------
+    def claim(self, job_id, key, title, session) -> str:
+        """
+        Înregistrează jobul și întoarce id-ul lui, sau id-ul jobului identic deja în lucru în alt proces viu.
+        Jobul rămas în lucru de la un proces mort e marcat terminat (cu un eveniment "done") și înlocuit.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT id, pid FROM jobs WHERE key = ? AND done_at IS NULL", (key,)).fetchone()
+                if row and _alive(row[1]):
+                    self.db.execute("COMMIT"); return row[0]
+                if row:
+                    self._append(row[0], {"event": "done", "target": "body",
+                                          "html": "<p class='err'>Workerul care rula jobul s-a oprit.</p>"})
+                    self.db.execute("UPDATE jobs SET done_at = ? WHERE id = ?", (now, row[0]))
+                self.db.execute("INSERT INTO jobs(id, key, title, session, pid, created) VALUES (?, ?, ?, ?, ?, ?)",
+                                (job_id, key, title, session, os.getpid(), now))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK"); raise
+        return job_id
+
+    def _append(self, job_id, event):
+        self.db.execute("INSERT INTO job_events(job_id, seq, data) SELECT ?, COALESCE(MAX(seq) + 1, 0), ? "
+                        "FROM job_events WHERE job_id = ?", (job_id, json.dumps(event, ensure_ascii=False), job_id))
+
+    def append(self, job_id, event):
+        with self.lock:
+            self._append(job_id, event)
+
+    def finish(self, job_id, trace=None):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET done_at = ?, trace = ? WHERE id = ?",
+                            (time.time(), json.dumps(trace, ensure_ascii=False) if trace else None, job_id))
+
+    def events_from(self, job_id, i) -> list:
+        with self.lock:
+            rows = self.db.execute("SELECT data FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, i)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def has_events(self, job_id, i) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM job_events WHERE job_id = ? AND seq >= ? LIMIT 1", (job_id, i)).fetchone() is not None
+
+    def trace(self, job_id):
+        with self.lock:
+            row = self.db.execute("SELECT trace FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def view(self, job_id):
+        with self.lock:
+            row = self.db.execute("SELECT title, session FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return JobView(self, job_id, *row) if row else None
+
+    def purge(self, ttl):
+        """Joburile terminate de mai mult de `ttl` secunde, cu evenimentele lor."""
+        cutoff = time.time() - ttl
+        with self.lock:
+            self.db.execute("DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE done_at < ?)", (cutoff,))
+            self.db.execute("DELETE FROM jobs WHERE done_at < ?", (cutoff,))
+
+    # ---------- sesiuni ----------
+    def allowed(self, session, login) -> bool:
+        """Sesiunea a dovedit deja (login în UI) că deține contul?"""
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM sessions WHERE session = ? AND login = ?",
+                                   (session, (login or "").strip().lower())).fetchone() is not None
+
+    def allow(self, session, login):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO sessions(session, login, since) VALUES (?, ?, ?)",
+                            (session, (login or "").strip().lower(), time.time()))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+_ui_store = None
+_ui_store_lock = threading.Lock()
+
+def get_ui_store() -> UiStore:
+    global _ui_store
+    if _ui_store is None:
+        with _ui_store_lock:
+            if _ui_store is None:
+                _ui_store = UiStore()
+    return _ui_store
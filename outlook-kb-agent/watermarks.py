@@ -0,0 +1,179 @@
+# watermarks.py — rezumat incremental „de la ultimul rezumat” (kb_mail.py --since-last, digest, UI)
+# Per interogare (expeditor/domeniu + folder) păstrăm watermark-ul: receivedDateTime-ul celui mai nou
+# mesaj văzut, id-urile mesajelor de la acea limită și rezumatul/draft-ul anterior. La re-rulare aducem
+# din Graph/store doar mesajele mai noi (receivedDateTime ge watermark, fără id-urile deja văzute);
+# fără noutăți => rezumatul salvat, fără niciun apel LLM; cu noutăți => LLM-ul actualizează rezumatul
+# anterior pe baza mesajelor noi, în loc să re-citească tot istoricul. Cheile sunt per cont (login-ul token-ului).
+#
+# După prima rulare nu ne oprim la `top`: paginăm (nextLink) până la watermark, altfel mesajele mai vechi decât
+# primele `top` ar fi sărite definitiv (watermark-ul trece de ele); plafonul SINCE_LAST_MAX e semnalat ("capped").
+#
+# .env (opțional):
+#   WATERMARK_PATH=.watermarks.sqlite3
+#   SINCE_LAST_MAX=500   # mesaje noi aduse cel mult la o actualizare
+
+import json, os, sqlite3, threading, time
+from datetime import datetime
+
+from kb_mail import BASE_DIR, PAYLOAD_LEGEND, SYSTEM_PROMPT, TZ_NAME, _build_payload, _summarize, fetch_last_messages, summary_base, token_account
+
+WATERMARK_PATH = os.getenv("WATERMARK_PATH", str(BASE_DIR / ".watermarks.sqlite3"))
+SINCE_LAST_MAX = int(os.getenv("SINCE_LAST_MAX", "500"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    key TEXT PRIMARY KEY,
+    last_received TEXT NOT NULL,
+    seen_ids TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    draft_html TEXT,
+    newest_id TEXT,
+    updated REAL NOT NULL
+);
+"""
+
+UPDATE_SYSTEM_PROMPT = f"""Esti un asistent de email concis, precis, fara emoticoane.
+Primesti rezumatul anterior al corespondentei ("previous_summary", valabil la "previous_as_of") si DOAR emailurile sosite de atunci.
+1) Actualizeaza rezumatul in 4-8 bullet-uri: pastreaza ce e inca valabil, marcheaza ce s-a rezolvat sau s-a schimbat, adauga noutatile (cerinte, blocaje, termene, cifre).
+2) Redactezi un draft de raspuns business la cel mai nou email: 2 paragrafe scurte + lista next steps numerotata. Ton: ferm, politicos.
+3) Daca lipsesc atasamente sau info, cere-le explicit.
+{PAYLOAD_LEGEND}
+Returneaza JSON cu cheile: summary (string Markdown), draft_html (string HTML).
+"""
+
+def watermark_key(sender=None, domain=None, folder_id=None, account=None) -> str:
+    """Cheia interogarii; cu `account` (login) prefixata de cont, ca doi utilizatori sa nu-si vada rezumatele."""
+    kind, value = ("sender", sender) if sender else ("domain", domain)
+    return f"{account + '/' if account else ''}{kind}:{(value or '').strip().lower()}|{folder_id or ''}"
+
+def _parse(ts):
+    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+def _received(m):
+    return _parse(m["receivedDateTime"])
+
+class WatermarkStore:
+    """Watermark-urile per interogare, thread-safe (o conexiune SQLite WAL + lock)."""
+    def __init__(self, path=WATERMARK_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)   # timeout: alti workeri scriu in acelasi fisier
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT last_received, seen_ids, summary, draft_html, newest_id, updated "
+                                  "FROM watermarks WHERE key = ?", (key,)).fetchone()
+        if row is None: return None
+        return {"last_received": row[0], "seen_ids": json.loads(row[1]), "summary": row[2],
+                "draft_html": row[3], "newest_id": row[4], "updated": row[5]}
+
+    def put(self, key, messages, summary, draft_html, previous=None):
+        """
+        Watermark nou = cel mai nou receivedDateTime dintre `messages` (si cel anterior). Se pastreaza
+        doar id-urile de la limita exacta: filtrul e `ge`, deci numai ele pot reveni la urmatoarea rulare.
+        """
+        seen = [(m["receivedDateTime"], m["id"]) for m in messages if m.get("receivedDateTime")]
+        if previous: seen += [(previous["last_received"], i) for i in previous["seen_ids"]]
+        last = max(seen, key=lambda s: _parse(s[0]))[0]
+        ids = sorted({i for r, i in seen if _parse(r) == _parse(last)})
+        newest = max(messages, key=_received)["id"] if messages else (previous or {}).get("newest_id")
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO watermarks(key, last_received, seen_ids, summary, draft_html, newest_id, updated) "
+                            "VALUES (?,?,?,?,?,?,?)", (key, last, json.dumps(ids), summary, draft_html, newest, time.time()))
+            self.db.commit()
+
+    def delete(self, key):
+        with self.lock:
+            self.db.execute("DELETE FROM watermarks WHERE key = ?", (key,))
+            self.db.commit()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_watermarks():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = WatermarkStore()
+    return _store
+
+# ---------- logica comuna sync/async ----------
+def fresh_messages(wm, msgs):
+    """Mesajele aduse cu since=watermark, fara cele deja vazute la limita."""
+    seen = set(wm["seen_ids"]) if wm else set()
+    return [m for m in msgs if m["id"] not in seen]
+
+def update_base(wm, sender_hint, tone, propose_slot, timezone_name):
+    return {**summary_base(sender_hint, tone, propose_slot, timezone_name), "task": "update_summary",
+            "previous_summary": wm["summary"], "previous_as_of": wm["last_received"]}
+
+def _result(summary, draft_html, new_messages, newest_id, incremental, capped=False):
+    return {"summary": summary, "draft_html": draft_html, "new_messages": new_messages,
+            "newest_id": newest_id, "incremental": incremental, "capped": capped}
+
+def _since(wm):
+    return _parse(wm["last_received"]) if wm else None
+
+def _limit(wm, top):
+    """Prima rulare: ultimele `top`; apoi tot ce a sosit de la watermark (paginat pana la el), cel mult SINCE_LAST_MAX."""
+    return top if wm is None else max(top, SINCE_LAST_MAX)
+
+def capped(wm, msgs) -> bool:
+    """Plafonul atins: pot exista mesaje sosite dupa watermark, mai vechi decat cele aduse, care raman nerezumate."""
+    return wm is not None and len(msgs) >= SINCE_LAST_MAX
+
+def _plan(wm, hint, tone, slot):
+    """(system_prompt, base): prima rulare = rezumatul complet; altfel actualizarea celui anterior."""
+    if wm is None: return SYSTEM_PROMPT, summary_base(hint, tone, slot, TZ_NAME)
+    return UPDATE_SYSTEM_PROMPT, update_base(wm, hint, tone, slot, TZ_NAME)
+
+def summarize_since_last(token, sender=None, domain=None, top=5, days=None, folder_id=None, tone="brief-firm",
+                         slot=None, use_cache=True, by_thread=True) -> dict:
+    """
+    {summary, draft_html, new_messages, newest_id, incremental}. Prima rulare = rezumat complet;
+    urmatoarele aduc doar mesajele noi. new_messages == 0 => rezumatul anterior, fara apel LLM.
+    """
+    store, key, hint = get_watermarks(), watermark_key(sender, domain, folder_id, token_account(token)), sender or domain
+    wm = store.get(key)
+    msgs = fresh_messages(wm, fetch_last_messages(token, sender=sender, domain=domain, top=_limit(wm, top), folder_id=folder_id,
+                                                  days=days, since=_since(wm)))
+    if not msgs:
+        return _result(wm["summary"], wm["draft_html"], 0, wm["newest_id"], True) if wm else _result(None, None, 0, None, False)
+    prompt, base = _plan(wm, hint, tone, slot)
+    data = _summarize(prompt, _build_payload(base, msgs, by_thread, use_cache), use_cache=use_cache)
+    store.put(key, msgs, data["summary"], data["draft_html"], wm)
+    return _result(data["summary"], data["draft_html"], len(msgs), max(msgs, key=_received)["id"], wm is not None, capped(wm, msgs))
+
+async def afresh_since_last(token, sender=None, domain=None, top=5, days=None, folder_id=None):
+    """(key, watermark | None, mesajele noi) — partea de fetch a variantei async."""
+    import asyncio
+    from kb_async import afetch_last_messages
+    key = watermark_key(sender, domain, folder_id, token_account(token))
+    wm = await asyncio.to_thread(get_watermarks().get, key)
+    msgs = await afetch_last_messages(token, sender=sender, domain=domain, top=_limit(wm, top), folder_id=folder_id, days=days, since=_since(wm))
+    return key, wm, fresh_messages(wm, msgs)
+
+async def asummarize_since_last(token, sender=None, domain=None, top=5, days=None, folder_id=None, tone="brief-firm",
+                                slot=None, use_cache=True, by_thread=True) -> dict:
+    """Varianta async (--batch): aceeasi logica peste afetch_last_messages / asummarize."""
+    import asyncio
+    from kb_async import _abuild_payload, asummarize
+    key, wm, msgs = await afresh_since_last(token, sender, domain, top, days, folder_id)
+    if not msgs:
+        return _result(wm["summary"], wm["draft_html"], 0, wm["newest_id"], True) if wm else _result(None, None, 0, None, False)
+    prompt, base = _plan(wm, sender or domain, tone, slot)
+    data = await asummarize(prompt, await _abuild_payload(base, msgs, by_thread, use_cache), use_cache=use_cache)
+    await asyncio.to_thread(get_watermarks().put, key, msgs, data["summary"], data["draft_html"], wm)
+    return _result(data["summary"], data["draft_html"], len(msgs), max(msgs, key=_received)["id"], wm is not None, capped(wm, msgs))
+
+async def astream_since_last(key, wm, msgs, hint=None, tone="brief-firm", slot=None, use_cache=True, by_thread=True):
+    """Rezumatul (complet sau actualizat) streamuit ca astream_summarize; watermark-ul se salveaza la final."""
+    import asyncio
+    from kb_async import _abuild_payload, astream_summarize
+    prompt, base = _plan(wm, hint, tone, slot)
+    async for k, v in astream_summarize(prompt, await _abuild_payload(base, msgs, by_thread, use_cache), use_cache=use_cache):
+        if k is None: await asyncio.to_thread(get_watermarks().put, key, msgs, v["summary"], v["draft_html"], wm)
+        yield k, v